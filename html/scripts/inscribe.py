@@ -25,6 +25,7 @@ Stylus, Copyright 2006-2008 Biologic Institute.
 import datetime
 import fnmatch
 import getopt
+import hashlib
 import os
 import random
 import re
@@ -32,7 +33,14 @@ import shutil
 import string
 import stylus.codons as Codons
 import stylus.common as Common
+import stylus.diskcache as DiskCache
+import stylus.fetch as Fetch
+import stylus.genearchive as GeneArchive
 import stylus.genome as Genome
+import stylus.hanarchive as HanArchive
+import stylus.hancache as HanCache
+import stylus.hanstore as HanStore
+import stylus.intersect as Intersect
 import sys
 import time
 import urllib2
@@ -45,13 +53,21 @@ import uuid
 _VERSION = '1.0'
 _NAME = 'inscribe.py %s' % _VERSION
 
-_HAN_DEFINITION = '''<?xml version='1.0' standalone='no'?>
+# Han and gene definitions are written in pieces (see writeHan and buildGenes); each template
+# below holds the text surrounding the repeated elements it encloses (Han numbers are
+# formatted by formatNumber)
+_HAN_DEFINITION_START = '''<?xml version='1.0' standalone='no'?>
+<!-- inputs sha1:%s -->
 <hanDefinition uuid='%s' unicode='%s' creationDate='%s' creationTool='%s' xmlns='http://biologicinstitute.org/schemas/stylus/1.0'>
 <bounds %s />
-<length>%r</length>
-<minimumStrokeLength>%r</minimumStrokeLength>
-<groups>%s</groups>
-<strokes>%s</strokes>
+<length>%s</length>
+<minimumStrokeLength>%s</minimumStrokeLength>
+<groups>'''
+
+_HAN_DEFINITION_STROKES = '''</groups>
+<strokes>'''
+
+_HAN_DEFINITION_END = '''</strokes>
 %s
 </hanDefinition>
 '''
@@ -59,30 +75,37 @@ _HAN_DEFINITION = '''<?xml version='1.0' standalone='no'?>
 _HAN_GROUP = '''
 <group>
 <bounds %s />
-<length>%r</length>
-<weightedCenter x='%r' y='%r' />
+<length>%s</length>
+<weightedCenter x='%s' y='%s' />
 <containedStrokes>%s</containedStrokes>
 </group>
 '''
 
-_HAN_STROKE = '''
+_HAN_STROKE_START = '''
 <stroke>
 <bounds %s />
-<length>%r</length>
+<length>%s</length>
 <points>
-<forward>%s</forward>
-<reverse>%s</reverse>
+<forward>'''
+
+_HAN_STROKE_REVERSE = '''</forward>
+<reverse>'''
+
+_HAN_STROKE_END = '''</reverse>
 </points>
 </stroke>
 '''
 
-_HAN_POINT = '''<pointDistance x='%r' y='%r' fractionalDistance='%r' />'''
+_HAN_POINT = '''<pointDistance x='%s' y='%s' fractionalDistance='%s' />'''
 
 _HAN_OVERLAP = '''<overlap firstStroke='%d' secondStroke='%d' required='%s' />'''
 
-_GENE_DEFINITION = '''<?xml version='1.0' encoding='UTF-8' ?>
+_GENE_DEFINITION_START = '''<?xml version='1.0' encoding='UTF-8' ?>
+<!-- inputs sha1:%s -->
 <genome uuid='%s' %s creationDate='%s' creationTool='%s' creationParameters='%s' xmlns='http://biologicinstitute.org/schemas/stylus/1.0'>
-<bases>%s</bases>
+<bases>'''
+
+_GENE_DEFINITION_END = '''</bases>
 <genes>
 <gene baseFirst='1' baseLast='%d'>
 <origin x='%r' y='%r' />
@@ -111,6 +134,20 @@ class Globals:
     aryGenes = []
     strGenePath = ''
     urlHan = ''
+    hanArchive = None
+    hanCache = None
+    hanMirror = None
+    hanStore = None
+    urlHanStore = ''
+    fSync = False
+    fCompress = False
+    geneArchive = None
+    strSeed = ''
+    fForce = False
+    cWritten = 0
+    cSkipped = 0
+    nDigits = None
+    nFractionDigits = None
     strAuthor = ''
 Common.Globals.fQuiet = True
 
@@ -129,9 +166,17 @@ class Usage(Common.BiologicError):
 \t[(-g|--gene) <gene parameters>|default] - Parameters used to form the gene
 
 \t[(-o|--output)=<output path>] - The path for gene files
+\t[(-p|--pack) <archive path>[,<MB per archive>]] - Add genes to a zip archive (or, given a size, a series of
+\t\tarchives) indexed by gene name, rather than writing gene files
 \t[(-u|--urls) [<Han URL>]] - Set the URLs
 
 \t[-a|--author] - Gene author name
+\t[-s|--sync] - Flush written files to disk before replacing existing files
+\t[-z|--gzip] - Write gzip-compressed Han and gene files (.han.gz, .gene.gz)
+\t[--seed=<seed>] - Seed the random choices made for each gene (from the seed, Unicode, and specification)
+\t[-f|--force] - Rebuild Han and gene files even when their inputs are unchanged
+\t[--precision=<digits>[,<fraction digits>]] - Write Han numbers rounded to the given decimal places (fractional
+\t\tdistances to <digits>+2 unless given) rather than in full
 \t[-q|--quiet] - Silence all output
 \t[-h|--help] - Print this help
 
@@ -152,9 +197,19 @@ STYLUS_INSCRIBEARGS - The default argument string to parse (command-line overrid
 STYLUS_INSCRIBEOUT  - The default output path for genome files
 
 STYLUS_HANURL       - The URL from which to obtain Han definition files
+                      (or the path of a Han archive built by packHan.py)
 
 STYLUS_AUTHOR       - Gene author
 
+STYLUS_HANCACHE     - <path>[,<megabytes>] - Cache parsed Han definitions within path
+                      (limited to the given size, 64MB by default)
+
+STYLUS_HANMIRROR    - <path>[,<megabytes>[,<seconds>]] - Keep Han and HCF files fetched from an http
+                      Han URL within path (limited to the given size, 64MB by default), asking the
+                      server whether each changed only once the given number of seconds has passed
+
+STYLUS_HANSTORE     - <megabytes> - Memory kept for Han definitions loaded within a process (32MB by default)
+
 See Stylus documentation for more details.
 '''
     def __init__(self, msg):
@@ -197,6 +252,13 @@ class Constants:
     reTransform = re.compile(rstrTransform)
 
     reGroup = re.compile(r'g(\d+)\((%s)\)' % rstrTransform)
+
+    # Decimal places added, by default, to those of Han numbers for fractional distances
+    nFractionDigitsExtra = 2
+
+    # Outputs record the hash of their inputs in a comment within their first bytes
+    reInputHash = re.compile(r'<!-- inputs sha1:([\da-f]{40}) -->')
+    cbInputHash = 256
     reStroke = re.compile(r's(\d+)\((%s)\)' % rstrTransform)
     
     strDefault = 'default'
@@ -580,11 +642,21 @@ def setGlobals(aryArgs=[], strArgs=''):
     Globals.strGenePath = Common.readEnvironment('$STYLUS_INSCRIBEOUT')
     Globals.urlHan = Common.readEnvironment('$STYLUS_HANURL')
     Globals.strAuthor = Common.readEnvironment('$STYLUS_AUTHOR')
+    Globals.fSync = False
+    Globals.fCompress = False
+    Globals.strSeed = ''
+    Globals.fForce = False
+    Globals.nDigits = None
+    Globals.nFractionDigits = None
+    strHanCache = Common.readEnvironment('$STYLUS_HANCACHE')
+    strHanMirror = Common.readEnvironment('$STYLUS_HANMIRROR')
+    strHanStore = Common.readEnvironment('$STYLUS_HANSTORE')
+    strPack = ''
 
     try:
         opts, remaining = getopt.getopt(argv,
-                    'c:d:g:o:u:a:qh',
-                    [ 'code=', 'definition', 'gene=', 'output=', 'urls=', 'author=', 'quiet', 'help' ])
+                    'c:d:g:o:p:u:a:szfqh',
+                    [ 'code=', 'definition', 'gene=', 'output=', 'pack=', 'urls=', 'author=', 'sync', 'gzip', 'seed=', 'force', 'precision=', 'quiet', 'help' ])
         if len(remaining) > 0:
             remaining[0].strip()
             if len(remaining) > 1 or remaining[0]:
@@ -608,12 +680,35 @@ def setGlobals(aryArgs=[], strArgs=''):
         if option in ('-o', '--output'):
             Globals.strGenePath = value
 
+        if option in ('-p', '--pack'):
+            strPack = value
+
         if option in ('-u', '--urls'):
             Globals.urlHan = value
             
         if option in ('-a', '--author'):
             Globals.strAuthor = value
 
+        if option in ('-s', '--sync'):
+            Globals.fSync = True
+
+        if option in ('-z', '--gzip'):
+            Globals.fCompress = True
+
+        if option == '--seed':
+            Globals.strSeed = value
+
+        if option in ('-f', '--force'):
+            Globals.fForce = True
+
+        if option == '--precision':
+            aryArgs = value.split(',')
+            Globals.nDigits = Common.ensureInteger(aryArgs[0], -1, 'precision requires an integer number of decimal places')
+            Globals.nFractionDigits = Common.ensureInteger(len(aryArgs) > 1 and aryArgs[1] or '', Globals.nDigits + Constants.nFractionDigitsExtra,
+                                                            'precision requires an integer number of decimal places')
+            if Globals.nDigits < 0 or Globals.nFractionDigits < 0:
+                raise Usage(value + ' is not a valid precision')
+
         if option in ('-q', '--quiet'):
             Common.Globals.fQuiet = True
 
@@ -632,26 +727,91 @@ def setGlobals(aryArgs=[], strArgs=''):
             try: os.makedirs(Globals.strArchetypePath)
             except OSError: raise Usage('Unable to create ' + Globals.strArchetypePath)
         
-    if len(Globals.aryGenes) > 0 and not Globals.strGenePath:
+    if len(Globals.aryGenes) > 0 and not Globals.strGenePath and not strPack:
         raise Usage('Required gene output path was not specified')
 
-    if len(Globals.aryGenes) > 0:
+    if len(Globals.aryGenes) > 0 and Globals.strGenePath:
         Globals.strGenePath = Common.resolvePath(Globals.strGenePath)
         if not os.path.exists(Globals.strGenePath):
             try: os.makedirs(Globals.strGenePath)
             except OSError: raise Usage('Unable to create ' + Globals.strGenePath)
         
+    # Archive settings follow the latest call, so a different (or no) archive closes the current one
+    if strPack:
+        aryArgs = strPack.split(',')
+        strArchive = Common.resolvePath(aryArgs[0])
+        cbShard = Common.ensureInteger(len(aryArgs) > 1 and aryArgs[1] or '', 0, 'pack requires an integer size in megabytes') * 1024 * 1024
+        if not Globals.geneArchive or Globals.geneArchive.strPath != strArchive or Globals.geneArchive.cbShard != cbShard:
+            closeGeneArchive()
+            strDir = os.path.dirname(strArchive)
+            if not os.path.exists(strDir):
+                try: os.makedirs(strDir)
+                except OSError: raise Usage('Unable to create ' + strDir)
+            try: Globals.geneArchive = GeneArchive.GeneArchiveWriter(strArchive, cbShard)
+            except GeneArchive.GeneArchiveError, err: raise Usage(err.msg[len('Error: '):])
+    else:
+        closeGeneArchive()
+
     if not Globals.urlHan:
         raise Usage('Required Han URL was not specified')
     Globals.urlHan = Common.pathToURL(Globals.urlHan, Common.Constants.schemeFile)
+
+    # Han URLs naming an archive load Han definitions from the archive (which cannot supply HCF files)
+    if Globals.urlHan.endswith(HanArchive.Constants.extArchive):
+        if Globals.fBuildArchetype:
+            raise Usage('Archetypes cannot be built from the Han archive %s' % Globals.urlHan)
+        strArchive = urllib2.url2pathname(urlparse.urlsplit(Globals.urlHan)[2])
+        if not Globals.hanArchive or Globals.hanArchive.strPath != strArchive:
+            try: Globals.hanArchive = HanArchive.HanArchive(strArchive)
+            except HanArchive.HanArchiveError, err: raise Usage(err.msg[len('Error: '):])
+    else:
+        Globals.hanArchive = None
+
+    if strHanCache and not Globals.hanCache:
+        aryArgs = strHanCache.split(',')
+        cbCache = Common.ensureInteger(len(aryArgs) > 1 and aryArgs[1] or '', 0, 'STYLUS_HANCACHE requires an integer size in megabytes') * 1024 * 1024
+        try: Globals.hanCache = HanCache.HanCache(Common.resolvePath(aryArgs[0]), cbCache or DiskCache.Constants.cbDefault)
+        except DiskCache.DiskCacheError, err: raise Common.BiologicError('Unable to create the Han cache %s' % aryArgs[0])
+
+    if strHanMirror and not Globals.hanMirror:
+        aryArgs = strHanMirror.split(',')
+        cbMirror = Common.ensureInteger(len(aryArgs) > 1 and aryArgs[1] or '', 0, 'STYLUS_HANMIRROR requires an integer size in megabytes') * 1024 * 1024
+        secFresh = Common.ensureInteger(len(aryArgs) > 2 and aryArgs[2] or '', 0, 'STYLUS_HANMIRROR requires an integer number of seconds')
+        try: Globals.hanMirror = Fetch.Mirror(Common.resolvePath(aryArgs[0]), cbMirror or DiskCache.Constants.cbDefault, secFresh)
+        except DiskCache.DiskCacheError, err: raise Common.BiologicError('Unable to create the Han mirror %s' % aryArgs[0])
+        Fetch.setMirror(Globals.hanMirror)
+
+    # Han definitions already loaded are kept across calls unless they come from elsewhere
+    if not Globals.hanStore:
+        cbStore = Common.ensureInteger(strHanStore, 0, 'STYLUS_HANSTORE requires an integer size in megabytes') * 1024 * 1024
+        Globals.hanStore = HanStore.HanStore(loadHan, cbStore or HanStore.Constants.cbDefault)
+    if Globals.urlHanStore != Globals.urlHan:
+        Globals.hanStore.clear()
+        Globals.urlHanStore = Globals.urlHan
     
+#------------------------------------------------------------------------------
+# Function: prefetchHan
+# 
+# Begin fetching, in the background, the Han definition (or, if fHCF, the HCF)
+# files of the passed characters when Han definitions come from an http URL
+#------------------------------------------------------------------------------
+def prefetchHan(aryUnicodes, fHCF=False):
+    if Globals.hanArchive:
+        return
+    strExt = fHCF and Common.Constants.extHCF or Common.Constants.extHan
+    Fetch.prefetch([ Common.pathToURL(Common.makeHanPath(strUnicode + strExt), Globals.urlHan) for strUnicode in aryUnicodes ])
+
 #------------------------------------------------------------------------------
 # Function: loadHan
 # 
 #------------------------------------------------------------------------------
 def loadHan(strUnicode):
+    if Globals.hanArchive:
+        try: return Globals.hanArchive.load(strUnicode)
+        except LookupError, err: raise Common.BiologicError(str(err))
+
     urlHan = Common.pathToURL(Common.makeHanPath(strUnicode + Common.Constants.extHan), Globals.urlHan)
-    try: han = Genome.Han(urlHan)
+    try: han = Globals.hanCache and Globals.hanCache.load(urlHan) or Genome.Han(urlHan)
     except LookupError, err: raise Common.BiologicError('%s is missing one or more required elements or attributes - %s' % (urlHan, str(err)))
     except OSError, err: raise Common.BiologicError('Unable to open URL %s - %s' % (urlHan, str(err)))
     except urllib2.URLError, err: raise Common.BiologicError('Unable to open URL %s - %s' % (urlHan, str(err)))
@@ -667,36 +827,133 @@ def loadHan(strUnicode):
 def buildHan(uchHan):
     Common.say('Creating Han Definition file for ' + uchHan)
 
-    hcf = Genome.HCF(Common.pathToURL(Common.makeHanPath(uchHan + Common.Constants.extHCF), Globals.urlHan))
+    # Skip Han whose definition was built from the same HCF by the same version (and at the same precision)
+    urlHCF = Common.pathToURL(Common.makeHanPath(uchHan + Common.Constants.extHCF), Globals.urlHan)
+    aryPrecision = Globals.nDigits is not None and [ '%d,%d' % (Globals.nDigits, Globals.nFractionDigits) ] or []
+    try: strHCF = Fetch.fetch(urlHCF)
+    except (urllib2.URLError, IOError), err: raise Common.BiologicError('Unable to open URL %s - %s' % (urlHCF, str(err)))
+    strHash = hashInputs(*[ _NAME, strHCF ] + aryPrecision)
+
+    strPath = Common.resolvePath(os.path.join(Globals.strArchetypePath, Common.makeHanPath(uchHan.upper() + Common.Constants.extHan)))
+    if Globals.fCompress:
+        strPath += Common.Constants.extGzip
+    if not Globals.fForce and readInputHash(strPath) == strHash:
+        Globals.cSkipped += 1
+        Common.say('Han definition %s is unchanged' % strPath)
+        return
+
+    # The HCF is parsed from the text hashed, so the recorded hash describes the definition built
+    hcf = Genome.HCF(urlHCF, strHCF)
+
+    # Check the declared overlaps against the strokes that actually cross
+    aryUndeclared, aryMissing = Intersect.checkOverlaps(hcf)
+    for nFirst, nSecond, aryPoints in aryUndeclared:
+        Common.say('\tStrokes %d and %d cross at %s without a declared overlap - consider adding overlap:%d,%d,0' % (nFirst, nSecond,
+                                                                                                                ' '.join([ '(%r,%r)' % pt for pt in aryPoints ]),
+                                                                                                                nFirst, nSecond))
+    for hcfO in aryMissing:
+        Common.say('\tStrokes %d and %d are declared to require an overlap but do not cross' % (hcfO.firstStroke, hcfO.secondStroke))
     
-    aryGroups = [ _HAN_GROUP % (str(hcfG.bounds), hcfG.length, hcfG.ptCenter.x, hcfG.ptCenter.y,
-                            ' '.join([ str(i+1) for i in hcfG.containedStrokes])) for hcfG in hcf.aryGroups ]
-    aryStrokes = [ _HAN_STROKE % (str(hcfS.bounds),
-                                hcfS.length,
-                                '\n'.join([ _HAN_POINT % (ptd.x, ptd.y, ptd.distance) for ptd in hcfS.aryPointsForward]),
-                                '\n'.join([ _HAN_POINT % (ptd.x, ptd.y, ptd.distance) for ptd in hcfS.aryPointsReverse]) ) for hcfS in hcf.aryStrokes ]
-    aryOverlaps = [ _HAN_OVERLAP % (hcfO.firstStroke, hcfO.secondStroke, hcfO.fRequired and 'true' or 'false') for hcfO in hcf.aryOverlaps ]
-    strHan = _HAN_DEFINITION % (str(uuid.uuid4()).upper(), hcf.unicode, datetime.datetime.utcnow().isoformat(), _NAME,
-                                str(hcf.bounds), hcf.length, hcf.minimumStrokeLength,
-                                '\n'.join(aryGroups),
-                                '\n'.join(aryStrokes),
-                                aryOverlaps and ('<overlaps>%s</overlaps>' % '\n'.join(aryOverlaps)) or '')
-                                
-    strPath = Common.resolvePath(os.path.join(Globals.strArchetypePath, Common.makeHanPath(hcf.unicode + Common.Constants.extHan)))
     strDir = os.path.dirname(strPath)
     if not os.path.exists(strDir):
         try: os.makedirs(os.path.dirname(strPath))
         except OSError, err: raise Common.BiologicError('Unable to create %s - %s' % (strDir, str(err)))
 
+    fileHan = Common.AtomicFile(strPath, Globals.fSync, fCompress=Globals.fCompress)
     try:
-        fileHan = os.open(strPath, os.O_CREAT | os.O_TRUNC | os.O_WRONLY, 0664)
-        os.write(fileHan, strHan)
-    except IOError, err: raise Common.BiologicError('Unable to create %s - %s' % (strPath, str(err)))
-    os.close(fileHan)
+        try:
+            writeHan(fileHan, hcf, strHash)
+            fileHan.commit()
+        except IOError, err: raise Common.BiologicError('Unable to create %s - %s' % (strPath, str(err)))
+    finally:
+        fileHan.abort()
+    removeOtherForm(strPath)
     
+    Globals.hanStore.discard(hcf.unicode)
+    Globals.cWritten += 1
+
     Common.say('Han definition written to ' + strPath)
     return
 
+#------------------------------------------------------------------------------
+# Function: writeHan
+# 
+# Write the Han definition built from an HCF, one group, stroke, and point at
+# a time, recording the passed hash of its inputs
+#------------------------------------------------------------------------------
+def writeHan(fileHan, hcf, strHash):
+    fileHan.write(_HAN_DEFINITION_START % (strHash, str(uuid.uuid4()).upper(), hcf.unicode, datetime.datetime.utcnow().isoformat(), _NAME,
+                                        formatBounds(hcf.bounds), formatNumber(hcf.length), formatNumber(hcf.minimumStrokeLength)))
+
+    for i, hcfG in enumerate(hcf.aryGroups):
+        if i:
+            fileHan.write('\n')
+        fileHan.write(_HAN_GROUP % (formatBounds(hcfG.bounds), formatNumber(hcfG.length), formatNumber(hcfG.ptCenter.x), formatNumber(hcfG.ptCenter.y),
+                                    ' '.join([ str(iStroke+1) for iStroke in hcfG.containedStrokes])))
+
+    fileHan.write(_HAN_DEFINITION_STROKES)
+    for i, hcfS in enumerate(hcf.aryStrokes):
+        if i:
+            fileHan.write('\n')
+        fileHan.write(_HAN_STROKE_START % (formatBounds(hcfS.bounds), formatNumber(hcfS.length)))
+
+        # Reverse distances are taken from the rounded forward distances, so both directions agree
+        aryDistances = roundFractions([ ptd.distance for ptd in hcfS.aryPointsForward ])
+        writePoints(fileHan, hcfS.aryPointsForward, aryDistances)
+        fileHan.write(_HAN_STROKE_REVERSE)
+        writePoints(fileHan, hcfS.aryPointsReverse, [ 1-distance for distance in aryDistances[::-1] ])
+        fileHan.write(_HAN_STROKE_END)
+
+    aryOverlaps = [ _HAN_OVERLAP % (hcfO.firstStroke, hcfO.secondStroke, hcfO.required and 'true' or 'false') for hcfO in hcf.aryOverlaps ]
+    fileHan.write(_HAN_DEFINITION_END % (aryOverlaps and ('<overlaps>%s</overlaps>' % '\n'.join(aryOverlaps)) or ''))
+    return
+
+def writePoints(fileHan, aryPoints, aryDistances):
+    for i, ptd in enumerate(aryPoints):
+        if i:
+            fileHan.write('\n')
+        fileHan.write(_HAN_POINT % (formatNumber(ptd.x), formatNumber(ptd.y), formatNumber(aryDistances[i], Globals.nFractionDigits)))
+    return
+
+#------------------------------------------------------------------------------
+# Function: formatNumber
+# 
+# Return a Han number as written: in full (as repr) unless a precision is set,
+# otherwise rounded to the passed (or set) decimal places without trailing zeros
+#------------------------------------------------------------------------------
+def formatNumber(n, nDigits=None):
+    if Globals.nDigits is None:
+        return repr(n)
+    if nDigits is None:
+        nDigits = Globals.nDigits
+    str = ('%.*f' % (nDigits, n))
+    if '.' in str:
+        str = str.rstrip('0').rstrip('.')
+    return str != '-0' and str or '0'
+
+def formatBounds(rect):
+    if Globals.nDigits is None:
+        return str(rect)
+    return "top='%s' left='%s' bottom='%s' right='%s' width='%s' height='%s' x-midpoint='%s' y-midpoint='%s'" % tuple([ formatNumber(n) for n in
+                                                                                                                        (rect.top, rect.left, rect.bottom, rect.right,
+                                                                                                                        rect.width, rect.height,
+                                                                                                                        rect.ptCenter.x, rect.ptCenter.y) ])
+
+#------------------------------------------------------------------------------
+# Function: roundFractions
+# 
+# Round the fractional distances along a stroke to the set decimal places;
+# since rounding preserves order, the distances still never decrease, and the
+# ends are held at exactly 0 and 1
+#------------------------------------------------------------------------------
+def roundFractions(aryDistances):
+    if Globals.nDigits is None or not aryDistances:
+        return aryDistances
+    aryDistances = [ round(distance, Globals.nFractionDigits) for distance in aryDistances ]
+    aryDistances[0] = 0.0
+    aryDistances[-1] = 1.0
+    return aryDistances
+
 #------------------------------------------------------------------------------
 # Function: buildSegment
 # 
@@ -833,19 +1090,41 @@ def validateCoherence(arySegments):
 def buildGenes(uchHan, aryGenes):
     Common.say('Creating %d gene(s)' % len(aryGenes))
     
-    han = loadHan(uchHan)
+    han = Globals.hanStore[uchHan]
     
     strAuthor = Globals.strAuthor and (" author='%s'" % Globals.strAuthor) or ''
+    strHan = HanArchive.packHan(han)
 
     aryGeneNames = []
     for specification in aryGenes:
         Common.say('Creating gene from specification ' + specification)
 
+        if Globals.strSeed:
+            random.seed(int(hashInputs(Globals.strSeed, han.unicode, specification)[:16], 16))
+
         gs = GeneSpecification(specification != Constants.strDefault and specification or '', han)
         gsName = gs.toName(han.unicode) + Common.Constants.extGene
-        gsPoints = gs.getPoints()
         Common.say('Gene to be named ' + gsName)
 
+        # Genes go either to the gene archive, as members named by their relative paths, or to their own files
+        if Globals.geneArchive:
+            strPath = Common.makeHanPath(gsName)
+        else:
+            strPath = Common.resolvePath(os.path.join(Globals.strGenePath, Common.makeHanPath(gsName)))
+            if Globals.fCompress:
+                strPath += Common.Constants.extGzip
+
+        # Skip genes already built from the same Han, specification, version, seed, and author
+        strHash = hashInputs(_NAME, strHan, str(gs), Globals.strSeed, strAuthor)
+        strHashRecorded = Globals.geneArchive and Globals.geneArchive.hashFor(gsName) or (not Globals.geneArchive and readInputHash(strPath))
+        if not Globals.fForce and strHashRecorded == strHash:
+            Globals.cSkipped += 1
+            Common.say('\t%s is unchanged' % strPath)
+            aryGeneNames.append(gsName)
+            continue
+
+        gsPoints = gs.getPoints()
+
         ptCurrent = Genome.Point(pt=gsPoints[0][1][0])
         arySegments = []
 
@@ -912,29 +1191,103 @@ def buildGenes(uchHan, aryGenes):
                 iStroke += 1
             iBase += len(aryVectors) * 3
 
-        strGene = _GENE_DEFINITION % (str(uuid.uuid4()).upper(), strAuthor, datetime.datetime.utcnow().isoformat(), _NAME, str(gs),
-                                    ''.join(aryCodons), len(aryCodons)*3,
-                                    gsPoints[0][1][0].x, gsPoints[0][1][0].y,
-                                    han.unicode,
-                                    '\n'.join(aryStrokes))
-
-        strPath = Common.resolvePath(os.path.join(Globals.strGenePath, Common.makeHanPath(gsName)))
-        strDir = os.path.dirname(strPath)
-        if not os.path.exists(strDir):
-            try: os.makedirs(os.path.dirname(strPath))
-            except OSError, err: raise Common.BiologicError('Unable to create %s - %s' % (strDir, str(err)))
-        
+        if Globals.geneArchive:
+            fileGene = Globals.geneArchive.open(strPath, strHash)
+        else:
+            strDir = os.path.dirname(strPath)
+            if not os.path.exists(strDir):
+                try: os.makedirs(os.path.dirname(strPath))
+                except OSError, err: raise Common.BiologicError('Unable to create %s - %s' % (strDir, str(err)))
+            fileGene = Common.AtomicFile(strPath, Globals.fSync, fCompress=Globals.fCompress)
+
         try:
-            fileGene = os.open(strPath, os.O_CREAT | os.O_TRUNC | os.O_WRONLY, 0664)
-            os.write(fileGene, strGene)
-        except IOError, err: raise Common.BiologicError('Unable to create %s - %s' % (strPath, str(err)))
-        os.close(fileGene)
+            try:
+                fileGene.write(_GENE_DEFINITION_START % (strHash, str(uuid.uuid4()).upper(), strAuthor, datetime.datetime.utcnow().isoformat(), _NAME, str(gs)))
+                fileGene.writelines(aryCodons)
+                fileGene.write(_GENE_DEFINITION_END % (len(aryCodons)*3,
+                                                    gsPoints[0][1][0].x, gsPoints[0][1][0].y,
+                                                    han.unicode,
+                                                    '\n'.join(aryStrokes)))
+                fileGene.commit()
+            except IOError, err: raise Common.BiologicError('Unable to create %s - %s' % (strPath, str(err)))
+            except GeneArchive.GeneArchiveError, err: raise Common.BiologicError(err.msg[len('Error: '):])
+        finally:
+            fileGene.abort()
+        if Globals.geneArchive:
+            strPath = '%s (in %s)' % (strPath, Globals.geneArchive.strPath)
+        else:
+            removeOtherForm(strPath)
         
+        Globals.cWritten += 1
         Common.say('\tWrote %s - %d codons, %d bases' % (strPath, len(aryCodons), len(aryCodons)*3))
         aryGeneNames.append(gsName)
 
     return aryGeneNames
 
+#------------------------------------------------------------------------------
+# Function: hashInputs
+# 
+# Return the hash (as hexadecimal) of the inputs, strings in order, from which
+# an output is built
+#------------------------------------------------------------------------------
+def hashInputs(*aryInputs):
+    sha1 = hashlib.sha1()
+    for strInput in aryInputs:
+        if isinstance(strInput, unicode):
+            strInput = strInput.encode('utf-8')
+        sha1.update('%d:' % len(strInput))
+        sha1.update(strInput)
+    return sha1.hexdigest()
+
+#------------------------------------------------------------------------------
+# Function: readInputHash
+# 
+# Return the hash of the inputs recorded within an existing output file, or
+# None if the file is missing, unreadable, or records no hash
+#------------------------------------------------------------------------------
+def readInputHash(strPath):
+    if not os.path.exists(strPath):
+        return None
+    try:
+        fileOutput = Fetch.openURL(Common.pathToURL(strPath, Common.Constants.schemeFile))
+        try: strStart = fileOutput.read(Constants.cbInputHash)
+        finally: fileOutput.close()
+    except (urllib2.URLError, IOError):
+        return None
+    mo = Constants.reInputHash.search(strStart)
+    return mo and mo.group(1) or None
+
+#------------------------------------------------------------------------------
+# Function: closeGeneArchive
+# 
+# Close the gene archive, if any, writing its directory and index (genes added
+# to an archive cannot be read until it is closed)
+#------------------------------------------------------------------------------
+def closeGeneArchive():
+    geneArchive = Globals.geneArchive
+    Globals.geneArchive = None
+    if geneArchive:
+        try: geneArchive.close()
+        except GeneArchive.GeneArchiveError, err: raise Common.BiologicError(err.msg[len('Error: '):])
+        Common.say('%d gene(s) added to %s (index %s)' % (geneArchive.added, geneArchive.strPath, geneArchive.strIndex))
+    return
+
+#------------------------------------------------------------------------------
+# Function: removeOtherForm
+# 
+# Remove the uncompressed copy of a compressed file just written, or the
+# compressed copy of an uncompressed file, so readers find only the new one
+#------------------------------------------------------------------------------
+def removeOtherForm(strPath):
+    if strPath.endswith(Common.Constants.extGzip):
+        strOther = strPath[:-len(Common.Constants.extGzip)]
+    else:
+        strOther = strPath + Common.Constants.extGzip
+    if os.path.exists(strOther):
+        try: os.remove(strOther)
+        except OSError, err: raise Common.BiologicError('Unable to remove %s - %s' % (strOther, str(err)))
+    return
+
 #------------------------------------------------------------------------------
 # Function: main
 # 
@@ -948,7 +1301,9 @@ def main(argv=None):
 
         if Globals.fBuildArchetype:
             Common.say('Archetypes Directory: %s' % Globals.strArchetypePath)
-        if len(Globals.aryGenes) > 0:
+        if Globals.geneArchive:
+            Common.say('Gene Archive        : %s' % Globals.geneArchive.strPath)
+        elif len(Globals.aryGenes) > 0:
             Common.say('Gene Directory      : %s' % Globals.strGenePath)
         Common.say('Han URL             : %s' % Globals.urlHan)
     
@@ -956,8 +1311,10 @@ def main(argv=None):
             buildHan(Globals.uchHan)
 
         if Globals.aryGenes:
-            buildGenes(Globals.uchHan, Globals.aryGenes)
+            try: buildGenes(Globals.uchHan, Globals.aryGenes)
+            finally: closeGeneArchive()
 
+        Common.say('%d file(s) written, %d skipped as unchanged' % (Globals.cWritten, Globals.cSkipped))
         return 0
 
     except Common.BiologicError, err:
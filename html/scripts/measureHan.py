@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# Stylus, Copyright 2006-2008 Biologic Institute
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+'''
+measureHan.py
+
+Measure what writing Han definitions at a reduced precision (see the
+--precision option of inscribe.py) saves. Every HCF file within an
+Archetypes directory is built twice, in full and rounded, into temporary
+directories; the script reports the total size of each set of Han files,
+the time taken to load them (as genome.Han objects), the largest change
+rounding made to any coordinate or length, and whether every stroke's
+fractional distances still never decrease.
+
+Stylus, Copyright 2006-2008 Biologic Institute.
+'''
+
+import fnmatch
+import getopt
+import inscribe
+import os
+import shutil
+import stylus.common as Common
+import stylus.genome as Genome
+import sys
+import tempfile
+import time
+
+#==============================================================================
+# Global Constants
+#==============================================================================
+class Constants:
+    strPrecisionDefault = '3'
+    cLoadsDefault = 5
+
+#==============================================================================
+# Helper Classes
+#==============================================================================
+#------------------------------------------------------------------------------
+# Class: Usage
+#
+#------------------------------------------------------------------------------
+class Usage(Common.BiologicError):
+    __strHelpMessage = '''
+\t<Archetypes path> - The directory containing the HCF files to build
+
+\t[(-p|--precision) <digits>[,<fraction digits>]] - The precision to compare with full precision (default %s)
+\t[(-n|--loads) <count>] - The times each set of Han files is loaded, taking the fastest (default %d)
+\t[-h|--help] - Print this help
+''' % (Constants.strPrecisionDefault, Constants.cLoadsDefault)
+
+    def __init__(self, msg):
+        self.msg = ''
+        if msg and len(msg) > 0:
+            self.msg = 'Error: ' + msg + '\n'
+        self.msg += 'Usage: ' + sys.argv[0].split("/")[-1] + ' [options] <Archetypes path>\n' + self.__strHelpMessage
+
+    def __str__(self):
+        return self.msg
+
+#==============================================================================
+# Helper Functions
+#==============================================================================
+#------------------------------------------------------------------------------
+# Function: buildAll
+#
+# Build the Han definitions of the passed characters into a directory,
+# returning the paths of the Han files written
+#------------------------------------------------------------------------------
+def buildAll(aryUnicodes, strArchetypes, strOutput, aryArgs):
+    inscribe.setGlobals([ '-d', strOutput, '-u', strArchetypes + os.sep, '-f' ] + aryArgs)
+    Common.Globals.fQuiet = True
+    for strUnicode in aryUnicodes:
+        inscribe.buildHan(strUnicode)
+    Common.Globals.fQuiet = False
+    return [ os.path.join(strOutput, Common.makeHanPath(strUnicode + Common.Constants.extHan)) for strUnicode in aryUnicodes ]
+
+#------------------------------------------------------------------------------
+# Function: loadAll
+#
+# Load the passed Han files cLoads times, returning the Han of the last pass
+# and the seconds taken by the fastest
+#------------------------------------------------------------------------------
+def loadAll(aryPaths, cLoads):
+    secFastest = None
+    for i in xrange(cLoads):
+        tmStart = time.time()
+        aryHan = [ Genome.Han('file://' + strPath) for strPath in aryPaths ]
+        secLoad = time.time() - tmStart
+        if secFastest is None or secLoad < secFastest:
+            secFastest = secLoad
+    return aryHan, secFastest
+
+#------------------------------------------------------------------------------
+# Function: compareHan
+#
+# Return the largest difference between the coordinates and lengths of two
+# Han and whether the fractional distances of the second never decrease
+#------------------------------------------------------------------------------
+def compareHan(hanFull, hanRounded):
+    aryPairs = [ (hanFull.length, hanRounded.length) ]
+    fMonotonic = True
+    for hanStrokeFull, hanStrokeRounded in zip(hanFull.aryStrokes, hanRounded.aryStrokes):
+        aryPairs.append((hanStrokeFull.length, hanStrokeRounded.length))
+        for strPoints in [ 'aryPointsForward', 'aryPointsReverse' ]:
+            aryFull = getattr(hanStrokeFull, strPoints)
+            aryRounded = getattr(hanStrokeRounded, strPoints)
+            for ptdFull, ptdRounded in zip(aryFull, aryRounded):
+                aryPairs.append((ptdFull.x, ptdRounded.x))
+                aryPairs.append((ptdFull.y, ptdRounded.y))
+            for i in xrange(1, len(aryRounded)):
+                if aryRounded[i].distance < aryRounded[i-1].distance:
+                    fMonotonic = False
+    return max([ abs(nFull - nRounded) for nFull, nRounded in aryPairs ]), fMonotonic
+
+#------------------------------------------------------------------------------
+# Function: main
+#
+#------------------------------------------------------------------------------
+def main(argv=None):
+    try:
+        Common.Globals.fQuiet = False
+        strPrecision = Constants.strPrecisionDefault
+        cLoads = Constants.cLoadsDefault
+        try:
+            opts, remaining = getopt.getopt(sys.argv[1:], 'p:n:h', [ 'precision=', 'loads=', 'help' ])
+        except getopt.error, err:
+            raise Usage(str(err))
+
+        for option, value in opts:
+            if option in ('-p', '--precision'):
+                strPrecision = value
+            if option in ('-n', '--loads'):
+                cLoads = Common.ensureInteger(value, cLoads, 'loads requires an integer count')
+            if option in ('-h', '--help'):
+                raise Usage('')
+
+        if len(remaining) != 1:
+            raise Usage('Exactly one Archetypes path is required')
+        strArchetypes = Common.resolvePath(remaining[0])
+        if not Common.isDir(strArchetypes):
+            raise Usage(strArchetypes + ' is not a directory')
+
+        aryUnicodes = []
+        for root, dirs, files in os.walk(strArchetypes):
+            aryUnicodes += [ os.path.splitext(f)[0].upper() for f in fnmatch.filter(files, '*' + Common.Constants.extHCF) ]
+        aryUnicodes.sort()
+        if not aryUnicodes:
+            raise Usage(strArchetypes + ' contains no HCF files')
+
+        strRoot = tempfile.mkdtemp()
+        try:
+            aryPathsFull = buildAll(aryUnicodes, strArchetypes, os.path.join(strRoot, 'full'), [])
+            aryPathsRounded = buildAll(aryUnicodes, strArchetypes, os.path.join(strRoot, 'rounded'), [ '--precision=' + strPrecision ])
+
+            cbFull = sum([ os.path.getsize(strPath) for strPath in aryPathsFull ])
+            cbRounded = sum([ os.path.getsize(strPath) for strPath in aryPathsRounded ])
+            aryHanFull, secFull = loadAll(aryPathsFull, cLoads)
+            aryHanRounded, secRounded = loadAll(aryPathsRounded, cLoads)
+
+            nError = 0
+            fMonotonic = True
+            for hanFull, hanRounded in zip(aryHanFull, aryHanRounded):
+                nHanError, fHanMonotonic = compareHan(hanFull, hanRounded)
+                nError = max(nError, nHanError)
+                fMonotonic = fMonotonic and fHanMonotonic
+        finally:
+            shutil.rmtree(strRoot)
+
+        Common.say('%d Han definitions from %s' % (len(aryUnicodes), strArchetypes))
+        Common.say('%-20s %12s %12s' % ('', 'bytes', 'load (s)'))
+        Common.say('%-20s %12d %12.4f' % ('full precision', cbFull, secFull))
+        Common.say('%-20s %12d %12.4f' % ('precision ' + strPrecision, cbRounded, secRounded))
+        Common.say('Size %.1f%%, load time %.1f%% of full precision' % ((100.0 * cbRounded) / cbFull, (100.0 * secRounded) / max(secFull, 1e-9)))
+        Common.say('Largest change to a coordinate or length: %r' % nError)
+        Common.say('Fractional distances never decrease: %s' % (fMonotonic and 'yes' or 'NO'))
+        return 0
+
+    except Common.BiologicError, err:
+        Common.sayError(err.msg)
+        return 2
+
+if __name__ == "__main__":
+    sys.exit(main())
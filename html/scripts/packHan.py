@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# Stylus, Copyright 2006-2008 Biologic Institute
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+'''
+packHan.py
+
+Pack all Han definition files within an Archetypes directory into a single
+Han archive (see stylus/hanarchive.py). Passing the archive as the Han URL
+to inscribe.py loads definitions from it rather than from individual files.
+
+Stylus, Copyright 2006-2008 Biologic Institute.
+'''
+
+import getopt
+import stylus.common as Common
+import stylus.hanarchive as HanArchive
+import sys
+
+#==============================================================================
+# Helper Classes
+#==============================================================================
+#------------------------------------------------------------------------------
+# Class: Usage
+#
+#------------------------------------------------------------------------------
+class Usage(Common.BiologicError):
+    __strHelpMessage = '''
+\t(-a|--archive) <archive path> - The archive file to create (by convention, ending in %s)
+\t<Archetypes path> - The directory containing the Han definition files to pack
+
+\t[-q|--quiet] - Silence all output
+\t[-h|--help] - Print this help
+''' % HanArchive.Constants.extArchive
+
+    def __init__(self, msg):
+        self.msg = ''
+        if msg and len(msg) > 0:
+            self.msg = 'Error: ' + msg + '\n'
+        self.msg += 'Usage: ' + sys.argv[0].split("/")[-1] + ' [options] <Archetypes path>\n' + self.__strHelpMessage
+
+    def __str__(self):
+        return self.msg
+
+#------------------------------------------------------------------------------
+# Function: main
+#
+#------------------------------------------------------------------------------
+def main(argv=None):
+    try:
+        strArchive = ''
+        try:
+            opts, remaining = getopt.getopt(sys.argv[1:], 'a:qh', [ 'archive=', 'quiet', 'help' ])
+        except getopt.error, err:
+            raise Usage(str(err))
+
+        for option, value in opts:
+            if option in ('-a', '--archive'):
+                strArchive = Common.resolvePath(value)
+            if option in ('-q', '--quiet'):
+                Common.Globals.fQuiet = True
+            if option in ('-h', '--help'):
+                raise Usage('')
+
+        if not strArchive:
+            raise Usage('Required archive path was not specified')
+        if len(remaining) != 1:
+            raise Usage('Exactly one Archetypes path is required')
+        strArchetypes = Common.resolvePath(remaining[0])
+        if not Common.isDir(strArchetypes):
+            raise Usage(strArchetypes + ' is not a directory')
+
+        Common.say('Packing Han definitions from %s' % strArchetypes)
+        try: cHan = HanArchive.packArchetypes(strArchetypes, strArchive, lambda strPath: Common.say('\t%s' % strPath))
+        except LookupError, err: raise Common.BiologicError('A Han definition is missing one or more required elements or attributes - %s' % str(err))
+        Common.say('%d Han definitions written to %s' % (cHan, strArchive))
+        return 0
+
+    except (Common.BiologicError, HanArchive.HanArchiveError), err:
+        Common.sayError(err.msg)
+        return 2
+
+if __name__ == "__main__":
+    sys.exit(main())
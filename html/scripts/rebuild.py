@@ -20,35 +20,40 @@ rebuild.py
 Re-build all Han and gene definition files from the local HCF files.
 
 Note:
-Run this script from its current directory (e.g., ./rebuild.py) within the Han directory
+Run this script from its current directory (e.g., ./rebuild.py) within the Han directory.
+Passing --archive=<archive path>[,<MB per archive>] adds genes to zip archives (see
+stylus/genearchive.py) rather than writing them beside the HCF files.
+Han and genes whose inputs are unchanged since they were last built are skipped unless
+--force is passed.
 
 Copyright (c) 2008 Biologic Institute, LLC. All rights reserved.
 '''
 
 import fnmatch
-import geneMaker
 import getopt
+import inscribe
 import os
 import os.path
 import re
 import stylus.common as Common
+import stylus.genearchive as GeneArchive
 import stylus.genome as Genome
 import sys
 
 reHCF = re.compile(r'([A-Fa-f\d]+)\.hcf')
 reGENE = re.compile(r'([A-Fa-f\d]+).*\.gene')
 
-geneMaker.setGlobals([ '-o', './../', '-u', './../' ])
-
 class Globals:
     fErase = False
     strDirPattern = '[123456789]000'
     fBuildHan = False
     fBuildGenes = False
+    strArchive = ''
+    fForce = False
 
 def getArguments():
     try:
-        opts, remaining = getopt.getopt(sys.argv[1:], 'ep:hg', [ 'erase', 'pattern=', 'han', 'genes' ])
+        opts, remaining = getopt.getopt(sys.argv[1:], 'ep:hga:f', [ 'erase', 'pattern=', 'han', 'genes', 'archive=', 'force' ])
     except getopt.error, err:
         raise BiologicError(str(err))
 
@@ -64,12 +69,38 @@ def getArguments():
             
         if option in ('-g', '--genes'):
             Globals.fBuildGenes = True
+
+        if option in ('-a', '--archive'):
+            Globals.strArchive = value
+
+        if option in ('-f', '--force'):
+            Globals.fForce = True
             
     if not Globals.fBuildHan and not Globals.fBuildGenes:
         Globals.fBuildGenes = not Globals.fErase
 
+# Print whether the last build wrote its output (inscribe counts those written), returning the number written
+def reportOutput(cWritten, strWritten, strUnchanged):
+    if inscribe.Globals.cWritten > cWritten:
+        print '\t' + strWritten
+        return 1
+    print '\t' + strUnchanged
+    return 0
+
 #----------------------------------------------------------------------------------------------------------------------------------------
 getArguments()
+inscribe.setGlobals([ '-d', './../', '-o', './../', '-u', './../' ] + (Globals.strArchive and [ '-p', Globals.strArchive ] or []) + (Globals.fForce and [ '-f' ] or []))
+
+# Archived genes are read before any are added, since added genes reach the archives only once the writer closes
+aryArchived = []
+if Globals.strArchive and Globals.fBuildGenes and os.path.exists(inscribe.Globals.geneArchive.strIndex):
+    geneIndex = GeneArchive.GeneIndex(Common.pathToURL(inscribe.Globals.geneArchive.strIndex, Common.Constants.schemeFile))
+    for gene in geneIndex.names():
+        if fnmatch.fnmatch(Common.makeHanPath(gene), Globals.strDirPattern + '/*'):
+            genome = Genome.Genome(geneIndex.urlFor(gene))
+            if genome.creationParameters != 'default':
+                aryArchived.append((reGENE.match(gene).groups()[0], genome.creationParameters))
+
 for folder in fnmatch.filter(os.listdir('..'), Globals.strDirPattern):
     print 'Examining directory %s' % folder
 
@@ -79,24 +110,26 @@ for folder in fnmatch.filter(os.listdir('..'), Globals.strDirPattern):
         for gene in fnmatch.filter(os.listdir(os.path.join('..', folder)), '*.gene'):
             os.remove(os.path.join('..', folder, gene))
 
+    aryUnicodes = [ reHCF.match(hcf).groups()[0] for hcf in fnmatch.filter(os.listdir(os.path.join('..', folder)), '*.hcf') ]
+
     if Globals.fBuildHan:
         print 'Creating Han definitions'
+        inscribe.prefetchHan(aryUnicodes, True)
         nCount = 0
-        for hcf in fnmatch.filter(os.listdir(os.path.join('..', folder)), '*.hcf'):
-            uchHan = reHCF.match(hcf).groups()[0]
-            geneMaker.buildHan(uchHan)
-            nCount += 1
-            print '\t%s definition created' % uchHan
+        for uchHan in aryUnicodes:
+            cWritten = inscribe.Globals.cWritten
+            inscribe.buildHan(uchHan)
+            nCount += reportOutput(cWritten, '%s definition created' % uchHan, '%s definition unchanged' % uchHan)
         print '\t%d definitions created' % nCount
 
     if Globals.fBuildGenes:
         print 'Creating default genes'
+        inscribe.prefetchHan(aryUnicodes)
         nCount = 0
-        for hcf in fnmatch.filter(os.listdir(os.path.join('..', folder)), '*.hcf'):
-            uchHan = reHCF.match(hcf).groups()[0]
-            aryGeneNames = geneMaker.buildGenes(uchHan, [ 'default' ])
-            nCount += 1
-            print '\t%s gene created' % uchHan
+        for uchHan in aryUnicodes:
+            cWritten = inscribe.Globals.cWritten
+            aryGeneNames = inscribe.buildGenes(uchHan, [ 'default' ])
+            nCount += reportOutput(cWritten, '%s gene created' % uchHan, '%s gene unchanged' % uchHan)
         
         print 'Rebuilding existing genes'
         for gene in fnmatch.filter(os.listdir(os.path.join('..', folder)), '*.gene'):
@@ -104,7 +137,22 @@ for folder in fnmatch.filter(os.listdir('..'), Globals.strDirPattern):
             genome = Genome.Genome('file://' + path)
             if genome.creationParameters != 'default':
                 uchGene = reGENE.match(gene).groups()[0]
-                aryGeneNames = geneMaker.buildGenes(uchGene, [ genome.creationParameters ])
-                nCount += 1
-                print '\t%s Rebuilt gene with parameters %s' % (uchGene, genome.creationParameters)
+                cWritten = inscribe.Globals.cWritten
+                aryGeneNames = inscribe.buildGenes(uchGene, [ genome.creationParameters ])
+                nCount += reportOutput(cWritten, '%s Rebuilt gene with parameters %s' % (uchGene, genome.creationParameters),
+                                        '%s gene with parameters %s unchanged' % (uchGene, genome.creationParameters))
         print '\t%d genes created' % nCount
+
+if aryArchived:
+    print 'Rebuilding archived genes'
+    inscribe.prefetchHan([ uchGene for uchGene, strParameters in aryArchived ])
+    nCount = 0
+    for uchGene, strParameters in aryArchived:
+        cWritten = inscribe.Globals.cWritten
+        aryGeneNames = inscribe.buildGenes(uchGene, [ strParameters ])
+        nCount += reportOutput(cWritten, '%s Rebuilt gene with parameters %s' % (uchGene, strParameters),
+                                '%s gene with parameters %s unchanged' % (uchGene, strParameters))
+    print '\t%d genes rebuilt' % nCount
+
+inscribe.closeGeneArchive()
+print '%d outputs rebuilt, %d skipped as unchanged' % (inscribe.Globals.cWritten, inscribe.Globals.cSkipped)
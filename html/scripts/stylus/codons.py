@@ -22,6 +22,8 @@ This script contains codon related data used by Stylus scripts.
 Stylus, Copyright 2006-2008 Biologic Institute.
 '''
 
+import array
+import operator
 import random
 import re
 
@@ -582,16 +584,197 @@ class Nws(Vector):
         self.id = Vectors.NorthwestShort
         self.codons = [ 'CGT', 'CGC', 'CGA', 'CGG' ]
 
+#------------------------------------------------------------------------------
+# Class: PackedBases
+# 
+# A base sequence stored with two bits per base (T=0, C=1, A=2, G=3 - the
+# same weights used to index _mapCodonToVector) packed four bases to a byte,
+# first base in the high bits.
+# 
+# Notes:
+# - Slicing (by Python slice or by a genome Range) returns a view that shares
+#   the packed buffer of the original sequence rather than copying it
+# - Range indexes are 1-based and inclusive, as within genome files
+#------------------------------------------------------------------------------
+class PackedBases(object):
+    __strBases = 'TCAG'
+    __mapBaseToValue = dict([ (__strBases[i], i) for i in xrange(4) ])
+    __mapQuadToByte = dict([ (b1+b2+b3+b4, (__mapBaseToValue[b1] << 6) | (__mapBaseToValue[b2] << 4) | (__mapBaseToValue[b3] << 2) | __mapBaseToValue[b4])
+                            for b1 in __strBases for b2 in __strBases for b3 in __strBases for b4 in __strBases ])
+    __mapByteToQuad = dict([ (v, k) for k, v in __mapQuadToByte.iteritems() ])
+
+    def __init__(self, bases='', buffer=None, offset=0, length=None):
+        if buffer is not None:
+            self.__buffer = buffer
+            self.__offset = offset
+            self.__length = length
+        else:
+            cPadding = (4 - (len(bases) % 4)) % 4
+            strPadded = bases + ('T' * cPadding)
+            try: self.__buffer = bytearray([ PackedBases.__mapQuadToByte[strPadded[i:i+4]] for i in xrange(0, len(strPadded), 4) ])
+            except KeyError, err: raise ValueError('%s contains a character other than T, C, A, or G' % str(err))
+            self.__offset = 0
+            self.__length = len(bases)
+        return
+
+    def __len__(self):
+        return self.__length
+
+    def __str__(self):
+        iFirst = self.__offset
+        iLast = self.__offset + self.__length
+        strBases = ''.join([ PackedBases.__mapByteToQuad[b] for b in self.__buffer[iFirst >> 2:(iLast + 3) >> 2] ])
+        return strBases[iFirst & 3:(iFirst & 3) + self.__length]
+
+    def __eq__(self, other):
+        return isinstance(other, PackedBases) and len(self) == len(other) and str(self) == str(other)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            iStart, iStop, iStep = key.indices(self.__length)
+            if iStep != 1:
+                raise ValueError('PackedBases slices do not support steps')
+            return PackedBases(buffer=self.__buffer, offset=self.__offset+iStart, length=max(0, iStop-iStart))
+        if key < 0:
+            key += self.__length
+        if key < 0 or key >= self.__length:
+            raise IndexError('PackedBases index out of range')
+        return PackedBases.__strBases[self.value(key)]
+
+    #--------------------------------------------------------------------------
+    # Function: value
+    # 
+    # Return the two-bit value of the base at the passed 0-based index
+    #--------------------------------------------------------------------------
+    def value(self, iBase):
+        iBase += self.__offset
+        return (self.__buffer[iBase >> 2] >> (6 - ((iBase & 3) << 1))) & 0x3
+
+    #--------------------------------------------------------------------------
+    # Function: slice
+    # 
+    # Return a view of the bases covered by a genome Range
+    #--------------------------------------------------------------------------
+    def slice(self, rgBases):
+        return self[rgBases.baseFirst-1:rgBases.baseLast]
+
+    #--------------------------------------------------------------------------
+    # Function: iterCodons
+    # 
+    # Yield the 6-bit index (0-63, suitable for codonIndexToVector) of each
+    # complete codon, beginning with the first base
+    #--------------------------------------------------------------------------
+    def iterCodons(self):
+        buffer = self.__buffer
+        iBase = self.__offset
+        iEnd = self.__offset + self.__length - 2
+        while iBase < iEnd:
+            iCodon = 0
+            for i in xrange(iBase, iBase+3):
+                iCodon = (iCodon << 2) | ((buffer[i >> 2] >> (6 - ((i & 3) << 1))) & 0x3)
+            yield iCodon
+            iBase += 3
+
+    #--------------------------------------------------------------------------
+    # Function: codonIndexes
+    # 
+    # Return the 6-bit index of every complete codon as an array of unsigned
+    # bytes, computed from the packed buffer without unpacking the bases
+    #
+    # Notes:
+    # - Every three bytes (twelve bases) hold four codons; each codon is
+    #   taken from one byte, or assembled from two, through translate tables
+    #   applied to every third byte at once
+    # - Sequences not beginning on a byte boundary are first shifted into
+    #   alignment, again a table at a time
+    #--------------------------------------------------------------------------
+    def codonIndexes(self):
+        cCodons = self.__length / 3
+        cGroups = (cCodons + 3) / 4
+        cBytes = cGroups * 3
+
+        iByte = self.__offset >> 2
+        cShift = self.__offset & 3
+        buffer = self.__buffer[iByte:iByte + cBytes + (cShift and 1 or 0)]
+        buffer += bytearray(cBytes + (cShift and 1 or 0) - len(buffer))
+        if cShift:
+            buffer = bytearray(map(operator.or_, buffer[:-1].translate(_aryShiftLeft[cShift]), buffer[1:].translate(_aryShiftRight[cShift])))
+
+        aryFirst = buffer[0::3]
+        arySecond = buffer[1::3]
+        aryThird = buffer[2::3]
+        aryCodons = bytearray(cGroups * 4)
+        aryCodons[0::4] = aryFirst.translate(_strHigh6)
+        aryCodons[1::4] = bytearray(map(operator.or_, aryFirst.translate(_strLow2), arySecond.translate(_strHigh4)))
+        aryCodons[2::4] = bytearray(map(operator.or_, arySecond.translate(_strLow4), aryThird.translate(_strHigh2)))
+        aryCodons[3::4] = aryThird.translate(_strLow6)
+        return array.array('B', str(aryCodons[:cCodons]))
+
+#------------------------------------------------------------------------------
+# Class: VectorArrays
+# 
+# Parallel arrays describing the vectors encoded by a base sequence: vector
+# identifiers and directions (as arrays of unsigned bytes) and dx, dy, and
+# lengths (as arrays of doubles)
+#------------------------------------------------------------------------------
+class VectorArrays(object):
+    def __init__(self, ids):
+        self.ids = ids
+        self.direction = array.array('B', ids.tostring().translate(_strVectorToDirection))
+        self.dx = array.array('d', map(_aryVectorToDX.__getitem__, ids))
+        self.dy = array.array('d', map(_aryVectorToDY.__getitem__, ids))
+        self.length = array.array('d', map(_aryVectorToLength.__getitem__, ids))
+        return
+
+    def __len__(self):
+        return len(self.ids)
+
 #------------------------------------------------------------------------------
 # Function: codonToVector
 # 
-# Retrieve the vector object for the passed codon
+# Retrieve the vector object for the passed codon (bases may be upper or
+# lower case; any other character is taken as T)
 #------------------------------------------------------------------------------
 def codonToVector(strCodon):
-    return _vectors[_mapCodonToVector[(strCodon[0] == 'G' and 48 or (strCodon[0] == 'A' and 32 or (strCodon[0] == 'C' and 16 or 0))) +
-                                    (strCodon[1] == 'G' and 12 or (strCodon[1] == 'A' and  8 or (strCodon[1] == 'C' and  4 or 0))) + 
-                                    (strCodon[2] == 'G' and  3 or (strCodon[2] == 'A' and  2 or (strCodon[2] == 'C' and  1 or 0)))]]
+    iCodon = _mapCodonToIndex.get(strCodon)
+    if iCodon is None:
+        strCodon = strCodon.upper()
+        iCodon = (_mapBaseToIndex.get(strCodon[0], 0) << 4) | (_mapBaseToIndex.get(strCodon[1], 0) << 2) | _mapBaseToIndex.get(strCodon[2], 0)
+    return _vectors[_mapCodonToVector[iCodon]]
+
+#------------------------------------------------------------------------------
+# Function: decodeBases
+# 
+# Decode every complete codon of a base sequence (a string or PackedBases)
+# into VectorArrays. Codons are translated in bulk through lookup tables,
+# rather than one call per codon, for throughput on large genomes.
+#------------------------------------------------------------------------------
+def decodeBases(bases):
+    if isinstance(bases, PackedBases):
+        return VectorArrays(array.array('B', bases.codonIndexes().tostring().translate(_strCodonToVector)))
+    return VectorArrays(_decodeCodons(bases, _mapCodonToVectorChar))
+
+def _decodeCodons(strBases, mapCodonToChar):
+    ary = array.array('B')
+    try: ary.fromstring(''.join(map(mapCodonToChar.__getitem__, [ strBases[i:i+3] for i in xrange(0, len(strBases)-2, 3) ])))
+    except KeyError, err: raise ValueError('%s is not a valid codon' % str(err))
+    return ary
                     
+#------------------------------------------------------------------------------
+# Function: codonToIndex, codonIndexToVector
+# 
+# Convert between codons and their 6-bit numeric value, and retrieve the
+# vector object for a numeric value
+#------------------------------------------------------------------------------
+def codonToIndex(strCodon):
+    return _mapCodonToIndex[strCodon]
+
+def codonIndexToVector(iCodon):
+    return _vectors[_mapCodonToVector[iCodon]]
+
 #------------------------------------------------------------------------------
 # Function: codonToName
 # 
@@ -664,6 +847,32 @@ _vectors = [
     Nwm()
     ]
 
+# Indexed by codon
+_mapCodonToIndex = dict([ (b1+b2+b3, (i1 << 4) | (i2 << 2) | i3) for i1, b1 in enumerate('TCAG') for i2, b2 in enumerate('TCAG') for i3, b3 in enumerate('TCAG') ])
+_mapCodonToIndexChar = dict([ (strCodon, chr(iCodon)) for strCodon, iCodon in _mapCodonToIndex.iteritems() ])
+_mapCodonToVectorChar = dict([ (strCodon, chr(_mapCodonToVector[iCodon])) for strCodon, iCodon in _mapCodonToIndex.iteritems() ])
+_mapBaseToIndex = dict([ (b, i) for i, b in enumerate('TCAG') ])
+
+# Indexed by codon index (a str.translate table)
+_strCodonToVector = ''.join([ chr(iVector) for iVector in _mapCodonToVector ]) + ('\0' * (256 - len(_mapCodonToVector)))
+
+# Indexed by packed byte (str.translate tables): the bits of the byte holding each part of a codon, moved into place
+# within the codon, and the byte shifted left or right by 1-3 bases (to align sequences not starting on a byte boundary)
+_strHigh6 = ''.join([ chr(b >> 2) for b in xrange(256) ])
+_strLow2 = ''.join([ chr((b & 0x03) << 4) for b in xrange(256) ])
+_strHigh4 = ''.join([ chr(b >> 4) for b in xrange(256) ])
+_strLow4 = ''.join([ chr((b & 0x0F) << 2) for b in xrange(256) ])
+_strHigh2 = ''.join([ chr(b >> 6) for b in xrange(256) ])
+_strLow6 = ''.join([ chr(b & 0x3F) for b in xrange(256) ])
+_aryShiftLeft = [ None ] + [ ''.join([ chr((b << (2 * cBases)) & 0xFF) for b in xrange(256) ]) for cBases in xrange(1, 4) ]
+_aryShiftRight = [ None ] + [ ''.join([ chr(b >> (8 - (2 * cBases))) for b in xrange(256) ]) for cBases in xrange(1, 4) ]
+
+# Indexed by vector identifier (the direction table is a str.translate table)
+_aryVectorToDX = [ v.dx for v in _vectors ]
+_aryVectorToDY = [ v.dy for v in _vectors ]
+_aryVectorToLength = [ v.length for v in _vectors ]
+_strVectorToDirection = ''.join([ chr(v.direction) for v in _vectors ]) + ('\0' * (256 - len(_vectors)))
+
 # Triple indexed by vector identifier
 _COHERENCE = [
     [
@@ -2927,6 +3136,30 @@ if __name__ == "__main__":
                 c = b1+b2+b3
                 v = codonToVector(c)
                 assert(c in v.codons)
+                assert(v == codonIndexToVector(codonToIndex(c)))
+
+    # Ensure packed bases round-trip and decode to the same codons
+    strBases = ''.join([ random.choice('TCAG') for i in xrange(301) ])
+    pb = PackedBases(strBases)
+    assert(str(pb) == strBases)
+    for iFirst in xrange(0, 8):
+        for iLast in xrange(len(strBases)-8, len(strBases)+1):
+            assert(pb[iFirst:iLast].codonIndexes().tolist() == [ codonToIndex(strBases[i:i+3]) for i in xrange(iFirst, iLast-2, 3) ])
+        assert(str(pb[iFirst:iFirst+17]) == strBases[iFirst:iFirst+17])
+        assert([ codonToIndex(strBases[i:i+3]) for i in xrange(iFirst, len(strBases)-2, 3) ] == list(pb[iFirst:].iterCodons()))
+        assert(list(pb[iFirst:].iterCodons()) == pb[iFirst:].codonIndexes().tolist())
+
+    # Ensure bulk decoding matches decoding codon by codon
+    va = decodeBases(pb)
+    aryVectors = [ codonToVector(strBases[i:i+3]) for i in xrange(0, len(strBases)-2, 3) ]
+    assert(va.ids.tolist() == [ v.id for v in aryVectors ])
+    assert(va.direction.tolist() == [ v.direction for v in aryVectors ])
+    assert(va.dx.tolist() == [ v.dx for v in aryVectors ] and va.dy.tolist() == [ v.dy for v in aryVectors ])
+    assert(va.length.tolist() == [ v.length for v in aryVectors ])
+    assert(decodeBases(pb[5:]).ids.tolist() == decodeBases(strBases[5:]).ids.tolist())
+
+    # Ensure lower case bases decode as upper case, and other characters as T
+    assert(codonToVector('atg') == codonToVector('ATG') and codonToVector('ANG') == codonToVector('ATG'))
                 
     # Generate codon mapping table for use in Stylus C/C++ file
     iCodon = -1
@@ -20,13 +20,15 @@ common.py
 Stylus, Copyright 2006-2008 Biologic Institute.
 '''
 
+import fetch as Fetch
+import gzip
 import os
 import os.path
 import re
 import shutil
 import sys
+import tempfile
 import time
-import urllib2
 import urlparse
 import xmldict as XMLDict
 
@@ -53,6 +55,14 @@ class Constants:
     extHCF = '.hcf'
     extXHTML = '.html'
     extXML = '.xml'
+    extTemporary = '.tmp'
+    extGzip = '.gz'
+
+    # Bytes buffered by AtomicFile before writing to its temporary file
+    cbWriteBuffer = 65536
+
+    # Compression level of files AtomicFile compresses (1 fastest to 9 smallest)
+    nCompressLevel = 6
 
     reBASENAMEUNICODE = re.compile(r'([\dA-Fa-f]{4,5}).*\.(\w+)')
     reUUID = re.compile(r'([A-F\d]{8}\-[A-F\d]{4}\-[A-F\d]{4}\-[A-F\d]{4}\-[A-F\d]{12})')
@@ -261,7 +271,7 @@ class Names:
                 self.idGenome = os.path.splitext(os.path.basename(self.urlGenome))[0]
             elif self.strNameType == 'uuid':
                 if not Constants.reUUID.match(self.strGenome):
-                    xmlDict = XMLDict.XMLDict({ XMLDict.XMLDict.ignore : [ 'seed', 'bases', 'statistics', 'lineage', 'genes' ] })
+                    xmlDict = XMLDict.XMLDict({ XMLDict.XMLDict.stopAfter : lambda strPath, fEnd: strPath == '/genome' })
                     try: self.idGenome = str(xmlDict.load(self.urlGenome)['genome']['uuid']).upper()
                     except LookupError, err: raise BiologicError('Genome (%s) is missing a UUID' % self.urlGenome)
             elif self.strNameType == 'unicode':
@@ -359,6 +369,75 @@ class Names:
         pathExpand = os.path.join(pathExpand, '%s%ld' % (Constants.filenameTrial, self.strExpand))
         return urlParent, pathExpand
 
+#------------------------------------------------------------------------------
+# Class: AtomicFile
+#
+# Notes:
+# - Writes go, buffered, to a temporary file within the directory of the
+#   destination; commit flushes (and, if fSync, syncs) the temporary file
+#   and renames it over the destination, so readers see either the previous
+#   file or the complete new one, never a partial file
+# - abort removes the temporary file; it does nothing once committed, so
+#   callers may abort within a finally clause
+# - If fCompress, writes are gzip-compressed (the caller chooses the name,
+#   normally ending in .gz)
+#------------------------------------------------------------------------------
+class AtomicFile(object):
+    def __init__(self, strPath, fSync=False, nMode=0664, fCompress=False):
+        self.strPath = strPath
+        self.fSync = fSync
+        self.nMode = nMode
+
+        try: fd, self.strTemporary = tempfile.mkstemp(Constants.extTemporary, '.' + os.path.basename(strPath) + '.', os.path.dirname(strPath) or '.')
+        except (IOError, OSError), err: raise BiologicError('Unable to create %s - %s' % (strPath, str(err)))
+        self.__file = os.fdopen(fd, 'wb', Constants.cbWriteBuffer)
+        self.__writer = self.__file
+        if fCompress:
+            strName = os.path.basename(strPath)
+            if strName.endswith(Constants.extGzip):
+                strName = strName[:-len(Constants.extGzip)]
+            self.__writer = gzip.GzipFile(strName, 'wb', Constants.nCompressLevel, self.__file)
+        return
+
+    def write(self, str):
+        self.__writer.write(str)
+        return
+
+    def writelines(self, aryStrings):
+        self.__writer.writelines(aryStrings)
+        return
+
+    def commit(self):
+        if not self.__file:
+            return
+        try:
+            if self.__writer is not self.__file:
+                self.__writer.close()
+            self.__file.flush()
+            if self.fSync:
+                os.fsync(self.__file.fileno())
+            self.__file.close()
+            self.__file = None
+            os.chmod(self.strTemporary, self.nMode)
+            os.rename(self.strTemporary, self.strPath)
+        except (IOError, OSError), err:
+            self.abort()
+            raise BiologicError('Unable to create %s - %s' % (self.strPath, str(err)))
+        self.strTemporary = None
+        return
+
+    def abort(self):
+        self.__writer = None
+        if self.__file:
+            try: self.__file.close()
+            except IOError: pass
+            self.__file = None
+        if self.strTemporary:
+            try: os.remove(self.strTemporary)
+            except OSError: pass
+            self.strTemporary = None
+        return
+
 #==============================================================================
 # Global Functions
 #==============================================================================
@@ -468,7 +547,7 @@ def readEnvironment(strVariable):
 #------------------------------------------------------------------------------
 def readFile(strURL):
     try:
-        file = urllib2.urlopen(strURL)
+        file = Fetch.openURL(strURL)
         str = file.read()
         file.close()
         return str
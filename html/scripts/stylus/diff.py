@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# Stylus, Copyright 2006-2008 Biologic Institute
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+'''
+diff.py
+
+Compute the edits (as mutations) that turn one genome into another.
+
+When the second genome descends directly from the first, its recorded
+accepted mutations are the edits; this is confirmed by undoing them (see
+replay.py) and comparing the result with the first genome. Otherwise the
+bases are compared directly: matching runs are anchored by words unique to
+both genomes (starting on codon boundaries within the first), chosen in
+order by a longest increasing subsequence, and refined by trimming equal
+bases around each difference. Each edit is mapped to the strokes of the
+first genome it touches.
+
+Stylus, Copyright 2006-2008 Biologic Institute.
+'''
+
+import bisect
+import random
+
+import genome as Genome
+import replay as Replay
+
+#==============================================================================
+# Global Constants
+#==============================================================================
+class Constants:
+    basesPerCodon = 3
+
+    # Length of the words used to anchor matching runs of bases
+    cbAnchor = 12
+
+    # Bases compared at once when trimming equal bases
+    cbCompare = 64
+
+#==============================================================================
+# Classes
+#==============================================================================
+#------------------------------------------------------------------------------
+# Class: GenomeDiff
+#
+# Notes:
+# - mutations, applied in order to the first genome, yield the second
+# - Edits from the bases comparison are ordered last to first, so every index
+#   refers to the first genome; edits taken from the lineage refer to the
+#   genome as it stood when each was made, so their strokes are approximate
+#   once earlier edits insert or remove bases
+#------------------------------------------------------------------------------
+class GenomeDiff(object):
+    def __init__(self, aryMutations, fLineage, gene=None):
+        self.mutations = aryMutations
+        self.fLineage = fLineage
+        self.strokes = [ gene and _touchedStrokes(gene, mutation) or [] for mutation in aryMutations ]
+        return
+
+    def __len__(self):
+        return len(self.mutations)
+
+    #--------------------------------------------------------------------------
+    # Function: changedStrokes
+    #
+    # Return the indexes of all strokes touched by any edit
+    #--------------------------------------------------------------------------
+    def changedStrokes(self):
+        setStrokes = set()
+        for aryStrokes in self.strokes:
+            setStrokes.update(aryStrokes)
+        return sorted(setStrokes)
+
+#------------------------------------------------------------------------------
+# Function: diff
+#
+# Return the GenomeDiff between two genomes (each a Genome or genome URL)
+#------------------------------------------------------------------------------
+def diff(genomeFrom, genomeTo, fUseLineage=True):
+    if not isinstance(genomeFrom, Genome.Genome):
+        genomeFrom = Genome.Genome(genomeFrom)
+    if not isinstance(genomeTo, Genome.Genome):
+        genomeTo = Genome.Genome(genomeTo)
+
+    try: gene = genomeFrom.gene
+    except (KeyError, IndexError): gene = None
+
+    if fUseLineage:
+        aryMutations = list(genomeTo.iterAcceptedMutations())
+        if aryMutations:
+            replay = Replay.Replay(genomeTo.bases)
+            try:
+                replay.invertAll(aryMutations)
+                if replay.bases == genomeFrom.bases:
+                    return GenomeDiff(aryMutations, True, gene)
+            except Replay.ReplayError:
+                pass
+
+    return GenomeDiff(diffBases(genomeFrom.bases, genomeTo.bases), False, gene)
+
+#------------------------------------------------------------------------------
+# Function: diffBases
+#
+# Return the mutations, ordered last to first, turning one string of bases
+# into another
+#------------------------------------------------------------------------------
+def diffBases(strFrom, strTo):
+    aryGaps = []
+    aryRanges = [ (0, len(strFrom), 0, len(strTo)) ]
+    while aryRanges:
+        iFrom, iFromEnd, iTo, iToEnd = aryRanges.pop()
+
+        cb = _commonPrefix(strFrom, iFrom, iFromEnd, strTo, iTo, iToEnd)
+        iFrom += cb
+        iTo += cb
+        cb = _commonSuffix(strFrom, iFrom, iFromEnd, strTo, iTo, iToEnd)
+        iFromEnd -= cb
+        iToEnd -= cb
+        if iFrom >= iFromEnd and iTo >= iToEnd:
+            continue
+
+        aryAnchors = (iFrom < iFromEnd and iTo < iToEnd) and _findAnchors(strFrom, iFrom, iFromEnd, strTo, iTo, iToEnd) or []
+        if not aryAnchors:
+            aryGaps.append((iFrom, iFromEnd, iTo, iToEnd))
+            continue
+
+        # Each anchor matches one base; the ranges between anchors are compared in turn
+        for iFromAnchor, iToAnchor in aryAnchors:
+            aryRanges.append((iFrom, iFromAnchor, iTo, iToAnchor))
+            iFrom = iFromAnchor + 1
+            iTo = iToAnchor + 1
+        aryRanges.append((iFrom, iFromEnd, iTo, iToEnd))
+
+    aryMutations = []
+    for iFrom, iFromEnd, iTo, iToEnd in sorted(aryGaps, reverse=True):
+        cbCommon = min(iFromEnd - iFrom, iToEnd - iTo)
+        if iFromEnd - iFrom > cbCommon:
+            aryMutations.append(_makeMutation('deleted', iFrom + cbCommon, iFromEnd - iFrom - cbCommon, strFrom[iFrom+cbCommon:iFromEnd]))
+        elif iToEnd - iTo > cbCommon:
+            aryMutations.append(_makeMutation('inserted', iFrom + cbCommon, iToEnd - iTo - cbCommon, strTo[iTo+cbCommon:iToEnd]))
+
+        # Record changed bases as runs of differing bases
+        aryRuns = []
+        i = 0
+        while i < cbCommon:
+            if strFrom[iFrom+i] == strTo[iTo+i]:
+                i += 1
+                continue
+            iRun = i
+            while i < cbCommon and strFrom[iFrom+i] != strTo[iTo+i]:
+                i += 1
+            aryRuns.append(_makeMutation('changed', iFrom + iRun, i - iRun, strFrom[iFrom+iRun:iFrom+i], strTo[iTo+iRun:iTo+i]))
+        aryRuns.reverse()
+        aryMutations.extend(aryRuns)
+    return aryMutations
+
+#------------------------------------------------------------------------------
+# Function: _findAnchors
+#
+# Return, in order, pairs of positions (one in each string) of words that
+# appear exactly once within both ranges. Words within the first range start
+# on codon boundaries; those within the second may start anywhere, so shifts
+# of the reading frame still leave anchors to find.
+#------------------------------------------------------------------------------
+def _findAnchors(strFrom, iFrom, iFromEnd, strTo, iTo, iToEnd):
+    cb = Constants.cbAnchor
+    iCodon = iFrom + ((Constants.basesPerCodon - (iFrom % Constants.basesPerCodon)) % Constants.basesPerCodon)
+
+    dictFrom = {}
+    for i in xrange(iCodon, iFromEnd - cb + 1, Constants.basesPerCodon):
+        strWord = strFrom[i:i+cb]
+        dictFrom[strWord] = strWord in dictFrom and -1 or i
+    if not dictFrom:
+        return []
+
+    dictTo = {}
+    for i in xrange(iTo, iToEnd - cb + 1):
+        strWord = strTo[i:i+cb]
+        if strWord in dictFrom:
+            dictTo[strWord] = strWord in dictTo and -1 or i
+
+    aryPairs = sorted([ (dictFrom[strWord], i) for strWord, i in dictTo.iteritems() if i >= 0 and dictFrom[strWord] >= 0 ])
+    return _longestIncreasing(aryPairs)
+
+#------------------------------------------------------------------------------
+# Function: _longestIncreasing
+#
+# Return the longest subsequence of pairs (sorted by their first member)
+# whose second members also increase
+#------------------------------------------------------------------------------
+def _longestIncreasing(aryPairs):
+    aryTails = []
+    aryTailIndexes = []
+    aryPrevious = []
+    for i, (iFrom, iTo) in enumerate(aryPairs):
+        iTail = bisect.bisect_left(aryTails, iTo)
+        if iTail > 0:
+            aryPrevious.append(aryTailIndexes[iTail-1])
+        else:
+            aryPrevious.append(-1)
+        if iTail == len(aryTails):
+            aryTails.append(iTo)
+            aryTailIndexes.append(i)
+        else:
+            aryTails[iTail] = iTo
+            aryTailIndexes[iTail] = i
+
+    aryResult = []
+    if not aryTailIndexes:
+        return aryResult
+    i = aryTailIndexes[-1]
+    while i >= 0:
+        aryResult.append(aryPairs[i])
+        i = aryPrevious[i]
+    aryResult.reverse()
+    return aryResult
+
+def _commonPrefix(strFrom, iFrom, iFromEnd, strTo, iTo, iToEnd):
+    cbMax = min(iFromEnd - iFrom, iToEnd - iTo)
+    cb = 0
+    while cb + Constants.cbCompare <= cbMax and strFrom[iFrom+cb:iFrom+cb+Constants.cbCompare] == strTo[iTo+cb:iTo+cb+Constants.cbCompare]:
+        cb += Constants.cbCompare
+    while cb < cbMax and strFrom[iFrom+cb] == strTo[iTo+cb]:
+        cb += 1
+    return cb
+
+def _commonSuffix(strFrom, iFrom, iFromEnd, strTo, iTo, iToEnd):
+    cbMax = min(iFromEnd - iFrom, iToEnd - iTo)
+    cb = 0
+    while cb + Constants.cbCompare <= cbMax and strFrom[iFromEnd-cb-Constants.cbCompare:iFromEnd-cb] == strTo[iToEnd-cb-Constants.cbCompare:iToEnd-cb]:
+        cb += Constants.cbCompare
+    while cb < cbMax and strFrom[iFromEnd-cb-1] == strTo[iToEnd-cb-1]:
+        cb += 1
+    return cb
+
+def _makeMutation(tag, iTarget, cBases, strBases, strBasesAfter=None):
+    dictMutation = { 'targetIndex' : iTarget + 1, 'countBases' : cBases, 'bases' : strBases }
+    if strBasesAfter is not None:
+        dictMutation['basesAfter'] = strBasesAfter
+    return Genome.Mutation(tag, dictMutation)
+
+#------------------------------------------------------------------------------
+# Function: _touchedStrokes
+#
+# Return the strokes whose bases a mutation removes or alters, or before
+# whose bases it inserts new ones
+#------------------------------------------------------------------------------
+def _touchedStrokes(gene, mutation):
+    aryRanges = []
+    if mutation.tag in ('changed', 'deleted'):
+        aryRanges.append(Genome.Range(baseFirst=mutation.targetIndex, baseLast=mutation.targetIndex + mutation.countBases - 1))
+    else:
+        aryRanges.append(Genome.Range(baseFirst=mutation.targetIndex, baseLast=mutation.targetIndex))
+    if mutation.tag == 'transposed':
+        aryRanges.append(Genome.Range(baseFirst=mutation.sourceIndex, baseLast=mutation.sourceIndex + mutation.countBases - 1))
+
+    setStrokes = set()
+    for rg in aryRanges:
+        setStrokes.update(gene.findStrokes(rg))
+    return sorted(setStrokes)
+
+if __name__ == '__main__':
+    # Ensure the edits found, applied in order, turn one string of bases into the other
+    random.seed(1)
+    for i in xrange(200):
+        aryBases = [ random.choice('TCAG') for j in xrange(random.randint(0, 600)) ]
+        strFrom = ''.join(aryBases)
+        for j in xrange(random.randint(0, 8)):
+            iTarget = random.randint(0, len(aryBases))
+            nChoice = random.randint(0, 2)
+            if nChoice == 0:
+                aryBases[iTarget:iTarget+random.randint(1, 30)] = []
+            elif nChoice == 1:
+                aryBases[iTarget:iTarget] = [ random.choice('TCAG') for k in xrange(random.randint(1, 30)) ]
+            else:
+                aryBases[iTarget:iTarget+3] = [ random.choice('TCAG') for k in xrange(3) ]
+        strTo = ''.join(aryBases)
+
+        replay = Replay.Replay(strFrom)
+        replay.applyAll(diffBases(strFrom, strTo))
+        assert(replay.bases == strTo)
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# Stylus, Copyright 2006-2008 Biologic Institute
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+'''
+diskcache.py
+
+A size-bounded directory of cached entries keyed by arbitrary strings.
+
+Each entry is one file named by the SHA-1 of its key. Entries are written
+to a temporary file and renamed into place, so concurrent readers see
+either the previous entry or the complete new one, never a partial file.
+Reading an entry refreshes its modification time; when the directory grows
+past its size limit the least recently used entries are removed.
+
+Stylus, Copyright 2006-2008 Biologic Institute.
+'''
+
+import errno
+import hashlib
+import os
+import tempfile
+
+#==============================================================================
+# Global Constants
+#==============================================================================
+class Constants:
+    extEntry = '.entry'
+    extTemporary = '.tmp'
+
+    # Size limit used when none is given
+    cbDefault = 64 * 1024 * 1024
+
+    # Percentage of the size limit to which eviction trims the cache
+    nTrimPercent = 90
+
+#==============================================================================
+# Classes
+#==============================================================================
+#------------------------------------------------------------------------------
+# Class: DiskCacheError
+#
+#------------------------------------------------------------------------------
+class DiskCacheError(Exception):
+    def __init__(self, msg):
+        self.msg = ''
+        if msg and len(msg) > 0:
+            self.msg = 'Error: ' + msg
+
+    def __str__(self):
+        return self.msg
+
+#------------------------------------------------------------------------------
+# Class: DiskCache
+#
+# Notes:
+# - Failures to read or write entries are treated as misses; a cache never
+#   prevents a caller from reaching the original data
+# - Eviction scans the directory, so it runs only after the bytes written
+#   since the last scan could have pushed the cache past its limit; each scan
+#   trims the cache to below its limit to leave room for further writes
+#------------------------------------------------------------------------------
+class DiskCache(object):
+    def __init__(self, strPath, cbMax=Constants.cbDefault):
+        self.strPath = strPath
+        self.cbMax = cbMax
+        self.__cbWritten = cbMax
+
+        if not os.path.exists(strPath):
+            try: os.makedirs(strPath)
+            except OSError, err:
+                if err.errno != errno.EEXIST:
+                    raise DiskCacheError('Unable to create cache directory %s - %s' % (strPath, str(err)))
+        return
+
+    def __toPath(self, strKey):
+        return os.path.join(self.strPath, hashlib.sha1(strKey).hexdigest() + Constants.extEntry)
+
+    def get(self, strKey):
+        strPath = self.__toPath(strKey)
+        try:
+            fileEntry = open(strPath, 'rb')
+            try: strData = fileEntry.read()
+            finally: fileEntry.close()
+        except (IOError, OSError):
+            return None
+
+        try: os.utime(strPath, None)
+        except OSError: pass
+        return strData
+
+    def put(self, strKey, strData):
+        try:
+            fd, strTemporary = tempfile.mkstemp(Constants.extTemporary, '', self.strPath)
+        except (IOError, OSError):
+            return False
+
+        try:
+            fileEntry = os.fdopen(fd, 'wb')
+            try: fileEntry.write(strData)
+            finally: fileEntry.close()
+            os.chmod(strTemporary, 0664)
+            os.rename(strTemporary, self.__toPath(strKey))
+        except (IOError, OSError):
+            try: os.remove(strTemporary)
+            except OSError: pass
+            return False
+
+        self.__cbWritten += len(strData)
+        if self.__cbWritten >= self.cbMax:
+            self.evict()
+        return True
+
+    def remove(self, strKey):
+        try: os.remove(self.__toPath(strKey))
+        except OSError: pass
+        return
+
+    #--------------------------------------------------------------------------
+    # Function: evict
+    #
+    # Remove the least recently used entries until the cache fits within its
+    # limit, returning the number of entries removed.
+    #--------------------------------------------------------------------------
+    def evict(self):
+        aryEntries = []
+        cbTotal = 0
+        try: aryFiles = os.listdir(self.strPath)
+        except OSError: return 0
+
+        for f in aryFiles:
+            if not f.endswith(Constants.extEntry):
+                continue
+            try: st = os.stat(os.path.join(self.strPath, f))
+            except OSError: continue
+            aryEntries.append((st.st_mtime, st.st_size, f))
+            cbTotal += st.st_size
+
+        cEvicted = 0
+        if cbTotal > self.cbMax:
+            cbTarget = (self.cbMax * Constants.nTrimPercent) // 100
+            aryEntries.sort()
+            for tmModified, cbEntry, f in aryEntries:
+                if cbTotal <= cbTarget:
+                    break
+                try: os.remove(os.path.join(self.strPath, f))
+                except OSError: continue
+                cbTotal -= cbEntry
+                cEvicted += 1
+
+        self.__cbWritten = cbTotal
+        return cEvicted
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,792 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# Stylus, Copyright 2006-2008 Biologic Institute
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+'''
+fetch.py
+
+Read documents from http URLs over persistent connections.
+
+Each host keeps a few idle (keep-alive) connections that later requests
+reuse, so fetching many Han definitions from one server costs a single
+connection rather than one per file. Requests failing for transient
+reasons (refused or dropped connections, 5xx responses) are retried after
+a delay that doubles with each attempt. A pool of threads can fetch a list
+of URLs ahead of their use; later reads of those URLs wait for, and take,
+the prefetched documents.
+
+Fetched documents may also be kept in a mirror on local disk (see Mirror);
+mirrored documents are revalidated with conditional requests (or, within a
+configured time, reused without asking the server), so repeated runs
+download only what changed.
+
+URLs with other schemes are opened with urllib2.
+
+Documents whose names end in .gz are decompressed as they are read, and a
+document missing from its URL is sought, compressed, under the same URL
+with .gz appended; readers see the same text either way. A URL naming a zip
+archive with a fragment (archive.zip#member) refers to that member of the
+archive.
+
+Stylus, Copyright 2006-2008 Biologic Institute.
+'''
+
+import atexit
+import BaseHTTPServer
+import collections
+import diskcache as DiskCache
+import gzip
+import httplib
+import os
+import Queue
+import shutil
+import SimpleHTTPServer
+import socket
+import SocketServer
+import StringIO
+import tempfile
+import threading
+import time
+import urllib2
+import urlparse
+import zipfile
+import zlib
+
+#==============================================================================
+# Global Constants
+#==============================================================================
+class Constants:
+    schemeHTTP = 'http'
+    schemeHTTPS = 'https'
+    schemeFile = 'file'
+
+    extGzip = '.gz'
+    extZip = '.zip'
+    chMember = '#'
+
+    # Zip archives kept open for reading members
+    cArchives = 8
+
+    # Compressed bytes read at once when decompressing
+    cbReadChunk = 65536
+
+    # Attempts made for each request and the delay (doubled after each failure) between them
+    cAttempts = 4
+    secBackoff = 0.25
+
+    secTimeout = 30
+    cRedirects = 5
+
+    # Idle connections kept per host and threads used to prefetch documents
+    cIdlePerHost = 4
+    cWorkers = 8
+
+    # Prefetched documents held at once and the seconds each is held once fetched
+    cPrefetched = 256
+    secPrefetched = 60
+
+    # Response codes worth retrying
+    setRetryCodes = set([ 500, 502, 503, 504 ])
+    setRedirectCodes = set([ 301, 302, 303, 307 ])
+    codeNotModified = 304
+
+    # Precedes the validators within each mirror entry (changing the entry layout requires changing this)
+    strMirrorTag = 'MIRROR1'
+    chSeparator = '\n'
+
+#==============================================================================
+# Classes
+#==============================================================================
+#------------------------------------------------------------------------------
+# Class: ConnectionPool
+#
+# Notes:
+# - Connections are keyed by scheme and host (with port); a connection is
+#   returned to the pool only after its response is read in full and the
+#   server did not ask to close it
+# - A request failing on a reused connection is retried at once on a new
+#   one, without counting as an attempt, since servers may close idle
+#   connections at any time
+# - connections counts the connections opened, requests the requests made
+#------------------------------------------------------------------------------
+class ConnectionPool(object):
+    def __init__(self, cIdlePerHost=Constants.cIdlePerHost, secTimeout=Constants.secTimeout):
+        self.cIdlePerHost = cIdlePerHost
+        self.secTimeout = secTimeout
+        self.connections = 0
+        self.requests = 0
+
+        self.__dictIdle = {}
+        self.__lock = threading.Lock()
+        return
+
+    def __acquire(self, key):
+        self.__lock.acquire()
+        try:
+            aryIdle = self.__dictIdle.get(key)
+            if aryIdle:
+                return aryIdle.pop(), True
+        finally:
+            self.__lock.release()
+        return self.__connect(key), False
+
+    def __connect(self, key):
+        self.__lock.acquire()
+        try: self.connections += 1
+        finally: self.__lock.release()
+
+        strScheme, strHost = key
+        if strScheme == Constants.schemeHTTPS:
+            return httplib.HTTPSConnection(strHost, timeout=self.secTimeout)
+        return httplib.HTTPConnection(strHost, timeout=self.secTimeout)
+
+    def __release(self, key, connection):
+        self.__lock.acquire()
+        try:
+            aryIdle = self.__dictIdle.setdefault(key, [])
+            if len(aryIdle) < self.cIdlePerHost:
+                aryIdle.append(connection)
+                return
+        finally:
+            self.__lock.release()
+        connection.close()
+        return
+
+    def __request(self, key, strPath, dictHeaders):
+        connection, fReused = self.__acquire(key)
+        try:
+            connection.request('GET', strPath, headers=dictHeaders)
+            response = connection.getresponse()
+            strBody = response.read()
+        except (httplib.HTTPException, socket.error):
+            connection.close()
+            if not fReused:
+                raise
+            connection = self.__connect(key)
+            try:
+                connection.request('GET', strPath, headers=dictHeaders)
+                response = connection.getresponse()
+                strBody = response.read()
+            except (httplib.HTTPException, socket.error):
+                connection.close()
+                raise
+
+        if response.will_close:
+            connection.close()
+        else:
+            self.__release(key, connection)
+        return response, strBody
+
+    #--------------------------------------------------------------------------
+    # Function: fetch
+    #
+    # Return the body of the document at an http URL (see request)
+    #--------------------------------------------------------------------------
+    def fetch(self, url):
+        return self.request(url)[1]
+
+    #--------------------------------------------------------------------------
+    # Function: request
+    #
+    # Return the response and body for an http URL, passing any extra request
+    # headers, and raising urllib2.HTTPError for responses other than success
+    # or not modified (once any retries are spent) and urllib2.URLError if the
+    # server cannot be reached
+    #--------------------------------------------------------------------------
+    def request(self, url, dictHeaders={}):
+        cRedirects = 0
+        cAttempts = 0
+        while True:
+            aryURL = urlparse.urlsplit(url)
+            key = (aryURL[0].lower(), aryURL[1])
+            strPath = urlparse.urlunsplit(('', '', aryURL[2] or '/', aryURL[3], ''))
+
+            cAttempts += 1
+            self.requests += 1
+            try:
+                response, strBody = self.__request(key, strPath, dictHeaders)
+            except (httplib.HTTPException, socket.error), err:
+                if cAttempts >= Constants.cAttempts:
+                    raise urllib2.URLError(err)
+                time.sleep(Constants.secBackoff * (2 ** (cAttempts-1)))
+                continue
+
+            if 200 <= response.status < 300 or response.status == Constants.codeNotModified:
+                return response, strBody
+
+            if response.status in Constants.setRedirectCodes and response.getheader('location') and cRedirects < Constants.cRedirects:
+                url = urlparse.urljoin(url, response.getheader('location'))
+                cRedirects += 1
+                cAttempts = 0
+                continue
+
+            if response.status in Constants.setRetryCodes and cAttempts < Constants.cAttempts:
+                time.sleep(Constants.secBackoff * (2 ** (cAttempts-1)))
+                continue
+
+            raise urllib2.HTTPError(url, response.status, response.reason, response.msg, None)
+
+    def close(self):
+        self.__lock.acquire()
+        try:
+            aryConnections = [ connection for aryIdle in self.__dictIdle.itervalues() for connection in aryIdle ]
+            self.__dictIdle = {}
+        finally:
+            self.__lock.release()
+        for connection in aryConnections:
+            connection.close()
+        return
+
+#------------------------------------------------------------------------------
+# Class: Prefetcher
+#
+# Notes:
+# - Each URL prefetched is held, once fetched, until taken (see take) or for
+#   secHeld seconds, whichever comes first, so documents never taken do not
+#   stand in for later fetches; the failure of a prefetch is held likewise
+#   and raised when taken
+# - At most cHeld URLs are held (fetched or not) at once; URLs prefetched
+#   beyond that are ignored and fetched when opened
+# - Worker threads start with the first prefetch and run as daemons, so they
+#   never hold the process open; close (called at exit for the module's own
+#   Prefetcher) drops the URLs held and stops the workers, so none is left
+#   running as the interpreter shuts down
+#------------------------------------------------------------------------------
+class Prefetcher(object):
+    def __init__(self, fnFetch, cWorkers=Constants.cWorkers, cHeld=Constants.cPrefetched, secHeld=Constants.secPrefetched):
+        self.fnFetch = fnFetch
+        self.cWorkers = cWorkers
+        self.cHeld = cHeld
+        self.secHeld = secHeld
+
+        self.__dictPending = {}
+        self.__lock = threading.Lock()
+        self.__queue = Queue.Queue()
+        self.__aryThreads = []
+        return
+
+    def __work(self):
+        while True:
+            url = self.__queue.get()
+            if url is None:
+                return
+            self.__lock.acquire()
+            try: aryEntry = self.__dictPending.get(url)
+            finally: self.__lock.release()
+            if aryEntry:
+                try: aryEntry[1] = self.fnFetch(url)
+                except Exception, err: aryEntry[2] = err
+                aryEntry[3] = time.time()
+                aryEntry[0].set()
+
+    # Drop documents held past secHeld (the caller holds the lock)
+    def __expire(self):
+        tmExpired = time.time() - self.secHeld
+        for url, aryEntry in self.__dictPending.items():
+            if aryEntry[0].isSet() and aryEntry[3] < tmExpired:
+                del self.__dictPending[url]
+        return
+
+    def prefetch(self, urls):
+        self.__lock.acquire()
+        try:
+            self.__expire()
+            for url in urls:
+                if len(self.__dictPending) >= self.cHeld:
+                    break
+                if not url in self.__dictPending:
+                    self.__dictPending[url] = [ threading.Event(), None, None, None ]
+                    self.__queue.put(url)
+            while len(self.__aryThreads) < self.cWorkers:
+                thread = threading.Thread(target=self.__work)
+                thread.setDaemon(True)
+                thread.start()
+                self.__aryThreads.append(thread)
+        finally:
+            self.__lock.release()
+        return
+
+    #--------------------------------------------------------------------------
+    # Function: take
+    #
+    # Return what fnFetch returned for a prefetched URL (waiting for it if
+    # necessary), or None if the URL was not prefetched or was held too long
+    #--------------------------------------------------------------------------
+    def take(self, url):
+        self.__lock.acquire()
+        try:
+            self.__expire()
+            aryEntry = self.__dictPending.get(url)
+        finally:
+            self.__lock.release()
+        if not aryEntry:
+            return None
+
+        aryEntry[0].wait()
+        self.__lock.acquire()
+        try: self.__dictPending.pop(url, None)
+        finally: self.__lock.release()
+        if aryEntry[2]:
+            raise aryEntry[2]
+        return aryEntry[1]
+
+    def close(self):
+        self.__lock.acquire()
+        try:
+            self.__dictPending = {}
+            aryThreads = self.__aryThreads
+            self.__aryThreads = []
+            for thread in aryThreads:
+                self.__queue.put(None)
+        finally:
+            self.__lock.release()
+        for thread in aryThreads:
+            thread.join(Constants.secTimeout)
+        return
+
+#------------------------------------------------------------------------------
+# Class: GzipReader
+#
+# Decompress a gzip stream while reading it. Unlike gzip.GzipFile, the source
+# need only support read, so http and other unseekable streams are handled.
+#------------------------------------------------------------------------------
+class GzipReader(object):
+    def __init__(self, fileSource):
+        self.__file = fileSource
+        self.__decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self.__aryPieces = []
+        self.__cbPieces = 0
+        self.__fEnd = False
+        return
+
+    def __fill(self):
+        strCompressed = self.__file.read(Constants.cbReadChunk)
+        if not strCompressed:
+            strData = self.__decompressor.flush()
+            self.__fEnd = True
+        else:
+            try:
+                strData = self.__decompressor.decompress(strCompressed)
+
+                # Concatenated members each begin a new stream
+                while self.__decompressor.unused_data:
+                    strUnused = self.__decompressor.unused_data
+                    self.__decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                    strData += self.__decompressor.decompress(strUnused)
+            except zlib.error, err: raise IOError('Unable to decompress - %s' % str(err))
+        if strData:
+            self.__aryPieces.append(strData)
+            self.__cbPieces += len(strData)
+        return
+
+    def read(self, cb=-1):
+        while not self.__fEnd and (cb < 0 or self.__cbPieces < cb):
+            self.__fill()
+        strData = ''.join(self.__aryPieces)
+        if cb < 0 or cb >= len(strData):
+            self.__aryPieces = []
+            self.__cbPieces = 0
+            return strData
+        self.__aryPieces = [ strData[cb:] ]
+        self.__cbPieces = len(strData) - cb
+        return strData[:cb]
+
+    def readlines(self):
+        return self.read().splitlines(True)
+
+    def __iter__(self):
+        return iter(self.readlines())
+
+    def close(self):
+        self.__file.close()
+        return
+
+#------------------------------------------------------------------------------
+# Class: Mirror
+#
+# Notes:
+# - Entries hold the URL, its ETag and Last-Modified validators, and the time
+#   of the last check ahead of the document, all within a DiskCache (which
+#   bounds the mirror's size, evicting the least recently used entries)
+# - Entries checked within secFresh seconds are used without asking the
+#   server; older ones are revalidated with a conditional request, and a
+#   not modified response renews the entry
+# - If the server cannot be reached, a mirrored document is used however old
+# - hits counts documents used without transferring them, misses those
+#   downloaded
+#------------------------------------------------------------------------------
+class Mirror(object):
+    def __init__(self, strPath, cbMax=DiskCache.Constants.cbDefault, secFresh=0, pool=None):
+        self.__cache = DiskCache.DiskCache(strPath, cbMax)
+        self.secFresh = secFresh
+        self.pool = pool or _pool
+        self.hits = 0
+        self.misses = 0
+        return
+
+    def __read(self, url):
+        strEntry = self.__cache.get(url)
+        if not strEntry:
+            return None
+        aryParts = strEntry.split(Constants.chSeparator, 5)
+        if len(aryParts) != 6 or aryParts[0] != Constants.strMirrorTag or aryParts[1] != url:
+            return None
+        try: tmChecked = float(aryParts[4])
+        except ValueError: return None
+        return aryParts[2], aryParts[3], tmChecked, aryParts[5]
+
+    def __write(self, url, strETag, strModified, strBody):
+        self.__cache.put(url, Constants.chSeparator.join([ Constants.strMirrorTag, url, strETag, strModified, repr(time.time()), strBody ]))
+        return
+
+    def fetch(self, url):
+        entry = self.__read(url)
+        dictHeaders = {}
+        if entry:
+            strETag, strModified, tmChecked, strBody = entry
+            if time.time() - tmChecked < self.secFresh:
+                self.hits += 1
+                return strBody
+            if strETag:
+                dictHeaders['If-None-Match'] = strETag
+            if strModified:
+                dictHeaders['If-Modified-Since'] = strModified
+
+        try: response, strResponse = self.pool.request(url, dictHeaders)
+        except urllib2.HTTPError:
+            raise
+        except urllib2.URLError:
+            if not entry:
+                raise
+            self.hits += 1
+            return strBody
+
+        if response.status == Constants.codeNotModified and entry:
+            self.__write(url, strETag, strModified, strBody)
+            self.hits += 1
+            return strBody
+
+        self.__write(url, response.getheader('etag') or '', response.getheader('last-modified') or '', strResponse)
+        self.misses += 1
+        return strResponse
+
+#------------------------------------------------------------------------------
+# Class: _ArchiveCache
+#
+# Notes:
+# - Keeps the most recently read zip archives open, so reading many members
+#   parses each archive's directory once
+# - Local archives are reopened when their size or modification time
+#   changes; http archives are fetched (see fetch) once
+# - Reads are serialized since archives fetched over http share one
+#   in-memory file
+#------------------------------------------------------------------------------
+class _ArchiveCache(object):
+    def __init__(self, cMax=Constants.cArchives):
+        self.cMax = cMax
+        self.__dictArchives = collections.OrderedDict()
+        self.__lock = threading.Lock()
+        return
+
+    def __open(self, urlArchive):
+        if isHTTP(urlArchive):
+            strKey = urlArchive
+            identity = None
+        else:
+            strKey = urllib2.url2pathname(urlparse.urlsplit(urlArchive)[2])
+            try: st = os.stat(strKey)
+            except OSError, err: raise urllib2.URLError(err)
+            identity = (st.st_size, st.st_mtime)
+
+        entry = self.__dictArchives.pop(strKey, None)
+        if entry and entry[0] != identity:
+            entry[1].close()
+            entry = None
+        if not entry:
+            try: zf = zipfile.ZipFile(identity and strKey or StringIO.StringIO(fetch(urlArchive)))
+            except (zipfile.BadZipfile, zipfile.LargeZipFile), err: raise IOError('%s is not a readable zip archive - %s' % (urlArchive, str(err)))
+            entry = (identity, zf)
+            while len(self.__dictArchives) >= self.cMax:
+                self.__dictArchives.popitem(last=False)[1][1].close()
+        self.__dictArchives[strKey] = entry
+        return entry[1]
+
+    def read(self, urlArchive, strMember):
+        self.__lock.acquire()
+        try:
+            zf = self.__open(urlArchive)
+            try: return zf.read(strMember)
+            except KeyError: raise urllib2.URLError('%s does not contain %s' % (urlArchive, strMember))
+            except (zipfile.BadZipfile, zlib.error), err: raise IOError('Unable to read %s from %s - %s' % (strMember, urlArchive, str(err)))
+        finally:
+            self.__lock.release()
+
+_pool = ConnectionPool()
+_mirror = None
+_archives = _ArchiveCache()
+
+def _fetchHTTP(url):
+    if _mirror:
+        return _mirror.fetch(url)
+    return _pool.fetch(url)
+
+# Return the URL found (the URL passed or, if that is missing, its compressed copy) and its body
+def _fetchFound(url):
+    try: return url, _fetchHTTP(url)
+    except urllib2.HTTPError, err:
+        if err.code != 404 or isCompressed(url):
+            raise
+        try: return url + Constants.extGzip, _fetchHTTP(url + Constants.extGzip)
+        except urllib2.HTTPError: raise err
+
+_prefetcher = Prefetcher(_fetchFound)
+atexit.register(_prefetcher.close)
+
+#------------------------------------------------------------------------------
+# Function: setMirror
+#
+# Keep documents fetched from now on within the passed Mirror (or, if None,
+# stop mirroring), returning the previous Mirror
+#------------------------------------------------------------------------------
+def setMirror(mirror):
+    global _mirror
+    mirrorPrevious = _mirror
+    _mirror = mirror
+    return mirrorPrevious
+
+#------------------------------------------------------------------------------
+# Function: isHTTP
+#
+#------------------------------------------------------------------------------
+def isHTTP(url):
+    return urlparse.urlsplit(url)[0].lower() in (Constants.schemeHTTP, Constants.schemeHTTPS)
+
+def isCompressed(url):
+    return urlparse.urlsplit(url)[2].endswith(Constants.extGzip)
+
+def isMember(url):
+    aryURL = urlparse.urlsplit(url)
+    return bool(aryURL[4]) and aryURL[2].lower().endswith(Constants.extZip)
+
+#------------------------------------------------------------------------------
+# Function: pathToURL
+#
+# Return the file URL of an absolute, ./ relative, or ~ path (URLs, and other
+# paths, are returned unchanged)
+#------------------------------------------------------------------------------
+def pathToURL(strPath):
+    if strPath[:1] == '.':
+        strPath = os.getcwd() + strPath[1:]
+    else:
+        strPath = os.path.expanduser(strPath)
+    if os.path.isabs(strPath):
+        strPath = urlparse.urljoin(Constants.schemeFile + '://', strPath)
+    return strPath
+
+#------------------------------------------------------------------------------
+# Function: makeMemberURL
+#
+# Return the URL of a member (named by its path within the archive) of the
+# zip archive at a URL
+#------------------------------------------------------------------------------
+def makeMemberURL(urlArchive, strMember):
+    return urlArchive + Constants.chMember + urllib2.quote(strMember)
+
+#------------------------------------------------------------------------------
+# Function: findURL
+#
+# Return the URL of a local file or, if the file is missing but a compressed
+# copy exists, the URL of the copy (other URLs are returned unchanged)
+#------------------------------------------------------------------------------
+def findURL(url):
+    aryURL = urlparse.urlsplit(url)
+    if aryURL[0].lower() != Constants.schemeFile or isCompressed(url):
+        return url
+    strPath = urllib2.url2pathname(aryURL[2])
+    if not os.path.exists(strPath) and os.path.exists(strPath + Constants.extGzip):
+        return urlparse.urlunsplit((aryURL[0], aryURL[1], aryURL[2] + Constants.extGzip, aryURL[3], aryURL[4]))
+    return url
+
+#------------------------------------------------------------------------------
+# Function: fetch
+#
+# Return the (decompressed) document at a URL (see openURL)
+#------------------------------------------------------------------------------
+def fetch(url):
+    fileURL = openURL(url)
+    try: return fileURL.read()
+    finally: fileURL.close()
+
+#------------------------------------------------------------------------------
+# Function: prefetch
+#
+# Begin fetching the http URLs passed (others are ignored) in the background
+#------------------------------------------------------------------------------
+def prefetch(urls):
+    urls = [ url for url in urls if isHTTP(url) ]
+    if urls:
+        _prefetcher.prefetch(urls)
+    return
+
+#------------------------------------------------------------------------------
+# Function: openURL
+#
+# Return a file-like object for the document at a URL; http documents are
+# fetched in full (taking them from those prefetched if present), other URLs
+# opened with urllib2, members of zip archives read whole, and compressed
+# documents decompressed as read
+#------------------------------------------------------------------------------
+def openURL(url):
+    if isMember(url):
+        aryURL = urlparse.urlsplit(url)
+        strMember = urllib2.unquote(aryURL[4])
+        fileURL = StringIO.StringIO(_archives.read(urlparse.urlunsplit(aryURL[:4] + ('',)), strMember))
+        if strMember.endswith(Constants.extGzip):
+            return GzipReader(fileURL)
+        return fileURL
+
+    url = findURL(url)
+    if not isHTTP(url):
+        fileURL = urllib2.urlopen(url)
+    else:
+        urlBody = _prefetcher.take(url)
+        if urlBody is None:
+            urlBody = _fetchFound(url)
+        url, strBody = urlBody
+        fileURL = StringIO.StringIO(strBody)
+
+    if isCompressed(url):
+        return GzipReader(fileURL)
+    return fileURL
+
+if __name__ == '__main__':
+    # Serve a directory locally and ensure documents arrive intact, over a single reused
+    # connection, with transient failures retried and prefetched documents taken
+    strRoot = tempfile.mkdtemp()
+    dictFailures = { '/flaky.txt' : 2 }
+
+    class Handler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def translate_path(self, strPath):
+            return os.path.join(strRoot, strPath.lstrip('/'))
+
+        def do_GET(self):
+            if dictFailures.get(self.path):
+                dictFailures[self.path] -= 1
+                self.send_response(503)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            strPath = self.translate_path(self.path)
+            if os.path.isfile(strPath) and self.headers.get('If-Modified-Since') == self.date_time_string(os.stat(strPath).st_mtime):
+                self.send_response(Constants.codeNotModified)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            return SimpleHTTPServer.SimpleHTTPRequestHandler.do_GET(self)
+
+        def log_message(self, *args):
+            pass
+
+    class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+        daemon_threads = True
+
+    try:
+        for i in xrange(20):
+            fileText = open(os.path.join(strRoot, '%d.txt' % i), 'wb')
+            fileText.write(str(i) * (i * 1000))
+            fileText.close()
+        shutil.copy(os.path.join(strRoot, '3.txt'), os.path.join(strRoot, 'flaky.txt'))
+
+        server = Server(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+        urlBase = 'http://127.0.0.1:%d/' % server.server_address[1]
+        Constants.secBackoff = 0.01
+
+        for i in xrange(20):
+            assert(fetch(urlBase + '%d.txt' % i) == str(i) * (i * 1000))
+        assert(_pool.connections == 1)
+
+        assert(fetch(urlBase + 'flaky.txt') == '3' * 3000)
+
+        try:
+            fetch(urlBase + 'missing.txt')
+            assert(False)
+        except urllib2.HTTPError, err:
+            assert(err.code == 404)
+
+        aryURLs = [ urlBase + '%d.txt' % i for i in xrange(20) ]
+        prefetch(aryURLs)
+        for i, url in enumerate(aryURLs):
+            assert(openURL(url).read() == str(i) * (i * 1000))
+        assert(_prefetcher.take(aryURLs[0]) is None)
+
+        # Documents prefetched but never taken expire, rather than answer later fetches
+        _prefetcher.secHeld = 0.2
+        prefetch([ aryURLs[1] ])
+        time.sleep(0.1)
+        fileText = open(os.path.join(strRoot, '1.txt'), 'wb')
+        fileText.write('changed')
+        fileText.close()
+        time.sleep(0.5)
+        assert(fetch(aryURLs[1]) == 'changed')
+        _prefetcher.secHeld = Constants.secPrefetched
+
+        # Compressed documents are decompressed, and found when asked for without .gz
+        fileGzip = gzip.open(os.path.join(strRoot, 'packed.txt.gz'), 'wb')
+        fileGzip.write('packed\n' * 50000)
+        fileGzip.close()
+        assert(fetch(urlBase + 'packed.txt') == 'packed\n' * 50000)
+        prefetch([ urlBase + 'packed.txt' ])
+        assert(fetch(urlBase + 'packed.txt') == 'packed\n' * 50000)
+        assert(len(openURL('file://' + os.path.join(strRoot, 'packed.txt')).readlines()) == 50000)
+
+        # Members of zip archives are read by name, whether the archive is local or served
+        zf = zipfile.ZipFile(os.path.join(strRoot, 'packed.zip'), 'w', zipfile.ZIP_DEFLATED)
+        for i in xrange(5):
+            zf.writestr('4000/%d member.txt' % i, str(i) * 1000)
+        zf.close()
+        for urlArchive in [ 'file://' + os.path.join(strRoot, 'packed.zip'), urlBase + 'packed.zip' ]:
+            for i in xrange(5):
+                assert(fetch(makeMemberURL(urlArchive, '4000/%d member.txt' % i)) == str(i) * 1000)
+            try:
+                fetch(makeMemberURL(urlArchive, 'missing.txt'))
+                assert(False)
+            except urllib2.URLError:
+                pass
+
+        # Mirrored documents are revalidated (the server answers not modified) unless fresh
+        mirror = Mirror(os.path.join(strRoot, 'mirror'))
+        setMirror(mirror)
+        assert(fetch(urlBase + '5.txt') == '5' * 5000 and mirror.misses == 1)
+        assert(fetch(urlBase + '5.txt') == '5' * 5000 and mirror.hits == 1)
+        fileText = open(os.path.join(strRoot, '5.txt'), 'wb')
+        fileText.write('changed')
+        fileText.close()
+        os.utime(os.path.join(strRoot, '5.txt'), (time.time() + 10, time.time() + 10))
+        assert(fetch(urlBase + '5.txt') == 'changed' and mirror.misses == 2)
+        mirror.secFresh = 60
+        cRequests = _pool.requests
+        assert(fetch(urlBase + '5.txt') == 'changed' and _pool.requests == cRequests)
+        setMirror(None)
+
+        _pool.close()
+        server.shutdown()
+        server.server_close()
+    finally:
+        shutil.rmtree(strRoot)
@@ -0,0 +1,410 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# Stylus, Copyright 2006-2008 Biologic Institute
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+'''
+genearchive.py
+
+Collect gene files into zip archives rather than one file apiece.
+
+Genes are appended, as compressed members named by their usual relative
+path (e.g., 4000/4E8C.gene), to one archive or to a series of archives of
+bounded size. An index beside the archives maps each gene name to the URL
+of its member (archive.zip#member), which readers (see fetch.py) open as
+they would a gene file.
+
+Stylus, Copyright 2006-2008 Biologic Institute.
+'''
+
+import glob
+import os
+import re
+import shutil
+import tempfile
+import time
+import urlparse
+import warnings
+import zipfile
+
+import fetch as Fetch
+
+#==============================================================================
+# Global Constants
+#==============================================================================
+class Constants:
+    extArchive = '.zip'
+    extIndex = '.index'
+    extTemporary = '.tmp'
+
+    # Shards are named <stem>.<number><extension> (e.g., genes.0003.zip)
+    fmtShard = '%s.%04d%s'
+    reShard = re.compile(r'.*\.(\d{4})\.[^.]*$')
+
+    # Index lines hold a gene name, the URL (relative to the index) of its member, and,
+    # if given, the hash of the inputs from which the gene was built
+    chSeparator = '\t'
+
+    nMode = 0664
+
+#==============================================================================
+# Classes
+#==============================================================================
+#------------------------------------------------------------------------------
+# Class: GeneArchiveError
+#
+#------------------------------------------------------------------------------
+class GeneArchiveError(Exception):
+    def __init__(self, msg):
+        self.msg = ''
+        if msg and len(msg) > 0:
+            self.msg = 'Error: ' + msg
+
+    def __str__(self):
+        return self.msg
+
+#------------------------------------------------------------------------------
+# Class: GeneArchiveWriter
+#
+# Notes:
+# - Without cbShard all genes go to strPath; with it, they go to a series of
+#   archives (genes.0000.zip, genes.0001.zip, ...), each begun once the one
+#   before passes cbShard bytes
+# - The index (e.g., genes.index) is read on open and rewritten on close, so
+#   later runs add to the archives of earlier runs; it also records the
+#   input hash given with each gene, so callers can skip unchanged genes
+#   without reading archives that may be partly written
+# - Adding a gene again indexes the new member in place of the old; archives
+#   are copied, without the members no longer indexed, when appended to and
+#   (for those holding members replaced since) on close, so they do not grow
+#   with each rebuild
+# - Each archive is written to a temporary copy that replaces it, so archives
+#   (and the genes of earlier runs) stay intact, though without the genes
+#   added since, should the writer never close
+#------------------------------------------------------------------------------
+class GeneArchiveWriter(object):
+    def __init__(self, strPath, cbShard=0):
+        self.strPath = strPath
+        self.cbShard = cbShard
+        self.added = 0
+
+        self.__strStem, self.__strExt = os.path.splitext(strPath)
+        self.__strExt = self.__strExt or Constants.extArchive
+        self.strIndex = self.__strStem + Constants.extIndex
+
+        self.__dictIndex = {}
+        if os.path.exists(self.strIndex):
+            try: self.__dictIndex = _readIndex(Fetch.fetch('file://' + os.path.abspath(self.strIndex)))
+            except IOError, err: raise GeneArchiveError('Unable to read %s - %s' % (self.strIndex, str(err)))
+
+        # Appending continues within the last shard written
+        self.__iShard = 0
+        if cbShard:
+            strPrefix = os.path.basename(self.__strStem) + '.'
+            try: aryFiles = os.listdir(os.path.dirname(strPath) or '.')
+            except OSError: aryFiles = []
+            aryShards = [ int(mo.group(1)) for mo in [ Constants.reShard.match(f) for f in aryFiles if f.startswith(strPrefix) and f.endswith(self.__strExt) ] if mo ]
+            self.__iShard = aryShards and max(aryShards) or 0
+
+        self.__zip = None
+        self.__strShard = None
+        self.__setReplaced = set()
+        return
+
+    def __getShardPath(self):
+        if not self.cbShard:
+            return self.strPath
+        return Constants.fmtShard % (self.__strStem, self.__iShard, self.__strExt)
+
+    def __openShard(self):
+        strShard = self.__getShardPath()
+        while self.cbShard and os.path.exists(strShard) and os.path.getsize(strShard) >= self.cbShard:
+            self.__iShard += 1
+            strShard = self.__getShardPath()
+
+        strTemporary = None
+        try:
+            strTemporary = _makeTemporary(strShard)
+            self.__zip = zipfile.ZipFile(strTemporary, 'w', zipfile.ZIP_DEFLATED, True)
+            if os.path.exists(strShard):
+                self.__copyMembers(strShard, self.__zip)
+        except (IOError, OSError, zipfile.BadZipfile), err:
+            if self.__zip:
+                self.__zip.close()
+                self.__zip = None
+            if strTemporary and os.path.exists(strTemporary):
+                os.remove(strTemporary)
+            raise GeneArchiveError('Unable to open %s - %s' % (strShard, str(err)))
+        self.__strShard = strShard
+        return strShard
+
+    #--------------------------------------------------------------------------
+    # Function: __copyMembers
+    #
+    # Copy the members of an archive still indexed (the last of any duplicates,
+    # and any the index does not know) to another, returning the number of
+    # members left behind
+    #--------------------------------------------------------------------------
+    def __copyMembers(self, strShard, zipTarget):
+        zipSource = zipfile.ZipFile(strShard, 'r')
+        try:
+            dictLast = {}
+            for zi in zipSource.infolist():
+                dictLast[zi.filename] = zi
+            aryInfos = sorted([ zi for zi in dictLast.itervalues() if self.__isIndexed(strShard, zi.filename) ], key=lambda zi: zi.header_offset)
+            for ziSource in aryInfos:
+                zi = zipfile.ZipInfo(ziSource.filename, ziSource.date_time)
+                zi.compress_type = ziSource.compress_type
+                zi.external_attr = ziSource.external_attr
+                zipTarget.writestr(zi, zipSource.read(ziSource))
+            return len(zipSource.infolist()) - len(aryInfos)
+        finally:
+            zipSource.close()
+
+    def __isIndexed(self, strShard, strMember):
+        if isinstance(strMember, unicode):
+            strMember = strMember.encode('utf-8')
+        entry = self.__dictIndex.get(os.path.basename(strMember))
+        return not entry or entry[0] == Fetch.makeMemberURL(os.path.basename(strShard), strMember)
+
+    #--------------------------------------------------------------------------
+    # Function: __compact
+    #
+    # Rewrite an archive without the members no longer indexed (if any)
+    #--------------------------------------------------------------------------
+    def __compact(self, strShard):
+        strTemporary = None
+        try:
+            strTemporary = _makeTemporary(strShard)
+            zipTarget = zipfile.ZipFile(strTemporary, 'w', zipfile.ZIP_DEFLATED, True)
+            try: cDropped = self.__copyMembers(strShard, zipTarget)
+            finally: zipTarget.close()
+            if cDropped:
+                os.chmod(strTemporary, Constants.nMode)
+                os.rename(strTemporary, strShard)
+                strTemporary = None
+        except (IOError, OSError, zipfile.BadZipfile), err:
+            raise GeneArchiveError('Unable to compact %s - %s' % (strShard, str(err)))
+        finally:
+            if strTemporary and os.path.exists(strTemporary):
+                os.remove(strTemporary)
+        return
+
+    #--------------------------------------------------------------------------
+    # Function: add
+    #
+    # Add a gene as the named member (its path within the archive), indexing
+    # it (and its input hash, if any) under the member's file name
+    #--------------------------------------------------------------------------
+    def add(self, strMember, strGene, strHash=''):
+        if isinstance(strMember, unicode):
+            strMember = strMember.encode('utf-8')
+        if not self.__zip:
+            self.__openShard()
+        strShard = self.__strShard
+
+        zi = zipfile.ZipInfo(strMember, time.localtime()[:6])
+        zi.compress_type = zipfile.ZIP_DEFLATED
+        zi.external_attr = Constants.nMode << 16
+        # A gene added twice within one archive is expected, and the earlier member dropped on close
+        aryFilters = warnings.filters[:]
+        try:
+            warnings.filterwarnings('ignore', 'Duplicate name', UserWarning)
+            try: self.__zip.writestr(zi, strGene)
+            finally: warnings.filters[:] = aryFilters
+        except (IOError, zipfile.LargeZipFile), err: raise GeneArchiveError('Unable to write %s to %s - %s' % (strMember, strShard, str(err)))
+
+        strName = os.path.basename(strMember)
+        if strName in self.__dictIndex:
+            self.__setReplaced.add(urlparse.urldefrag(self.__dictIndex[strName][0])[0])
+        self.__dictIndex[strName] = (Fetch.makeMemberURL(os.path.basename(strShard), strMember), strHash or '')
+        self.added += 1
+
+        if self.cbShard and self.__zip.fp.tell() >= self.cbShard:
+            self.__closeShard()
+            self.__iShard += 1
+        return
+
+    #--------------------------------------------------------------------------
+    # Function: open
+    #
+    # Return a file-like object (with the write, commit, and abort of
+    # common.AtomicFile) whose contents, once committed, are added as the
+    # named member
+    #--------------------------------------------------------------------------
+    def open(self, strMember, strHash=''):
+        return _MemberFile(self, strMember, strHash)
+
+    #--------------------------------------------------------------------------
+    # Function: hashFor
+    #
+    # Return the input hash recorded for a gene, or None if the gene is absent
+    # or was added without one
+    #--------------------------------------------------------------------------
+    def hashFor(self, strName):
+        entry = self.__dictIndex.get(strName)
+        return entry and entry[1] or None
+
+    def __closeShard(self):
+        if self.__zip:
+            strTemporary = self.__zip.filename
+            try:
+                self.__zip.close()
+                os.chmod(strTemporary, Constants.nMode)
+                os.rename(strTemporary, self.__strShard)
+            except (IOError, OSError), err: raise GeneArchiveError('Unable to write %s - %s' % (self.__strShard, str(err)))
+            self.__zip = None
+            self.__strShard = None
+        return
+
+    def close(self):
+        self.__closeShard()
+
+        strDir = os.path.dirname(self.strIndex) or '.'
+        try:
+            fd, strTemporary = tempfile.mkstemp(Constants.extTemporary, '.' + os.path.basename(self.strIndex) + '.', strDir)
+            fileIndex = os.fdopen(fd, 'wb')
+            try:
+                fileIndex.writelines([ Constants.chSeparator.join([ strName ] + [ str for str in entry if str ]) + '\n' for strName, entry in sorted(self.__dictIndex.iteritems()) ])
+            finally:
+                fileIndex.close()
+            os.chmod(strTemporary, Constants.nMode)
+            os.rename(strTemporary, self.strIndex)
+        except (IOError, OSError), err: raise GeneArchiveError('Unable to write %s - %s' % (self.strIndex, str(err)))
+
+        # Replaced members are dropped only once the index no longer refers to them
+        for strArchive in sorted(self.__setReplaced):
+            strShard = os.path.join(strDir, strArchive)
+            if os.path.exists(strShard):
+                self.__compact(strShard)
+        self.__setReplaced = set()
+        return
+
+#------------------------------------------------------------------------------
+# Class: _MemberFile
+#
+#------------------------------------------------------------------------------
+class _MemberFile(object):
+    def __init__(self, writer, strMember, strHash=''):
+        self.writer = writer
+        self.strMember = strMember
+        self.strHash = strHash
+        self.__aryPieces = []
+        return
+
+    def write(self, str):
+        self.__aryPieces.append(str)
+        return
+
+    def writelines(self, aryStrings):
+        self.__aryPieces.extend(aryStrings)
+        return
+
+    def commit(self):
+        if self.__aryPieces is not None:
+            self.writer.add(self.strMember, ''.join(self.__aryPieces), self.strHash)
+            self.__aryPieces = None
+        return
+
+    def abort(self):
+        self.__aryPieces = None
+        return
+
+#------------------------------------------------------------------------------
+# Class: GeneIndex
+#
+# Read-only access to the index of gene archives, resolving gene names (e.g.,
+# 4E8C.gene) to the URLs of their members
+#------------------------------------------------------------------------------
+class GeneIndex(object):
+    def __init__(self, urlIndex):
+        self.urlIndex = urlIndex
+        try: self.__dictIndex = _readIndex(Fetch.fetch(urlIndex))
+        except (IOError, OSError), err: raise GeneArchiveError('Unable to read %s - %s' % (urlIndex, str(err)))
+        return
+
+    def __contains__(self, strName):
+        return strName in self.__dictIndex
+
+    def __len__(self):
+        return len(self.__dictIndex)
+
+    def names(self):
+        return sorted(self.__dictIndex.keys())
+
+    def urlFor(self, strName):
+        try: return urlparse.urljoin(self.urlIndex, self.__dictIndex[strName][0])
+        except KeyError: raise LookupError('%s does not contain gene %s' % (self.urlIndex, strName))
+
+#==============================================================================
+# Global Functions
+#==============================================================================
+def _makeTemporary(strPath):
+    fd, strTemporary = tempfile.mkstemp(Constants.extTemporary, '.' + os.path.basename(strPath) + '.', os.path.dirname(strPath) or '.')
+    os.close(fd)
+    return strTemporary
+
+def _readIndex(strIndex):
+    dictIndex = {}
+    for strLine in strIndex.splitlines():
+        if strLine:
+            aryFields = strLine.split(Constants.chSeparator)
+            dictIndex[aryFields[0]] = (aryFields[1], len(aryFields) > 2 and aryFields[2] or '')
+    return dictIndex
+
+if __name__ == '__main__':
+    # Ensure genes written across shards, in two runs, are indexed and read back intact
+    strRoot = tempfile.mkdtemp()
+    try:
+        strArchive = os.path.join(strRoot, 'genes.zip')
+        for aryRange in [ xrange(0, 30), xrange(20, 40) ]:
+            writer = GeneArchiveWriter(strArchive, 8192)
+            for i in aryRange:
+                fileGene = writer.open('4000/%04X.gene' % (0x4E00 + i), '%040x' % i)
+                fileGene.write(os.urandom(1024).encode('hex'))
+                fileGene.writelines([ '\n%d\n' % i ])
+                fileGene.commit()
+            fileGene = writer.open('4000/aborted.gene')
+            fileGene.write('aborted')
+            fileGene.abort()
+            assert(writer.hashFor('4E00.gene') == '%040x' % 0 and writer.hashFor('aborted.gene') is None)
+            writer.close()
+
+        geneIndex = GeneIndex('file://' + os.path.join(strRoot, 'genes.index'))
+        assert(len(geneIndex) == 40 and not 'aborted.gene' in geneIndex)
+        assert(len(glob.glob(os.path.join(strRoot, 'genes.*.zip'))) > 2)
+        for i in xrange(40):
+            assert(Fetch.fetch(geneIndex.urlFor('%04X.gene' % (0x4E00 + i))).endswith('\n%d\n' % i))
+
+        # Ensure replaced genes leave no stale members behind
+        assert(sum([ len(zipfile.ZipFile(strShard).infolist()) for strShard in glob.glob(os.path.join(strRoot, 'genes.*.zip')) ]) == 40)
+        aryFilters = warnings.filters[:]
+        strSingle = os.path.join(strRoot, 'single.zip')
+        for strGene in [ 'first', 'second' ]:
+            writer = GeneArchiveWriter(strSingle)
+            writer.add('4000/4E00.gene', strGene)
+            writer.add('4000/4E00.gene', strGene)
+            writer.close()
+        assert(zipfile.ZipFile(strSingle).namelist() == [ '4000/4E00.gene' ])
+        assert(Fetch.fetch(GeneIndex('file://' + os.path.join(strRoot, 'single.index')).urlFor('4E00.gene')) == 'second')
+        assert(warnings.filters == aryFilters)
+
+        # Ensure a writer that never closes leaves the archives of earlier runs readable
+        writer = GeneArchiveWriter(strArchive, 8192)
+        writer.add('4000/4E00.gene', 'replaced')
+        for strShard in glob.glob(os.path.join(strRoot, 'genes.*.zip')):
+            zipfile.ZipFile(strShard).testzip()
+        assert(Fetch.fetch(geneIndex.urlFor('4E00.gene')).endswith('\n0\n'))
+    finally:
+        shutil.rmtree(strRoot)
@@ -26,14 +26,66 @@ This script assumes a single gene within the genome.
 Stylus, Copyright 2006-2008 Biologic Institute.
 '''
 
+import array
+import bisect
 import codons as Codons
+import fetch as Fetch
 import fpconst
+import glob
 import math
+import mmap
+import os
 import re
+import StringIO
 import sys
 import urllib2
+import urlparse
 import xmldict
 
+#==============================================================================
+# Global Constants
+#==============================================================================
+# Types of the attributes (and textual content) of genome and Han elements, converted as documents are parsed
+_dictTypes = {
+    'bounds' : dict([ (name, xmldict.XMLDict.typeFloat) for name in [ 'top', 'left', 'bottom', 'right', 'width', 'height', 'x-midpoint', 'y-midpoint' ] ]),
+    'scale' : { 'sxToHan' : xmldict.XMLDict.typeFloat, 'syToHan' : xmldict.XMLDict.typeFloat },
+    'translation' : { 'dxToHan' : xmldict.XMLDict.typeFloat, 'dyToHan' : xmldict.XMLDict.typeFloat },
+    'score' : dict([ (name, xmldict.XMLDict.typeFloat) for name in [ 'score', 'scale', 'placement', 'deviation', 'extraLength', 'illegalOverlaps', 'missingOverlaps', 'dropouts', 'marks' ] ]),
+    'origin' : { 'x' : xmldict.XMLDict.typeFloat, 'y' : xmldict.XMLDict.typeFloat },
+    'point' : { 'x' : xmldict.XMLDict.typeFloat, 'y' : xmldict.XMLDict.typeFloat },
+    'pointDistance' : { 'x' : xmldict.XMLDict.typeFloat, 'y' : xmldict.XMLDict.typeFloat, 'fractionalDistance' : xmldict.XMLDict.typeFloat },
+    'weightedCenter' : { 'x' : xmldict.XMLDict.typeFloat, 'y' : xmldict.XMLDict.typeFloat },
+    'length' : { xmldict.XMLDict.value : xmldict.XMLDict.typeFloat },
+    'minimumStrokeLength' : { xmldict.XMLDict.value : xmldict.XMLDict.typeFloat },
+    'containedStrokes' : { xmldict.XMLDict.value : xmldict.XMLDict.typeIntList },
+    'gene' : { 'baseFirst' : xmldict.XMLDict.typeInt, 'baseLast' : xmldict.XMLDict.typeInt },
+    'stroke' : { 'baseFirst' : xmldict.XMLDict.typeInt, 'baseLast' : xmldict.XMLDict.typeInt, 'correspondsTo' : xmldict.XMLDict.typeInt },
+    'segment' : { 'baseFirst' : xmldict.XMLDict.typeInt, 'baseLast' : xmldict.XMLDict.typeInt, 'coherent' : xmldict.XMLDict.typeBool },
+    'overlap' : { 'firstStroke' : xmldict.XMLDict.typeInt, 'secondStroke' : xmldict.XMLDict.typeInt, 'required' : xmldict.XMLDict.typeBool,
+                'x' : xmldict.XMLDict.typeFloat, 'y' : xmldict.XMLDict.typeFloat },
+    'statistics' : { 'trialFirst' : xmldict.XMLDict.typeInt, 'trialLast' : xmldict.XMLDict.typeInt, 'countBases' : xmldict.XMLDict.typeInt, 'countRollbacks' : xmldict.XMLDict.typeInt,
+                    'score' : xmldict.XMLDict.typeFloat, 'units' : xmldict.XMLDict.typeFloat, 'cost' : xmldict.XMLDict.typeFloat, 'fitness' : xmldict.XMLDict.typeFloat },
+    'maximum' : { 'value' : xmldict.XMLDict.typeFloat, 'trial' : xmldict.XMLDict.typeInt, 'countBases' : xmldict.XMLDict.typeInt, 'countRollbacks' : xmldict.XMLDict.typeInt },
+    'bases' : { 'changed' : xmldict.XMLDict.typeInt, 'deleted' : xmldict.XMLDict.typeInt, 'inserted' : xmldict.XMLDict.typeInt },
+    'rollbacks' : { 'countRollbacks' : xmldict.XMLDict.typeInt },
+    'changes' : { 'accepted' : xmldict.XMLDict.typeInt, 'attempted' : xmldict.XMLDict.typeInt, 'countBases' : xmldict.XMLDict.typeInt, 'silent' : xmldict.XMLDict.typeInt },
+    'changed' : { 'targetIndex' : xmldict.XMLDict.typeInt, 'countBases' : xmldict.XMLDict.typeInt },
+    }
+_dictTypes['minimum'] = _dictTypes['maximum']
+for tag in [ 'copies', 'deletions', 'insertions', 'transpositions' ]:
+    _dictTypes[tag] = _dictTypes['changes']
+for tag in [ 'copied', 'deleted', 'inserted', 'transposed' ]:
+    _dictTypes[tag] = { 'sourceIndex' : xmldict.XMLDict.typeInt, 'targetIndex' : xmldict.XMLDict.typeInt, 'countBases' : xmldict.XMLDict.typeInt }
+
+# Objects built directly from elements as documents are parsed
+_dictFactories = {
+    'bounds' : lambda dictRect: Rectangle(dictRect=dictRect),
+    'origin' : lambda dictPoint: Point(dictPoint=dictPoint),
+    'point' : lambda dictPoint: Point(dictPoint=dictPoint),
+    'pointDistance' : lambda dictPoint: PointDistance(dictPoint=dictPoint),
+    'weightedCenter' : lambda dictPoint: Point(dictPoint=dictPoint),
+    }
+
 #------------------------------------------------------------------------------
 # Class: BezierCurve
 # 
@@ -104,8 +156,8 @@ class Point(object):
         self.y = y
 
         if dictPoint:
-            self.x = float(dictPoint['x'])
-            self.y = float(dictPoint['y'])
+            self.x = dictPoint['x']
+            self.y = dictPoint['y']
         elif pt:
             self.x = pt.x
             self.y = pt.y
@@ -131,7 +183,7 @@ class PointDistance(Point):
         Point.__init__(self, x=x, y=y, dictPoint=dictPoint, pt=ptd)
         self.distance = distance
         if dictPoint:
-            self.distance = float(dictPoint['fractionalDistance'])
+            self.distance = dictPoint['fractionalDistance']
         elif ptd:
             self.distance = ptd.distance
         return
@@ -280,9 +332,13 @@ class Line(object):
 # 
 #------------------------------------------------------------------------------
 class Range(object):
-    def __init__(self, dictRange):
-        self.baseFirst = int(dictRange['baseFirst'])
-        self.baseLast = int(dictRange['baseLast'])
+    def __init__(self, dictRange=None, baseFirst=None, baseLast=None):
+        self.baseFirst = baseFirst
+        self.baseLast = baseLast
+
+        if dictRange:
+            self.baseFirst = dictRange['baseFirst']
+            self.baseLast = dictRange['baseLast']
         return
 
     def __cmp__(self, rg):
@@ -302,6 +358,68 @@ class Range(object):
     def length(self):
         return self.baseLast - self.baseFirst + 1
 
+#------------------------------------------------------------------------------
+# Class: RangeIndex
+# 
+# An index of items (e.g., strokes or segments) by their base ranges that
+# answers which items contain a base or overlap a range in O(log n) time.
+# Queries return positions within the original list of items.
+#
+# Notes:
+# - Ranges are held sorted by their first base alongside the running maximum
+#   of their last bases; every range before the first whose running maximum
+#   reaches the query cannot overlap it, and every range after the last that
+#   starts within the query cannot either
+# - Overlapping ranges are allowed, though disjoint ranges (as strokes and
+#   segments are) cost only O(log n) plus the number of ranges found
+#------------------------------------------------------------------------------
+class RangeIndex(object):
+    def __init__(self, aryItems, fnRange=lambda item: item.rgBases):
+        aryRanges = sorted([ (fnRange(item).baseFirst, fnRange(item).baseLast, i) for i, item in enumerate(aryItems) ])
+        self.__aryFirst = [ baseFirst for baseFirst, baseLast, i in aryRanges ]
+        self.__aryLast = [ baseLast for baseFirst, baseLast, i in aryRanges ]
+        self.__aryItems = [ i for baseFirst, baseLast, i in aryRanges ]
+        self.__aryMaxLast = []
+        baseMax = -sys.maxint-1
+        for baseLast in self.__aryLast:
+            baseMax = max(baseMax, baseLast)
+            self.__aryMaxLast.append(baseMax)
+        return
+
+    def __len__(self):
+        return len(self.__aryItems)
+
+    def __find(self, baseFirst, baseLast):
+        iFirst = bisect.bisect_left(self.__aryMaxLast, baseFirst)
+        iLast = bisect.bisect_right(self.__aryFirst, baseLast)
+        return [ self.__aryItems[i] for i in xrange(iFirst, iLast) if self.__aryLast[i] >= baseFirst ]
+
+    #--------------------------------------------------------------------------
+    # Function: indexOf
+    # 
+    # Return the position of the first item containing the base (or None)
+    #--------------------------------------------------------------------------
+    def indexOf(self, baseIndex):
+        i = bisect.bisect_left(self.__aryMaxLast, baseIndex)
+        iLast = bisect.bisect_right(self.__aryFirst, baseIndex)
+        while i < iLast:
+            if self.__aryLast[i] >= baseIndex:
+                return self.__aryItems[i]
+            i += 1
+        return None
+
+    #--------------------------------------------------------------------------
+    # Function: indexesOf, indexesOverlapping
+    # 
+    # Return the positions of all items containing the base or overlapping the
+    # range (ordered by the first base of each item)
+    #--------------------------------------------------------------------------
+    def indexesOf(self, baseIndex):
+        return self.__find(baseIndex, baseIndex)
+
+    def indexesOverlapping(self, rg):
+        return self.__find(rg.baseFirst, rg.baseLast)
+
 #------------------------------------------------------------------------------
 # Class: Rectangle
 # 
@@ -311,13 +429,13 @@ class Rectangle(object):
         self.__set(top, left, bottom, right)
 
         if dictRect:
-            self.top = float(dictRect['top'])
-            self.left = float(dictRect['left'])
-            self.bottom = float(dictRect['bottom'])
-            self.right = float(dictRect['right'])
-            self.width = float(dictRect['width'])
-            self.height = float(dictRect['height'])
-            self.ptCenter = Point(x=float(dictRect['x-midpoint']), y=float(dictRect['y-midpoint']))
+            self.top = dictRect['top']
+            self.left = dictRect['left']
+            self.bottom = dictRect['bottom']
+            self.right = dictRect['right']
+            self.width = dictRect['width']
+            self.height = dictRect['height']
+            self.ptCenter = Point(x=dictRect['x-midpoint'], y=dictRect['y-midpoint'])
         elif rect:
             self.top = rect.top
             self.left = rect.left
@@ -375,38 +493,38 @@ class Group(object):
         self.dropouts = None
 
         if 'bounds' in dictGroup:
-            self.bounds = Rectangle(dictRect=dictGroup['bounds'])
+            self.bounds = dictGroup['bounds']
         
         if 'scale' in dictGroup:
             dictScale = dictGroup['scale']
-            self.sxToHan = float(dictScale['sxToHan'])
-            self.syToHan = float(dictScale['syToHan'])
+            self.sxToHan = dictScale['sxToHan']
+            self.syToHan = dictScale['syToHan']
 
         if 'translation' in dictGroup:
             dictTranslation = dictGroup['translation']
-            self.dxToHan = float(dictTranslation['dxToHan'])
-            self.dyToHan = float(dictTranslation['dyToHan'])
+            self.dxToHan = dictTranslation['dxToHan']
+            self.dyToHan = dictTranslation['dyToHan']
 
         if 'score' in dictGroup:
             dictScore = dictGroup['score']
-            self.score = float(dictScore['score'])
+            self.score = dictScore['score']
 
             if 'scale' in dictScore:
-                self.scale = float(dictScore['scale'])
+                self.scale = dictScore['scale']
             if 'placement' in dictScore:
-                self.placement = float(dictScore['placement'])
+                self.placement = dictScore['placement']
             if 'deviation' in dictScore:
-                self.deviation = float(dictScore['deviation'])
+                self.deviation = dictScore['deviation']
             if 'extraLength' in dictScore:
-                self.extraLength = float(dictScore['extraLength'])
+                self.extraLength = dictScore['extraLength']
             if 'illegalOverlaps' in dictScore:
-                self.illegalOverlaps = float(dictScore['illegalOverlaps'])
+                self.illegalOverlaps = dictScore['illegalOverlaps']
             if 'missingOverlaps' in dictScore:
-                self.missingOverlaps = float(dictScore['missingOverlaps'])
+                self.missingOverlaps = dictScore['missingOverlaps']
             if 'dropouts' in dictScore:
-                self.dropouts = float(dictScore['dropouts'])
+                self.dropouts = dictScore['dropouts']
 
-        self.containedStrokes = [ int(nStroke)-1 for nStroke in dictGroup['containedStrokes'][xmldict.XMLDict.value].split() ]
+        self.containedStrokes = [ nStroke-1 for nStroke in dictGroup['containedStrokes'][xmldict.XMLDict.value] ]
         return
 
 #------------------------------------------------------------------------------
@@ -416,7 +534,7 @@ class Group(object):
 class Stroke(object):
     def __init__(self, dictStroke):
         self.rgBases = Range(dictStroke)
-        self.correspondsTo = int(dictStroke['correspondsTo'])
+        self.correspondsTo = dictStroke['correspondsTo']
 
         self.bounds = None
 
@@ -430,26 +548,26 @@ class Stroke(object):
         self.dropouts = None
 
         if 'bounds' in dictStroke:
-            self.bounds = Rectangle(dictRect=dictStroke['bounds'])
+            self.bounds = dictStroke['bounds']
         
         if 'scale' in dictStroke:
             dictScale = dictStroke['scale']
-            self.sxToHan = float(dictScale['sxToHan'])
-            self.syToHan = float(dictScale['syToHan'])
+            self.sxToHan = dictScale['sxToHan']
+            self.syToHan = dictScale['syToHan']
 
         if 'translation' in dictStroke:
             dictTranslation = dictStroke['translation']
-            self.dxToHan = float(dictTranslation['dxToHan'])
-            self.dyToHan = float(dictTranslation['dyToHan'])
+            self.dxToHan = dictTranslation['dxToHan']
+            self.dyToHan = dictTranslation['dyToHan']
 
         if 'score' in dictStroke:
             dictScore = dictStroke['score']
             if 'deviation' in dictScore:
-                self.deviation = float(dictScore['deviation'])
+                self.deviation = dictScore['deviation']
             if 'extraLength' in dictScore:
-                self.extraLength = float(dictScore['extraLength'])
+                self.extraLength = dictScore['extraLength']
             if 'dropouts' in dictScore:
-                self.dropouts = float(dictScore['dropouts'])
+                self.dropouts = dictScore['dropouts']
         return
 
 #------------------------------------------------------------------------------
@@ -470,8 +588,8 @@ class Overlap(object):
 class Segment(object):
     def __init__(self, dictSegment):
         self.rgBases = Range(dictSegment)
-        self.coherent = dictSegment['coherent'] == 'true' and True or False
-        self.aryPoints = [ Point(dictPoint=dictPoint) for tag, dictPoint in dictSegment[xmldict.XMLDict.children] ]
+        self.coherent = dictSegment['coherent']
+        self.aryPoints = [ pt for tag, pt in dictSegment[xmldict.XMLDict.children] ]
         return
 
 #------------------------------------------------------------------------------
@@ -481,6 +599,7 @@ class Segment(object):
 class Gene(object):
     def __init__(self, dictGene):
         self.rgBases = Range(dictGene)
+        self.ptOrigin = None
         
         self.unicode = None
         self.bounds = None
@@ -502,36 +621,42 @@ class Gene(object):
         self.aryOverlaps = []
         self.arySegments = []
 
+        self.__strokeIndex = None
+        self.__segmentIndex = None
+
+        if 'origin' in dictGene:
+            self.ptOrigin = dictGene['origin']
+
         if 'hanReferences' in dictGene:
             dictHanReference = dictGene['hanReferences'][xmldict.XMLDict.children][0][1]
             self.unicode = dictHanReference['unicode']
 
             if 'bounds' in dictHanReference:
-                self.bounds = Rectangle(dictRect=dictHanReference['bounds'])
+                self.bounds = dictHanReference['bounds']
 
             if 'scale' in dictHanReference:
                 dictScale = dictHanReference['scale']
-                self.sxToHan = float(dictScale['sxToHan'])
-                self.syToHan = float(dictScale['syToHan'])
+                self.sxToHan = dictScale['sxToHan']
+                self.syToHan = dictScale['syToHan']
                 
             if 'translation' in dictHanReference:
                 dictTranslation = dictHanReference['translation']
-                self.dxToHan = float(dictTranslation['dxToHan'])
-                self.dyToHan = float(dictTranslation['dyToHan'])
+                self.dxToHan = dictTranslation['dxToHan']
+                self.dyToHan = dictTranslation['dyToHan']
 
             if 'score' in dictHanReference:
                 dictScore = dictHanReference['score']
-                self.score = float(dictScore['score'])
+                self.score = dictScore['score']
                 if 'scale' in dictScore:
-                    self.scale = float(dictScore['scale'])
+                    self.scale = dictScore['scale']
                 if 'placement' in dictScore:
-                    self.placement = float(dictScore['placement'])
+                    self.placement = dictScore['placement']
                 if 'illegalOverlaps' in dictScore:
-                    self.illegalOverlaps = float(dictScore['illegalOverlaps'])
+                    self.illegalOverlaps = dictScore['illegalOverlaps']
                 if 'missingOverlaps' in dictScore:
-                    self.missingOverlaps = float(dictScore['missingOverlaps'])
+                    self.missingOverlaps = dictScore['missingOverlaps']
                 if 'marks' in dictScore:
-                    self.marks = float(dictScore['marks'])
+                    self.marks = dictScore['marks']
 
             if 'groups' in dictHanReference:
                 self.aryGroups = [ Group(dictGroup) for tag, dictGroup in dictHanReference['groups'][xmldict.XMLDict.children] ]
@@ -543,17 +668,57 @@ class Gene(object):
                 self.arySegments = [ Segment(dictSegment) for tag, dictSegment in dictGene['segments'][xmldict.XMLDict.children] ]
         return
 
+    def __getStrokeIndex(self):
+        if self.__strokeIndex is None:
+            self.__strokeIndex = RangeIndex(self.aryStrokes)
+        return self.__strokeIndex
+    strokeIndex = property(__getStrokeIndex)
+
+    def __getSegmentIndex(self):
+        if self.__segmentIndex is None:
+            self.__segmentIndex = RangeIndex(self.arySegments)
+        return self.__segmentIndex
+    segmentIndex = property(__getSegmentIndex)
+
+    #--------------------------------------------------------------------------
+    # Function: locateBase
+    # 
+    # Return the stroke and segment (as indexes into aryStrokes and
+    # arySegments) containing a base and whether that segment is coherent;
+    # each is None if no stroke or segment contains the base
+    #--------------------------------------------------------------------------
+    def locateBase(self, baseIndex):
+        iStroke = self.strokeIndex.indexOf(baseIndex)
+        iSegment = self.segmentIndex.indexOf(baseIndex)
+        if iSegment is None:
+            return iStroke, None, None
+        return iStroke, iSegment, self.arySegments[iSegment].coherent
+
+    #--------------------------------------------------------------------------
+    # Function: findStrokes, findSegments
+    # 
+    # Return the indexes of the strokes or segments overlapping a range
+    #--------------------------------------------------------------------------
+    def findStrokes(self, rg):
+        return self.strokeIndex.indexesOverlapping(rg)
+
+    def findSegments(self, rg):
+        return self.segmentIndex.indexesOverlapping(rg)
+
 #------------------------------------------------------------------------------
 # Class: Mutation
 # 
 #------------------------------------------------------------------------------
 class Mutation(object):
+    tags = [ 'changed', 'copied', 'deleted', 'inserted', 'transposed' ]
+
     def __init__(self, tag, dictMutation):
         self.tag = tag
+        self.attempt = None
 
-        self.sourceIndex = 'sourceIndex' in dictMutation and int(dictMutation['sourceIndex']) or None
-        self.targetIndex = 'targetIndex' in dictMutation and int(dictMutation['targetIndex']) or None
-        self.countBases = 'countBases' in dictMutation and int(dictMutation['countBases']) or 1
+        self.sourceIndex = 'sourceIndex' in dictMutation and dictMutation['sourceIndex'] or None
+        self.targetIndex = 'targetIndex' in dictMutation and dictMutation['targetIndex'] or None
+        self.countBases = 'countBases' in dictMutation and dictMutation['countBases'] or 1
         self.bases = 'bases' in dictMutation and dictMutation['bases'] or None
         self.basesAfter = 'basesAfter' in dictMutation and dictMutation['basesAfter'] or None
         return
@@ -565,6 +730,18 @@ class Mutation(object):
         elif self.tag == 'inserted': return 'Inserted %s (%d bases) at %d' % (self.bases, self.countBases, self.targetIndex)
         elif self.tag == 'transposed': return 'Transposed %s (%d bases) from %d to %d' % (self.bases, self.countBases, self.sourceIndex, self.targetIndex)
         else: return 'Unknown mutation'
+
+    #--------------------------------------------------------------------------
+    # Function: overlapsRange
+    # 
+    # Return True if the bases read or written by the mutation fall within the
+    # passed range
+    #--------------------------------------------------------------------------
+    def overlapsRange(self, rg):
+        for baseIndex in (self.targetIndex, self.sourceIndex):
+            if baseIndex is not None and baseIndex <= rg.baseLast and (baseIndex + self.countBases - 1) >= rg.baseFirst:
+                return True
+        return False
         
 #------------------------------------------------------------------------------
 # Class: Mutations
@@ -628,8 +805,8 @@ class Termination(object):
 #------------------------------------------------------------------------------
 class ValueStatistics(object):
     def __init__(self, dictValue):
-        self.value = float(dictValue['value'])
-        self.trial = int(dictValue['trial'])
+        self.value = dictValue['value']
+        self.trial = dictValue['trial']
         return
 
 #------------------------------------------------------------------------------
@@ -638,8 +815,8 @@ class ValueStatistics(object):
 #------------------------------------------------------------------------------
 class SizeStatistics(object):
     def __init__(self, dictSizes):
-        self.countBases = int(dictSizes['countBases'])
-        self.trial = int(dictSizes['trial'])
+        self.countBases = dictSizes['countBases']
+        self.trial = dictSizes['trial']
         return
 
 #------------------------------------------------------------------------------
@@ -648,9 +825,9 @@ class SizeStatistics(object):
 #------------------------------------------------------------------------------
 class MutationStatistics(object):
     def __init__(self, dictMutations):
-        self.accepted = int(dictMutations['accepted'])
-        self.attempted = int(dictMutations['attempted'])
-        self.countBases = int(dictMutations['countBases'])
+        self.accepted = dictMutations['accepted']
+        self.attempted = dictMutations['attempted']
+        self.countBases = dictMutations['countBases']
         return
 
 #------------------------------------------------------------------------------
@@ -659,8 +836,8 @@ class MutationStatistics(object):
 #------------------------------------------------------------------------------
 class RollbackStatistics(object):
     def __init__(self, dictRollbacks):
-        self.countRollbacks = int(dictRollbacks['countRollbacks'])
-        self.trial = int(dictRollbacks['trial'])
+        self.countRollbacks = dictRollbacks['countRollbacks']
+        self.trial = dictRollbacks['trial']
         return
         
 #------------------------------------------------------------------------------
@@ -710,21 +887,21 @@ class Statistics(object):
         if 'statistics' in dictGenome:
             dictStatistics = dictGenome['statistics']
 
-            self.trialFirst = int(dictStatistics['trialFirst'])
-            self.trialLast = int(dictStatistics['trialLast'])
+            self.trialFirst = dictStatistics['trialFirst']
+            self.trialLast = dictStatistics['trialLast']
 
             if 'score' in dictStatistics:
-                self.score = float(dictStatistics['score'])
+                self.score = dictStatistics['score']
             if 'units' in dictStatistics:
-                self.units = float(dictStatistics['units'])
+                self.units = dictStatistics['units']
             if 'cost' in dictStatistics:
-                self.cost = float(dictStatistics['cost'])
+                self.cost = dictStatistics['cost']
             if 'fitness' in dictStatistics:
-                self.fitness = float(dictStatistics['fitness'])
+                self.fitness = dictStatistics['fitness']
             if 'countBases' in dictStatistics:
-                self.countBases = int(dictStatistics['countBases'])
+                self.countBases = dictStatistics['countBases']
             if 'countRollbacks' in dictStatistics:
-                self.countRollbacks = int(dictStatistics['countRollbacks'])
+                self.countRollbacks = dictStatistics['countRollbacks']
 
             if 'scoreRange' in dictStatistics:
                 dictScores = dictStatistics['scoreRange']
@@ -748,22 +925,22 @@ class Statistics(object):
 
             if 'bases' in dictStatistics:
                 dictBases = dictStatistics['bases']
-                self.basesChanged = int(dictBases['changed'])
-                self.basesDeleted = int(dictBases['deleted'])
-                self.basesInserted = int(dictBases['inserted'])
+                self.basesChanged = dictBases['changed']
+                self.basesDeleted = dictBases['deleted']
+                self.basesInserted = dictBases['inserted']
                 self.maxBases = SizeStatistics(dictBases['maximum'])
                 self.minBases = SizeStatistics(dictBases['minimum'])
 
             if 'rollbacks' in dictStatistics:
                 dictRollbacks = dictStatistics['rollbacks']
-                self.totalRollbacks = int(dictRollbacks['countRollbacks'])
+                self.totalRollbacks = dictRollbacks['countRollbacks']
                 self.maxRollbacks = RollbackStatistics(dictRollbacks['maximum'])
                 self.minRollbacks = RollbackStatistics(dictRollbacks['minimum'])
 
             if 'mutations' in dictStatistics:
                 dictMutations = dictStatistics['mutations']
                 self.changeMutations = MutationStatistics(dictMutations['changes'])
-                self.changeMutations.silent = int(dictMutations['changes']['silent'])
+                self.changeMutations.silent = dictMutations['changes']['silent']
                 self.copyMutations = MutationStatistics(dictMutations['copies'])
                 self.deletionMutations = MutationStatistics(dictMutations['deletions'])
                 self.insertionMutations = MutationStatistics(dictMutations['insertions'])
@@ -773,14 +950,55 @@ class Statistics(object):
 #------------------------------------------------------------------------------
 # Class: Genome
 # 
+# Notes:
+# - Only the genome header (attributes, seed, bases, and termination) is parsed
+#   on construction; the lineage, statistics, and gene sections are located
+#   (by byte offset) and parsed on first access
+# - Plain local files are memory-mapped for the life of the Genome, so
+#   sections are read from the file as constructed even if it is since
+#   replaced (e.g., by an atomic rename); documents from other URLs, and
+#   compressed files, are retained in memory
+# - iterAcceptedMutations and iterRejectedMutations stream mutations from the
+#   lineage without building the Lineage object tree
 #------------------------------------------------------------------------------
 class Genome(object):
+    _aryDeferred = [ 'lineage', 'statistics', 'genes' ]
+    _dictOptions = {
+                xmldict.XMLDict.toList : [ 'acceptedMutations', 'rejectedMutations', 'attempt', 'genes', 'hanReferences', 'groups', 'strokes', 'overlaps', 'segments', 'segment' ],
+                xmldict.XMLDict.ignore : [],
+                xmldict.XMLDict.types : _dictTypes,
+                xmldict.XMLDict.factories : _dictFactories
+                }
+
     def __init__(self, urlGenome):
-        xmlDict = xmldict.XMLDict({
-                                xmldict.XMLDict.toList : [ 'acceptedMutations', 'rejectedMutations', 'attempt', 'genes', 'hanReferences', 'groups', 'strokes', 'overlaps', 'segments', 'segment' ],
-                                xmldict.XMLDict.ignore : []
-                                })
-        dictGenome = xmlDict.load(urlGenome)['genome']
+        self.urlGenome = urlGenome
+        self.__strDocument = None
+        self.__dictSections = {}
+
+        self.__lineage = None
+        self.__statistics = None
+        self.__gene = None
+        self.__packedBases = None
+
+        # Compressed files and archive members are read whole; only plain files are mapped
+        urlGenome = Fetch.pathToURL(urlGenome)
+        aryURL = urlparse.urlsplit(Fetch.findURL(urlGenome))
+        if aryURL[0].lower() == 'file' and not Fetch.isCompressed(aryURL[2]) and not Fetch.isMember(urlGenome):
+            try:
+                fileGenome = open(urllib2.url2pathname(aryURL[2]), 'rb')
+            except IOError, err: raise urllib2.URLError(err)
+            try:
+                try: self.__strDocument = mmap.mmap(fileGenome.fileno(), 0, access=mmap.ACCESS_READ)
+                except (ValueError, mmap.error): self.__strDocument = fileGenome.read()
+            finally:
+                fileGenome.close()
+        else:
+            fileGenome = Fetch.openURL(urlGenome)
+            try: self.__strDocument = fileGenome.read()
+            finally: fileGenome.close()
+        strHeader = self.__locateSections(self.__strDocument)
+
+        dictGenome = xmldict.XMLDict(Genome._dictOptions).loads(strHeader)['genome']
 
         self.uuid = dictGenome['uuid'].upper()
 
@@ -799,21 +1017,542 @@ class Genome(object):
         self.bases = dictGenome['bases'][xmldict.XMLDict.value]
 
         self.termination = Termination(dictGenome)
-        self.statistics = Statistics(dictGenome)
-        self.lineage = Lineage(dictGenome)
-        self.gene = Gene(dictGenome['genes'][xmldict.XMLDict.children][0][1])
         return
 
+    #--------------------------------------------------------------------------
+    # Function: __locateSections
+    # 
+    # Record the offsets of each deferred section and return the document with
+    # those sections removed. Sections are found in document order, so text
+    # within one (e.g., the bases element of statistics) cannot be mistaken
+    # for another.
+    #--------------------------------------------------------------------------
+    def __locateSections(self, strDocument):
+        aryHeader = []
+        iHeader = 0
+        iSearch = 0
+        aryRemaining = list(Genome._aryDeferred)
+        while aryRemaining:
+            aryFound = [ (_findElement(strDocument, strTag, iSearch), strTag) for strTag in aryRemaining ]
+            aryFound = [ (iStart, strTag) for iStart, strTag in aryFound if iStart >= 0 ]
+            if not aryFound:
+                break
+            iStart, strTag = min(aryFound)
+            iEnd = _findElementEnd(strDocument, strTag, iStart)
+            self.__dictSections[strTag] = (iStart, iEnd)
+            aryHeader.append(strDocument[iHeader:iStart])
+            aryRemaining.remove(strTag)
+            iHeader = iSearch = iEnd
+        aryHeader.append(strDocument[iHeader:])
+        return ''.join(aryHeader)
+
+    #--------------------------------------------------------------------------
+    # Function: __loadSection
+    # 
+    # Parse a deferred section, returning a dictionary that contains it under
+    # its tag (or an empty dictionary if the genome lacks the section)
+    #--------------------------------------------------------------------------
+    def __loadSection(self, strTag):
+        if not strTag in self.__dictSections:
+            return {}
+        iStart, iEnd = self.__dictSections[strTag]
+        strSection = self.__strDocument[iStart:iEnd]
+        return xmldict.XMLDict(Genome._dictOptions).loads(strSection)
+
+    #--------------------------------------------------------------------------
+    # Function: __readSection
+    # 
+    # Yield the text of a deferred section in chunks
+    #--------------------------------------------------------------------------
+    def __readSection(self, strTag, cbChunk=65536):
+        if not strTag in self.__dictSections:
+            return
+        iStart, iEnd = self.__dictSections[strTag]
+        for i in xrange(iStart, iEnd, cbChunk):
+            yield self.__strDocument[i:min(i+cbChunk, iEnd)]
+
+    #--------------------------------------------------------------------------
+    # Function: __iterMutations
+    # 
+    # Stream the mutations recorded within one part of the lineage, optionally
+    # limited to those with the given tags and touching bases within rgBases.
+    # Mutations are created (and filtered) as the parser reaches them and held
+    # only until the current chunk of text is consumed.
+    #
+    # Notes:
+    # - The other part of the lineage, and mutations with other tags, are
+    #   ignored while parsing
+    # - Attempts end after the mutations they contain, so the attempts seen
+    #   so far number the attempt holding each mutation
+    #--------------------------------------------------------------------------
+    def __iterMutations(self, strContainer, aryTags, rgBases):
+        if not 'lineage' in self.__dictSections:
+            return
+
+        aryTags = aryTags or Mutation.tags
+        dictOptions = dict(Genome._dictOptions)
+        dictOptions[xmldict.XMLDict.ignore] = [ strTag for strTag in [ 'acceptedMutations', 'rejectedMutations' ] + Mutation.tags if strTag != strContainer and not strTag in aryTags ]
+
+        strContainer = '/' + strContainer + '/'
+        cAttempts = 0
+        for strPath, dictElement in xmldict.XMLDict(dictOptions).iterloads(self.__readSection('lineage'), [ 'attempt' ] + list(aryTags)):
+            if not strContainer in strPath:
+                continue
+            if strPath.endswith('/attempt'):
+                cAttempts += 1
+                continue
+            mutation = Mutation(strPath[strPath.rfind('/')+1:], dictElement)
+            if not rgBases or mutation.overlapsRange(rgBases):
+                if strPath.endswith('/attempt/' + mutation.tag):
+                    mutation.attempt = cAttempts
+                yield mutation
+
+    def iterAcceptedMutations(self, aryTags=None, rgBases=None):
+        return self.__iterMutations('acceptedMutations', aryTags, rgBases)
+
+    def iterRejectedMutations(self, aryTags=None, rgBases=None):
+        return self.__iterMutations('rejectedMutations', aryTags, rgBases)
+
+    def __getLineage(self):
+        if not self.__lineage:
+            self.__lineage = Lineage(self.__loadSection('lineage'))
+        return self.__lineage
+    lineage = property(__getLineage)
+
+    def __getStatistics(self):
+        if not self.__statistics:
+            self.__statistics = Statistics(self.__loadSection('statistics'))
+        return self.__statistics
+    statistics = property(__getStatistics)
+
+    def __getGene(self):
+        if not self.__gene:
+            self.__gene = Gene(self.__loadSection('genes')['genes'][xmldict.XMLDict.children][0][1])
+        return self.__gene
+    gene = property(__getGene)
+
+    def __getPackedBases(self):
+        if not self.__packedBases:
+            self.__packedBases = Codons.PackedBases(self.bases)
+        return self.__packedBases
+    packedBases = property(__getPackedBases)
+
+    #--------------------------------------------------------------------------
+    # Function: getStrokeBases
+    # 
+    # Return the packed bases (a view sharing packedBases) of a gene stroke
+    #--------------------------------------------------------------------------
+    def getStrokeBases(self, iStroke):
+        return self.packedBases.slice(self.gene.aryStrokes[iStroke].rgBases)
+
+#------------------------------------------------------------------------------
+# Function: _findElement, _findElementEnd
+# 
+# Locate the start of an element (by tag) and the offset just past its end
+#------------------------------------------------------------------------------
+def _findElement(strDocument, strTag, iStart):
+    strOpen = '<' + strTag
+    i = strDocument.find(strOpen, iStart)
+    while i >= 0 and not strDocument[i+len(strOpen):i+len(strOpen)+1] in (' ', '\t', '\r', '\n', '>', '/'):
+        i = strDocument.find(strOpen, i+len(strOpen))
+    return i
+
+def _findElementEnd(strDocument, strTag, iStart):
+    iTag = strDocument.find('>', iStart)
+    if iTag < 0:
+        raise xmldict.XMLDictError('The %s element is not closed' % strTag)
+    if strDocument[iTag-1] == '/':
+        return iTag+1
+    strClose = '</' + strTag
+    i = strDocument.find(strClose, iTag)
+    if i < 0:
+        raise xmldict.XMLDictError('The %s element is not closed' % strTag)
+    i = strDocument.find('>', i)
+    if i < 0:
+        raise xmldict.XMLDictError('The %s element is not closed' % strTag)
+    return i+1
+
+#------------------------------------------------------------------------------
+# Class: ExpressedPath
+# 
+# The points drawn by a contiguous run of vectors (either a stroke or a move
+# between strokes) along with their bounds and total length
+#------------------------------------------------------------------------------
+class ExpressedPath(object):
+    def __init__(self, rgBases, aryX, aryY, length):
+        self.rgBases = rgBases
+        self.aryX = aryX
+        self.aryY = aryY
+        self.length = length
+        self.bounds = Rectangle(top=max(aryY), left=min(aryX), bottom=min(aryY), right=max(aryX))
+        return
+
+    def __len__(self):
+        return len(self.aryX)
+
+#------------------------------------------------------------------------------
+# Class: Expression
+# 
+# The path drawn by the gene of a genome. The coordinates of every point are
+# computed at once, as cumulative sums of the decoded vectors beginning at
+# the gene origin; strokes and moves are slices of those coordinates.
+#
+# Notes:
+# - Point i lies before vector i; a run of vectors i through j draws points
+#   i through j+1 (so a move shares its end points with adjacent strokes)
+# - Moves are the runs of vectors, other than the closing stop codon, not
+#   covered by any stroke
+#------------------------------------------------------------------------------
+class Expression(object):
+    def __init__(self, genome):
+        gene = genome.gene
+        self.gene = gene
+        self.ptOrigin = gene.ptOrigin or Point(x=0.0, y=0.0)
+
+        # Decode the vectors following the start codon
+        self.vectors = Codons.decodeBases(genome.bases[gene.rgBases.baseFirst+2:gene.rgBases.baseLast])
+        cVectors = len(self.vectors)
+        if cVectors and self.vectors.ids[-1] == Codons.Vectors.Stop:
+            cVectors -= 1
+
+        self.aryX = _accumulate(self.ptOrigin.x, self.vectors.dx)
+        self.aryY = _accumulate(self.ptOrigin.y, self.vectors.dy)
+
+        self.aryStrokes = [ self.__toPath(*self.__toVectors(stroke.rgBases)) for stroke in gene.aryStrokes ]
+
+        self.aryMoves = []
+        iVector = 0
+        for iFirst, iLast in sorted([ self.__toVectors(stroke.rgBases) for stroke in gene.aryStrokes ]):
+            if iFirst > iVector:
+                self.aryMoves.append(self.__toPath(iVector, iFirst-1))
+            iVector = max(iVector, iLast+1)
+        if iVector < cVectors:
+            self.aryMoves.append(self.__toPath(iVector, cVectors-1))
+
+        self.length = sum([ path.length for path in self.aryStrokes ])
+        self.bounds = None
+        if self.aryStrokes:
+            self.bounds = Rectangle(rect=self.aryStrokes[0].bounds)
+            for path in self.aryStrokes[1:]:
+                self.bounds.unionRect(path.bounds)
+        return
+
+    def __toVectors(self, rgBases):
+        return ((rgBases.baseFirst - self.gene.rgBases.baseFirst) / 3) - 1, ((rgBases.baseLast - self.gene.rgBases.baseFirst) / 3) - 1
+
+    def __toPath(self, iFirst, iLast):
+        rgBases = Range(baseFirst=self.gene.rgBases.baseFirst + ((iFirst+1) * 3), baseLast=self.gene.rgBases.baseFirst + ((iLast+1) * 3) + 2)
+        return ExpressedPath(rgBases, self.aryX[iFirst:iLast+2], self.aryY[iFirst:iLast+2], sum(self.vectors.length[iFirst:iLast+1]))
+
+def _accumulate(value, aryValues):
+    ary = array.array('d', [ value ]) * (len(aryValues) + 1)
+    i = 1
+    for v in aryValues:
+        value += v
+        ary[i] = value
+        i += 1
+    return ary
+
+#------------------------------------------------------------------------------
+# Function: express
+# 
+# Return the Expression of a genome (a Genome or genome URL)
+#------------------------------------------------------------------------------
+def express(genome):
+    if not isinstance(genome, Genome):
+        genome = Genome(genome)
+    return Expression(genome)
+
+#------------------------------------------------------------------------------
+# Function: expressDirectory
+# 
+# Express every genome within a directory whose file name matches one of the
+# glob patterns, yielding (path, expression, error) in file name order.
+#
+# Notes:
+# - Only the header and gene of each genome are parsed (see Genome)
+# - A genome that fails to load or express yields a None expression and the
+#   exception raised; scanning continues with the next file
+#------------------------------------------------------------------------------
+def expressDirectory(strPath, aryGlobs=[ '*.gene', '*.xml' ]):
+    aryPaths = set()
+    for strGlob in aryGlobs:
+        aryPaths.update([ f for f in glob.glob(os.path.join(strPath, strGlob)) if os.path.isfile(f) ])
+
+    for f in sorted(aryPaths):
+        try:
+            expression = express('file://' + os.path.abspath(f))
+        except Exception, err:
+            yield f, None, err
+        else:
+            yield f, expression, None
+
+#------------------------------------------------------------------------------
+# Class: PointGrid
+# 
+# A uniform grid of points (each with an associated tag) answering nearest
+# point queries by searching outward, ring by ring, from the cell holding
+# the query point. Searching stops once no unsearched cell could hold a
+# nearer point.
+#------------------------------------------------------------------------------
+class PointGrid(object):
+    def __init__(self, aryPoints, cellSize):
+        self.cellSize = float(cellSize)
+        self.__dictCells = {}
+        for x, y, tag in aryPoints:
+            self.__dictCells.setdefault(self.__toCell(x, y), []).append((x, y, tag))
+
+        aryCells = self.__dictCells.keys()
+        self.__rgX = aryCells and (min([ cx for cx, cy in aryCells ]), max([ cx for cx, cy in aryCells ])) or (0, -1)
+        self.__rgY = aryCells and (min([ cy for cx, cy in aryCells ]), max([ cy for cx, cy in aryCells ])) or (0, -1)
+        return
+
+    def __len__(self):
+        return sum([ len(aryPoints) for aryPoints in self.__dictCells.itervalues() ])
+
+    def __toCell(self, x, y):
+        return int(math.floor(x / self.cellSize)), int(math.floor(y / self.cellSize))
+
+    def __ring(self, cx, cy, r):
+        if not r:
+            return [ (cx, cy) ]
+        aryCells = []
+        for i in xrange(-r, r+1):
+            aryCells.append((cx+i, cy-r))
+            aryCells.append((cx+i, cy+r))
+        for i in xrange(-r+1, r):
+            aryCells.append((cx-r, cy+i))
+            aryCells.append((cx+r, cy+i))
+        return aryCells
+
+    #--------------------------------------------------------------------------
+    # Function: nearest
+    # 
+    # Return (distance, x, y, tag) of the point nearest (x, y), or None if the
+    # grid is empty
+    #--------------------------------------------------------------------------
+    def nearest(self, x, y):
+        if not self.__dictCells:
+            return None
+
+        cx, cy = self.__toCell(x, y)
+        rMax = max(abs(cx - self.__rgX[0]), abs(cx - self.__rgX[1]), abs(cy - self.__rgY[0]), abs(cy - self.__rgY[1]))
+        ptBest = None
+        distance2Best = None
+        for r in xrange(rMax+1):
+            for cell in self.__ring(cx, cy, r):
+                for ptX, ptY, tag in self.__dictCells.get(cell, ()):
+                    distance2 = ((ptX - x) * (ptX - x)) + ((ptY - y) * (ptY - y))
+                    if distance2Best is None or distance2 < distance2Best:
+                        distance2Best = distance2
+                        ptBest = (ptX, ptY, tag)
+            if distance2Best is not None and distance2Best <= (r * self.cellSize) * (r * self.cellSize):
+                break
+        return math.sqrt(distance2Best), ptBest[0], ptBest[1], ptBest[2]
+
+#------------------------------------------------------------------------------
+# Class: StrokeScore
+# 
+# Measures of one expressed gene stroke against its Han stroke
+#------------------------------------------------------------------------------
+class StrokeScore(object):
+    def __init__(self, iStroke, iHanStroke):
+        self.iStroke = iStroke
+        self.iHanStroke = iHanStroke
+        self.fReversed = False
+        self.deviation = None
+        self.extraLength = None
+        self.placement = None
+        self.dropouts = None
+        return
+
+#------------------------------------------------------------------------------
+# Class: GeneScore
+# 
+# Measures of an expressed gene against its Han (each the mean of the stroke
+# measures) along with the Han strokes no gene stroke corresponds to
+#------------------------------------------------------------------------------
+class GeneScore(object):
+    def __init__(self, aryStrokes, aryMissing):
+        self.aryStrokes = aryStrokes
+        self.aryMissing = aryMissing
+
+        cStrokes = len(aryStrokes) or 1
+        self.deviation = sum([ score.deviation for score in aryStrokes ]) / cStrokes
+        self.extraLength = sum([ score.extraLength for score in aryStrokes ]) / cStrokes
+        self.placement = sum([ score.placement for score in aryStrokes ]) / cStrokes
+        self.dropouts = sum([ score.dropouts for score in aryStrokes ]) / cStrokes
+        return
+
+#------------------------------------------------------------------------------
+# Class: Scorer
+# 
+# Score expressed genes (see Expression) against a Han without running
+# Stylus. The measures follow those Stylus reports, computed locally:
+# - deviation: the mean distance, in Han units, between the points of a gene
+#   stroke (scaled to the bounds of its Han stroke) and the Han stroke points
+#   at the same fractional distance (forward or reverse, whichever is nearer)
+# - extraLength: the fraction by which a gene stroke, scaled with the gene
+#   to the Han, exceeds the length of its Han stroke
+# - placement: the distance, as a fraction of the Han diagonal, between the
+#   centers of a gene stroke (scaled with the gene) and its Han stroke
+# - dropouts: the fraction of gene stroke points (scaled with the gene) whose
+#   nearest Han point lies farther than dropoutFraction of the Han diagonal
+#
+# Notes:
+# - The Han strokes are resampled at half the grid cell size before entering
+#   the grid, so nearest points approximate nearest positions along strokes
+# - Build one Scorer per Han and reuse it across candidate genes
+#------------------------------------------------------------------------------
+class Scorer(object):
+    cellsPerSide = 32
+    dropoutFraction = 0.05
+
+    def __init__(self, han):
+        self.han = han
+        self.bounds = Rectangle(rect=han.bounds)
+        self.diagonal = math.sqrt((self.bounds.width * self.bounds.width) + (self.bounds.height * self.bounds.height)) or 1.0
+        self.dropoutDistance = self.diagonal * Scorer.dropoutFraction
+
+        self.aryLengths = [ hanStroke.length for hanStroke in han.aryStrokes ]
+        self.aryForward = [ _toColumns(hanStroke.aryPointsForward) for hanStroke in han.aryStrokes ]
+        self.aryReverse = [ _toColumns(hanStroke.aryPointsReverse) for hanStroke in han.aryStrokes ]
+
+        cellSize = self.diagonal / Scorer.cellsPerSide
+        aryPoints = []
+        for iStroke, hanStroke in enumerate(han.aryStrokes):
+            aryPoints.extend([ (x, y, iStroke) for x, y in _resample(hanStroke.aryPointsForward, cellSize / 2) ])
+        self.grid = PointGrid(aryPoints, cellSize)
+        return
+
+    def score(self, expression):
+        # A gene expressing no strokes misses every Han stroke
+        if expression.bounds is None:
+            return GeneScore([], range(len(self.han.aryStrokes)))
+
+        sx, sy = _toScale(expression.bounds, self.bounds)
+        dx = self.bounds.ptCenter.x - (expression.bounds.ptCenter.x * sx)
+        dy = self.bounds.ptCenter.y - (expression.bounds.ptCenter.y * sy)
+
+        aryScores = []
+        setCovered = set()
+        for iStroke, stroke in enumerate(expression.gene.aryStrokes):
+            iHanStroke = stroke.correspondsTo - 1
+            if iHanStroke < 0 or iHanStroke >= len(self.han.aryStrokes):
+                raise ValueError('Gene stroke %d corresponds to Han stroke %d, which does not exist' % (iStroke+1, stroke.correspondsTo))
+            setCovered.add(iHanStroke)
+            path = expression.aryStrokes[iStroke]
+            hanStroke = self.han.aryStrokes[iHanStroke]
+            score = StrokeScore(iStroke, iHanStroke)
+
+            # Deviation compares the stroke scaled to the bounds of its Han stroke
+            sxStroke, syStroke = _toScale(path.bounds, hanStroke.bounds)
+            aryX = [ ((x - path.bounds.ptCenter.x) * sxStroke) + hanStroke.bounds.ptCenter.x for x in path.aryX ]
+            aryY = [ ((y - path.bounds.ptCenter.y) * syStroke) + hanStroke.bounds.ptCenter.y for y in path.aryY ]
+            aryDistances = _toDistances(aryX, aryY)
+            deviationForward = _deviation(aryX, aryY, aryDistances, self.aryForward[iHanStroke])
+            deviationReverse = _deviation(aryX, aryY, aryDistances, self.aryReverse[iHanStroke])
+            score.fReversed = deviationReverse < deviationForward
+            score.deviation = min(deviationForward, deviationReverse)
+
+            # The remaining measures place the stroke as scaled with the whole gene
+            aryX = [ (x * sx) + dx for x in path.aryX ]
+            aryY = [ (y * sy) + dy for y in path.aryY ]
+            length = _toLength(aryX, aryY)
+            score.extraLength = max(0.0, length - self.aryLengths[iHanStroke]) / (self.aryLengths[iHanStroke] or 1.0)
+
+            xCenter = ((min(aryX) + max(aryX)) / 2) - hanStroke.bounds.ptCenter.x
+            yCenter = ((min(aryY) + max(aryY)) / 2) - hanStroke.bounds.ptCenter.y
+            score.placement = math.sqrt((xCenter * xCenter) + (yCenter * yCenter)) / self.diagonal
+
+            cDropouts = 0
+            for i in xrange(len(aryX)):
+                if self.grid.nearest(aryX[i], aryY[i])[0] > self.dropoutDistance:
+                    cDropouts += 1
+            score.dropouts = float(cDropouts) / len(aryX)
+
+            aryScores.append(score)
+
+        return GeneScore(aryScores, [ i for i in xrange(len(self.han.aryStrokes)) if not i in setCovered ])
+
+def _toScale(rectFrom, rectTo):
+    sx = rectFrom.width and (rectTo.width / rectFrom.width) or None
+    sy = rectFrom.height and (rectTo.height / rectFrom.height) or None
+    if sx is None: sx = sy
+    if sy is None: sy = sx
+    if sx is None:
+        sx = sy = 1.0
+    return sx, sy
+
+def _toColumns(aryPtd):
+    return [ ptd.x for ptd in aryPtd ], [ ptd.y for ptd in aryPtd ], [ ptd.distance for ptd in aryPtd ]
+
+def _toLength(aryX, aryY):
+    return sum([ math.sqrt(((aryX[i] - aryX[i-1]) * (aryX[i] - aryX[i-1])) + ((aryY[i] - aryY[i-1]) * (aryY[i] - aryY[i-1]))) for i in xrange(1, len(aryX)) ])
+
+def _toDistances(aryX, aryY):
+    aryDistances = [ 0.0 ]
+    for i in xrange(1, len(aryX)):
+        aryDistances.append(aryDistances[-1] + math.sqrt(((aryX[i] - aryX[i-1]) * (aryX[i] - aryX[i-1])) + ((aryY[i] - aryY[i-1]) * (aryY[i] - aryY[i-1]))))
+    length = aryDistances[-1] or 1.0
+    return [ distance / length for distance in aryDistances ]
+
+#------------------------------------------------------------------------------
+# Function: _deviation
+# 
+# Return the mean distance between points and those at the same fractional
+# distance along a Han stroke (given as x, y, and distance columns). Both
+# sets of points are ordered by fractional distance, so a single merged walk
+# finds the Han points bracketing each point.
+#------------------------------------------------------------------------------
+def _deviation(aryX, aryY, aryDistances, columns):
+    aryHanX, aryHanY, aryHanDistances = columns
+    iLast = len(aryHanX) - 1
+    j = 0
+    total = 0.0
+    for i in xrange(len(aryX)):
+        distance = aryDistances[i]
+        while j < iLast - 1 and aryHanDistances[j+1] < distance:
+            j += 1
+        if iLast > 0 and aryHanDistances[j+1] > aryHanDistances[j]:
+            f = min(max((distance - aryHanDistances[j]) / (aryHanDistances[j+1] - aryHanDistances[j]), 0.0), 1.0)
+            x = aryHanX[j] + ((aryHanX[j+1] - aryHanX[j]) * f)
+            y = aryHanY[j] + ((aryHanY[j+1] - aryHanY[j]) * f)
+        else:
+            x = aryHanX[j]
+            y = aryHanY[j]
+        total += math.sqrt(((aryX[i] - x) * (aryX[i] - x)) + ((aryY[i] - y) * (aryY[i] - y)))
+    return total / (len(aryX) or 1)
+
+#------------------------------------------------------------------------------
+# Function: _resample
+# 
+# Return (x, y) points along a stroke spaced no farther apart than spacing
+#------------------------------------------------------------------------------
+def _resample(aryPts, spacing):
+    aryPoints = aryPts and [ (aryPts[0].x, aryPts[0].y) ] or []
+    for i in xrange(1, len(aryPts)):
+        x1, y1, x2, y2 = aryPts[i-1].x, aryPts[i-1].y, aryPts[i].x, aryPts[i].y
+        cSteps = max(1, int(math.ceil(math.sqrt(((x2 - x1) * (x2 - x1)) + ((y2 - y1) * (y2 - y1))) / spacing)))
+        aryPoints.extend([ (x1 + ((x2 - x1) * k / cSteps), y1 + ((y2 - y1) * k / cSteps)) for k in xrange(1, cSteps+1) ])
+    return aryPoints
+
 #------------------------------------------------------------------------------
 # Class: HanGroup
 # 
 #------------------------------------------------------------------------------
 class HanGroup(object):
-    def __init__(self, dictGroup):
-        self.bounds = Rectangle(dictRect=dictGroup['bounds'])
-        self.length = dictGroup['length'][xmldict.XMLDict.value]
-        self.weightedCenter = Point(dictPoint=dictGroup['weightedCenter'])
-        self.containedStrokes = [ int(strStroke)-1 for strStroke in dictGroup['containedStrokes'][xmldict.XMLDict.value].split() ]
+    def __init__(self, dictGroup=None):
+        self.bounds = None
+        self.length = None
+        self.weightedCenter = None
+        self.containedStrokes = []
+
+        if dictGroup:
+            self.bounds = dictGroup['bounds']
+            self.length = dictGroup['length'][xmldict.XMLDict.value]
+            self.weightedCenter = dictGroup['weightedCenter']
+            self.containedStrokes = [ nStroke-1 for nStroke in dictGroup['containedStrokes'][xmldict.XMLDict.value] ]
         return
 
 #------------------------------------------------------------------------------
@@ -821,13 +1560,19 @@ class HanGroup(object):
 # 
 #------------------------------------------------------------------------------
 class HanStroke(object):
-    def __init__(self, dictStroke):
-        self.bounds = Rectangle(dictRect=dictStroke['bounds'])
-        self.length = dictStroke['length'][xmldict.XMLDict.value]
-        
-        dictPoints = dictStroke['points']
-        self.aryPointsForward = [ PointDistance(dictPoint=dictPoint) for tag, dictPoint in dictPoints['forward'][xmldict.XMLDict.children] ]
-        self.aryPointsReverse = [ PointDistance(dictPoint=dictPoint) for tag, dictPoint in dictPoints['reverse'][xmldict.XMLDict.children] ]
+    def __init__(self, dictStroke=None):
+        self.bounds = None
+        self.length = None
+        self.aryPointsForward = []
+        self.aryPointsReverse = []
+
+        if dictStroke:
+            self.bounds = dictStroke['bounds']
+            self.length = dictStroke['length'][xmldict.XMLDict.value]
+            
+            dictPoints = dictStroke['points']
+            self.aryPointsForward = [ ptd for tag, ptd in dictPoints['forward'][xmldict.XMLDict.children] ]
+            self.aryPointsReverse = [ ptd for tag, ptd in dictPoints['reverse'][xmldict.XMLDict.children] ]
         return
 
 #------------------------------------------------------------------------------
@@ -835,19 +1580,49 @@ class HanStroke(object):
 # 
 #------------------------------------------------------------------------------
 class HanOverlap(object):
-    def __init__(self, dictOverlap):
-        self.firstStroke = dictOverlap['firstStroke']
-        self.secondStroke = dictOverlap['secondStroke']
-        self.required = dictOverlap['required'] == 'true' and True or False
+    def __init__(self, dictOverlap=None):
+        self.firstStroke = None
+        self.secondStroke = None
+        self.required = False
+
+        if dictOverlap:
+            self.firstStroke = dictOverlap['firstStroke']
+            self.secondStroke = dictOverlap['secondStroke']
+            self.required = dictOverlap['required']
         return
 
 #------------------------------------------------------------------------------
 # Class: Han
 # 
+# Note:
+# - Constructing a Han without a URL yields an empty definition; alternate
+#   sources (such as the packed archive in hanarchive.py) fill it directly
 #------------------------------------------------------------------------------
 class Han(object):
-    def __init__(self, urlHan):
-        xmlDict = xmldict.XMLDict({ xmldict.XMLDict.toList : [ 'groups', 'strokes', 'forward', 'reverse', 'overlaps' ] })
+    def __init__(self, urlHan=None):
+        self.uuid = None
+        self.unicode = None
+
+        self.creationDate = None
+        self.creationTool = None
+        self.creationParameters = None
+
+        self.bounds = None
+        self.length = None
+        self.minimumStrokeLength = None
+
+        self.aryGroups = []
+        self.aryStrokes = []
+        self.aryOverlaps = []
+
+        if urlHan:
+            self.__load(urlHan)
+        return
+
+    def __load(self, urlHan):
+        xmlDict = xmldict.XMLDict({ xmldict.XMLDict.toList : [ 'groups', 'strokes', 'forward', 'reverse', 'overlaps' ],
+                                    xmldict.XMLDict.types : _dictTypes,
+                                    xmldict.XMLDict.factories : _dictFactories })
         dictHan = xmlDict.load(urlHan)['hanDefinition']
         
         self.uuid = dictHan['uuid']
@@ -857,7 +1632,7 @@ class Han(object):
         self.creationTool = 'creationTool' in dictHan and dictHan['creationTool'] or None
         self.creationParameters = 'creationParameters' in dictHan and dictHan['creationParameters'] or None
 
-        self.bounds = Rectangle(dictRect=dictHan['bounds'])
+        self.bounds = dictHan['bounds']
         self.length = dictHan['length'][xmldict.XMLDict.value]
         self.minimumStrokeLength = dictHan['minimumStrokeLength'][xmldict.XMLDict.value]
 
@@ -961,15 +1736,18 @@ class HCFOverlap(object):
         aryOverlap = strOverlap.split(',')
         self.firstStroke = int(aryOverlap[0])
         self.secondStroke = int(aryOverlap[1])
-        self.fRequired = int(aryOverlap[2]) and True or False
+        self.required = int(aryOverlap[2]) and True or False
         return
         
     def __str__(self):
-        return '(%d,%d,%s)' % (self.firstStroke, self.secondStroke, self.fRequired and 'true' or 'false')
+        return '(%d,%d,%s)' % (self.firstStroke, self.secondStroke, self.required and 'true' or 'false')
 
 #------------------------------------------------------------------------------
 # Class: HCF
 # 
+# Notes:
+# - Given strHCF, the HCF is parsed from that text (already read from urlHCF)
+#   rather than read again from urlHCF
 #------------------------------------------------------------------------------
 class HCF(object):
     _rstrUnicode = r'[A-F\d]{4,5}'
@@ -981,7 +1759,7 @@ class HCF(object):
     _reGroup = re.compile(r'group:(\d+(?:,\d+)*)')
     _reOverlap = re.compile(r'overlap:(\d+,\d+,[0|1])')
     
-    def __init__(self, urlHCF):
+    def __init__(self, urlHCF, strHCF=None):
         self.unicode = ''
         self.bounds = Rectangle()
         self.length = 0
@@ -990,8 +1768,11 @@ class HCF(object):
         self.aryGroups = []
         self.aryOverlaps = []
 
-        try: fileHCF = urllib2.urlopen(urlHCF)
-        except urllib2.URLError, err: raise HCFError('Unable to open URL %s - %s' % (urlHCF, str(err)))
+        if strHCF is None:
+            try: fileHCF = Fetch.openURL(urlHCF)
+            except urllib2.URLError, err: raise HCFError('Unable to open URL %s - %s' % (urlHCF, str(err)))
+        else:
+            fileHCF = StringIO.StringIO(strHCF)
         
         for l in fileHCF.readlines():
             mo = HCF._reHan.match(l)
@@ -0,0 +1,368 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# Stylus, Copyright 2006-2008 Biologic Institute
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+'''
+hanarchive.py
+
+This script packs Han definitions into a single binary archive and loads
+them back, by Unicode value, as genome.Han objects.
+
+An archive begins with a fixed header and an index sorted by Unicode value;
+each index entry gives the offset and size of one packed Han record. Records
+store their numeric data by column (all stroke bounds, then all stroke
+lengths, then all point x values, and so on) so that loading a Han is a
+seek into the memory-mapped file followed by a handful of slices.
+
+Stylus, Copyright 2006-2008 Biologic Institute.
+'''
+
+import array
+import fnmatch
+import mmap
+import os
+import struct
+import sys
+
+import genome as Genome
+
+#==============================================================================
+# Global Constants
+#==============================================================================
+class Constants:
+    magic = 'HANA'
+    version = 1
+
+    extArchive = '.hana'
+    globHan = '*.han'
+    globHanCompressed = '*.han.gz'
+
+    # Archive header: magic, version, reserved, count of records
+    fmtHeader = '<4sHHI'
+    cbHeader = struct.calcsize(fmtHeader)
+
+    # Index entry: Unicode value, record offset, record size
+    fmtIndex = '<IQI'
+    cbIndex = struct.calcsize(fmtIndex)
+
+    # Record header: string lengths (uuid, unicode, creationDate, creationTool, creationParameters),
+    # Han bounds, length, minimumStrokeLength, and the count of groups, strokes, and overlaps
+    fmtRecord = '<5H8ddd3I'
+    cbRecord = struct.calcsize(fmtRecord)
+
+    # Marks a missing (None) string
+    cbNone = 0xFFFF
+
+    # Doubles per stored rectangle (top, left, bottom, right, width, height, x-midpoint, y-midpoint)
+    cRectangle = 8
+
+#==============================================================================
+# Classes
+#==============================================================================
+#------------------------------------------------------------------------------
+# Class: HanArchiveError
+#
+#------------------------------------------------------------------------------
+class HanArchiveError(Exception):
+    def __init__(self, msg):
+        self.msg = ''
+        if msg and len(msg) > 0:
+            self.msg = 'Error: ' + msg
+
+    def __str__(self):
+        return self.msg
+
+#------------------------------------------------------------------------------
+# Class: HanArchive
+#
+# Read-only access to a packed archive. The index is read once on open; each
+# load then slices a single record from the memory-mapped file.
+#------------------------------------------------------------------------------
+class HanArchive(object):
+    def __init__(self, strPath):
+        self.strPath = strPath
+        self.__dictIndex = {}
+
+        try:
+            self.__file = open(strPath, 'rb')
+            self.__mm = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (IOError, OSError, mmap.error), err:
+            raise HanArchiveError('Unable to open archive %s - %s' % (strPath, str(err)))
+
+        if len(self.__mm) < Constants.cbHeader:
+            raise HanArchiveError('%s is not a Han archive' % strPath)
+        strMagic, nVersion, nReserved, cRecords = struct.unpack_from(Constants.fmtHeader, self.__mm, 0)
+        if strMagic != Constants.magic:
+            raise HanArchiveError('%s is not a Han archive' % strPath)
+        if nVersion != Constants.version:
+            raise HanArchiveError('%s uses an unsupported archive version (%d)' % (strPath, nVersion))
+
+        iEntry = Constants.cbHeader
+        for i in xrange(cRecords):
+            nUnicode, iOffset, cbRecord = struct.unpack_from(Constants.fmtIndex, self.__mm, iEntry)
+            self.__dictIndex[nUnicode] = (iOffset, cbRecord)
+            iEntry += Constants.cbIndex
+        return
+
+    def __contains__(self, strUnicode):
+        return _toKey(strUnicode) in self.__dictIndex
+
+    def __len__(self):
+        return len(self.__dictIndex)
+
+    def close(self):
+        self.__mm.close()
+        self.__file.close()
+        return
+
+    def unicodes(self):
+        return [ '%04X' % nUnicode for nUnicode in sorted(self.__dictIndex.keys()) ]
+
+    def load(self, strUnicode):
+        try: iOffset, cbRecord = self.__dictIndex[_toKey(strUnicode)]
+        except KeyError: raise LookupError('%s does not contain Han %s' % (self.strPath, strUnicode))
+        return unpackHan(self.__mm[iOffset:iOffset+cbRecord])
+
+#------------------------------------------------------------------------------
+# Class: HanArchiveWriter
+#
+# Records are appended as Han definitions are added; the header and index,
+# whose size is unknown until all records are present, are written on close.
+#------------------------------------------------------------------------------
+class HanArchiveWriter(object):
+    def __init__(self, strPath):
+        self.strPath = strPath
+        self.__aryRecords = []
+        self.__setUnicodes = set()
+        return
+
+    def add(self, han):
+        nUnicode = _toKey(han.unicode)
+        if nUnicode in self.__setUnicodes:
+            raise HanArchiveError('Han %s was added to %s more than once' % (han.unicode, self.strPath))
+        self.__setUnicodes.add(nUnicode)
+        self.__aryRecords.append((nUnicode, packHan(han)))
+        return
+
+    def close(self):
+        self.__aryRecords.sort()
+
+        iOffset = Constants.cbHeader + (len(self.__aryRecords) * Constants.cbIndex)
+        aryIndex = []
+        for nUnicode, strRecord in self.__aryRecords:
+            aryIndex.append(struct.pack(Constants.fmtIndex, nUnicode, iOffset, len(strRecord)))
+            iOffset += len(strRecord)
+
+        try:
+            fileArchive = open(self.strPath, 'wb')
+            fileArchive.write(struct.pack(Constants.fmtHeader, Constants.magic, Constants.version, 0, len(self.__aryRecords)))
+            fileArchive.write(''.join(aryIndex))
+            for nUnicode, strRecord in self.__aryRecords:
+                fileArchive.write(strRecord)
+            fileArchive.close()
+        except IOError, err: raise HanArchiveError('Unable to write %s - %s' % (self.strPath, str(err)))
+        return
+
+#==============================================================================
+# Global Functions
+#==============================================================================
+def _toKey(strUnicode):
+    try: return int(strUnicode, 16)
+    except (TypeError, ValueError): raise LookupError('%s is not a valid Unicode value' % strUnicode)
+
+def _packString(str):
+    if str is None:
+        return ''
+    return str.encode('utf-8')
+
+def _packStringLength(str):
+    if str is None:
+        return Constants.cbNone
+    return len(str.encode('utf-8'))
+
+# Columns are stored little-endian (as is the header)
+def _packArray(typecode, aryValues):
+    ary = array.array(typecode, aryValues)
+    if sys.byteorder != 'little':
+        ary.byteswap()
+    return ary.tostring()
+
+def _packDoubles(aryValues):
+    return _packArray('d', aryValues)
+
+def _packIntegers(aryValues):
+    return _packArray('I', aryValues)
+
+def _packRectangle(rect):
+    return [ rect.top, rect.left, rect.bottom, rect.right, rect.width, rect.height, rect.ptCenter.x, rect.ptCenter.y ]
+
+def _unpackRectangle(aryValues, i):
+    rect = Genome.Rectangle()
+    rect.top, rect.left, rect.bottom, rect.right, rect.width, rect.height, rect.ptCenter.x, rect.ptCenter.y = aryValues[i:i+Constants.cRectangle]
+    return rect
+
+#------------------------------------------------------------------------------
+# Function: packHan
+#
+# Convert a Han into a packed record. Lengths are stored as doubles and stroke
+# numbers as integers, the same types the XML form yields once parsed.
+#------------------------------------------------------------------------------
+def packHan(han):
+    aryStrings = [ han.uuid, han.unicode, han.creationDate, han.creationTool, han.creationParameters ]
+
+    aryParts = [ struct.pack(Constants.fmtRecord, *([ _packStringLength(str) for str in aryStrings ] +
+                                                    _packRectangle(han.bounds) +
+                                                    [ float(han.length), float(han.minimumStrokeLength),
+                                                    len(han.aryGroups), len(han.aryStrokes), len(han.aryOverlaps) ])) ]
+    aryParts += [ _packString(str) for str in aryStrings ]
+
+    # Group columns
+    aryParts.append(_packDoubles([ f for hanGroup in han.aryGroups for f in _packRectangle(hanGroup.bounds) ]))
+    aryParts.append(_packDoubles([ float(hanGroup.length) for hanGroup in han.aryGroups ]))
+    aryParts.append(_packDoubles([ f for hanGroup in han.aryGroups for f in (hanGroup.weightedCenter.x, hanGroup.weightedCenter.y) ]))
+    aryParts.append(_packIntegers([ len(hanGroup.containedStrokes) for hanGroup in han.aryGroups ]))
+    aryParts.append(_packIntegers([ iStroke for hanGroup in han.aryGroups for iStroke in hanGroup.containedStrokes ]))
+
+    # Stroke columns
+    aryParts.append(_packDoubles([ f for hanStroke in han.aryStrokes for f in _packRectangle(hanStroke.bounds) ]))
+    aryParts.append(_packDoubles([ float(hanStroke.length) for hanStroke in han.aryStrokes ]))
+    aryParts.append(_packIntegers([ len(hanStroke.aryPointsForward) for hanStroke in han.aryStrokes ]))
+    aryParts.append(_packIntegers([ len(hanStroke.aryPointsReverse) for hanStroke in han.aryStrokes ]))
+    for strPoints in [ 'aryPointsForward', 'aryPointsReverse' ]:
+        aryParts.append(_packDoubles([ ptd.x for hanStroke in han.aryStrokes for ptd in getattr(hanStroke, strPoints) ]))
+        aryParts.append(_packDoubles([ ptd.y for hanStroke in han.aryStrokes for ptd in getattr(hanStroke, strPoints) ]))
+        aryParts.append(_packDoubles([ ptd.distance for hanStroke in han.aryStrokes for ptd in getattr(hanStroke, strPoints) ]))
+
+    # Overlap columns
+    aryParts.append(_packIntegers([ int(hanOverlap.firstStroke) for hanOverlap in han.aryOverlaps ]))
+    aryParts.append(_packIntegers([ int(hanOverlap.secondStroke) for hanOverlap in han.aryOverlaps ]))
+    aryParts.append(_packArray('B', [ hanOverlap.required and 1 or 0 for hanOverlap in han.aryOverlaps ]))
+
+    return ''.join(aryParts)
+
+#------------------------------------------------------------------------------
+# Class: _Reader
+#
+# Sequentially slices columns from a packed record
+#------------------------------------------------------------------------------
+class _Reader(object):
+    def __init__(self, strRecord, iOffset):
+        self.strRecord = strRecord
+        self.iOffset = iOffset
+        return
+
+    def read(self, typecode, cValues):
+        ary = array.array(typecode)
+        cb = ary.itemsize * cValues
+        ary.fromstring(self.strRecord[self.iOffset:self.iOffset+cb])
+        if sys.byteorder != 'little':
+            ary.byteswap()
+        self.iOffset += cb
+        return ary
+
+    def readString(self, cb):
+        if cb == Constants.cbNone:
+            return None
+        str = self.strRecord[self.iOffset:self.iOffset+cb]
+        self.iOffset += cb
+        return str
+
+#------------------------------------------------------------------------------
+# Function: unpackHan
+#
+#------------------------------------------------------------------------------
+def unpackHan(strRecord):
+    aryHeader = struct.unpack_from(Constants.fmtRecord, strRecord, 0)
+    cGroups, cStrokes, cOverlaps = aryHeader[-3:]
+    reader = _Reader(strRecord, Constants.cbRecord)
+
+    han = Genome.Han()
+    han.uuid, han.unicode, han.creationDate, han.creationTool, han.creationParameters = [ reader.readString(cb) for cb in aryHeader[:5] ]
+    han.bounds = _unpackRectangle(aryHeader, 5)
+    han.length = aryHeader[5+Constants.cRectangle]
+    han.minimumStrokeLength = aryHeader[6+Constants.cRectangle]
+
+    # Groups
+    aryBounds = reader.read('d', cGroups * Constants.cRectangle)
+    aryLength = reader.read('d', cGroups)
+    aryCenter = reader.read('d', cGroups * 2)
+    aryCounts = reader.read('I', cGroups)
+    aryContained = reader.read('I', sum(aryCounts))
+    iContained = 0
+    for i in xrange(cGroups):
+        hanGroup = Genome.HanGroup()
+        hanGroup.bounds = _unpackRectangle(aryBounds, i * Constants.cRectangle)
+        hanGroup.length = aryLength[i]
+        hanGroup.weightedCenter = Genome.Point(x=aryCenter[i*2], y=aryCenter[i*2+1])
+        hanGroup.containedStrokes = aryContained[iContained:iContained+aryCounts[i]].tolist()
+        iContained += aryCounts[i]
+        han.aryGroups.append(hanGroup)
+
+    # Strokes
+    aryBounds = reader.read('d', cStrokes * Constants.cRectangle)
+    aryLength = reader.read('d', cStrokes)
+    aryCountsForward = reader.read('I', cStrokes)
+    aryCountsReverse = reader.read('I', cStrokes)
+    aryForward = [ reader.read('d', sum(aryCountsForward)) for i in xrange(3) ]
+    aryReverse = [ reader.read('d', sum(aryCountsReverse)) for i in xrange(3) ]
+    iForward = 0
+    iReverse = 0
+    for i in xrange(cStrokes):
+        hanStroke = Genome.HanStroke()
+        hanStroke.bounds = _unpackRectangle(aryBounds, i * Constants.cRectangle)
+        hanStroke.length = aryLength[i]
+        hanStroke.aryPointsForward = [ Genome.PointDistance(x=aryForward[0][j], y=aryForward[1][j], distance=aryForward[2][j]) for j in xrange(iForward, iForward+aryCountsForward[i]) ]
+        hanStroke.aryPointsReverse = [ Genome.PointDistance(x=aryReverse[0][j], y=aryReverse[1][j], distance=aryReverse[2][j]) for j in xrange(iReverse, iReverse+aryCountsReverse[i]) ]
+        iForward += aryCountsForward[i]
+        iReverse += aryCountsReverse[i]
+        han.aryStrokes.append(hanStroke)
+
+    # Overlaps
+    aryFirst = reader.read('I', cOverlaps)
+    arySecond = reader.read('I', cOverlaps)
+    aryRequired = reader.read('B', cOverlaps)
+    for i in xrange(cOverlaps):
+        hanOverlap = Genome.HanOverlap()
+        hanOverlap.firstStroke = aryFirst[i]
+        hanOverlap.secondStroke = arySecond[i]
+        hanOverlap.required = aryRequired[i] and True or False
+        han.aryOverlaps.append(hanOverlap)
+
+    return han
+
+#------------------------------------------------------------------------------
+# Function: packArchetypes
+#
+# Pack every Han definition found beneath the passed Archetypes directory
+#------------------------------------------------------------------------------
+def packArchetypes(strArchetypePath, strArchivePath, fnProgress=None):
+    writer = HanArchiveWriter(strArchivePath)
+    cHan = 0
+    for root, dirs, files in os.walk(strArchetypePath):
+        dirs.sort()
+        # Compressed Han are packed only when no uncompressed copy sits beside them
+        aryFiles = fnmatch.filter(files, Constants.globHan)
+        aryFiles += [ f for f in fnmatch.filter(files, Constants.globHanCompressed) if not os.path.splitext(f)[0] in aryFiles ]
+        for f in sorted(aryFiles):
+            strPath = os.path.join(root, f)
+            writer.add(Genome.Han('file://' + os.path.abspath(strPath)))
+            cHan += 1
+            if fnProgress:
+                fnProgress(strPath)
+    writer.close()
+    return cHan
+
+if __name__ == '__main__':
+    pass
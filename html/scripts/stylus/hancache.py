@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# Stylus, Copyright 2006-2008 Biologic Institute
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+'''
+hancache.py
+
+A persistent cache of parsed Han definitions.
+
+Entries hold the packed form used by Han archives (see hanarchive.py) and
+are keyed by the identity of the source file: its path plus its size and
+modification time or, optionally, a hash of its content. Changing a Han
+file changes its key, so stale entries are never returned; they simply age
+out of the cache.
+
+Stylus, Copyright 2006-2008 Biologic Institute.
+'''
+
+import hashlib
+import os
+import urllib2
+import urlparse
+
+import diskcache as DiskCache
+import fetch as Fetch
+import genome as Genome
+import hanarchive as HanArchive
+
+#==============================================================================
+# Global Constants
+#==============================================================================
+class Constants:
+    schemeFile = 'file'
+
+    # Precedes the file identity within each entry (changing the packed form requires changing this)
+    strTag = 'HANC1'
+    chSeparator = '\n'
+
+#==============================================================================
+# Classes
+#==============================================================================
+#------------------------------------------------------------------------------
+# Class: HanCache
+#
+# Notes:
+# - Only file URLs are cached; other URLs load directly
+# - The file identity is stored within the entry and compared on reads, so a
+#   (however unlikely) key collision is treated as a miss
+#------------------------------------------------------------------------------
+class HanCache(object):
+    def __init__(self, strPath, cbMax=DiskCache.Constants.cbDefault, fContentHash=False):
+        self.__cache = DiskCache.DiskCache(strPath, cbMax)
+        self.fContentHash = fContentHash
+        self.hits = 0
+        self.misses = 0
+        return
+
+    def __getIdentity(self, strPath):
+        if self.fContentHash:
+            fileHan = open(strPath, 'rb')
+            try: return '%s:sha1:%s' % (strPath, hashlib.sha1(fileHan.read()).hexdigest())
+            finally: fileHan.close()
+        else:
+            st = os.stat(strPath)
+            return '%s:%d:%r' % (strPath, st.st_size, st.st_mtime)
+
+    def load(self, urlHan):
+        # Identify compressed Han by the compressed file, which is the one read
+        aryURL = urlparse.urlsplit(Fetch.findURL(urlHan))
+        if aryURL[0].lower() != Constants.schemeFile:
+            return Genome.Han(urlHan)
+
+        # Unreadable files fall through to the normal load, which reports the error
+        try: strIdentity = Constants.strTag + Constants.chSeparator + self.__getIdentity(urllib2.url2pathname(aryURL[2])) + Constants.chSeparator
+        except (IOError, OSError): return Genome.Han(urlHan)
+
+        strEntry = self.__cache.get(strIdentity)
+        if strEntry and strEntry.startswith(strIdentity):
+            try:
+                han = HanArchive.unpackHan(strEntry[len(strIdentity):])
+                self.hits += 1
+                return han
+            except Exception:
+                self.__cache.remove(strIdentity)
+
+        self.misses += 1
+        han = Genome.Han(urlHan)
+        self.__cache.put(strIdentity, strIdentity + HanArchive.packHan(han))
+        return han
+
+if __name__ == '__main__':
+    pass
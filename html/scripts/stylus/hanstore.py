@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# Stylus, Copyright 2006-2008 Biologic Institute
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+'''
+hanstore.py
+
+An in-memory store of loaded Han definitions, keyed by Unicode value.
+
+Han definitions load on demand through a caller-supplied function and are
+kept until the store's estimate of their memory passes its budget, when
+the least recently used are dropped. Long-running and batch callers share
+one store rather than each keeping its own dictionary of Han.
+
+Stylus, Copyright 2006-2008 Biologic Institute.
+'''
+
+import collections
+import threading
+
+import genome as Genome
+
+#==============================================================================
+# Global Constants
+#==============================================================================
+class Constants:
+    # Budget used when none is given
+    cbDefault = 32 * 1024 * 1024
+
+    # Approximate bytes held by a Han, each group, stroke and overlap, and each point of a stroke
+    cbHan = 4096
+    cbGroup = 1024
+    cbStroke = 2048
+    cbOverlap = 512
+    cbPoint = 320
+
+#==============================================================================
+# Classes
+#==============================================================================
+#------------------------------------------------------------------------------
+# Class: HanStore
+#
+# Notes:
+# - Keys are Unicode values (e.g., 4E8C) in any case
+# - The size of each Han is estimated from its counts of groups, strokes,
+#   overlaps, and points (see estimateSize) rather than measured
+# - The most recently loaded Han is kept even if it alone exceeds the budget
+# - Loads happen outside the store's lock, so two threads asking for the
+#   same missing Han may each load it; the later simply replaces the earlier
+#------------------------------------------------------------------------------
+class HanStore(object):
+    def __init__(self, fnLoad, cbMax=Constants.cbDefault):
+        self.fnLoad = fnLoad
+        self.cbMax = cbMax
+        self.cbUsed = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.__dictHan = collections.OrderedDict()
+        self.__lock = threading.Lock()
+        return
+
+    def __contains__(self, strUnicode):
+        return strUnicode.upper() in self.__dictHan
+
+    def __len__(self):
+        return len(self.__dictHan)
+
+    def __getitem__(self, strUnicode):
+        strUnicode = strUnicode.upper()
+        self.__lock.acquire()
+        try:
+            entry = self.__dictHan.pop(strUnicode, None)
+            if entry:
+                self.__dictHan[strUnicode] = entry
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        finally:
+            self.__lock.release()
+
+        han = self.fnLoad(strUnicode)
+        cbHan = estimateSize(han)
+
+        self.__lock.acquire()
+        try:
+            entry = self.__dictHan.pop(strUnicode, None)
+            if entry:
+                self.cbUsed -= entry[1]
+            self.__dictHan[strUnicode] = (han, cbHan)
+            self.cbUsed += cbHan
+            while self.cbUsed > self.cbMax and len(self.__dictHan) > 1:
+                strOldest, (hanOldest, cbOldest) = self.__dictHan.popitem(last=False)
+                self.cbUsed -= cbOldest
+                self.evictions += 1
+        finally:
+            self.__lock.release()
+        return han
+
+    #--------------------------------------------------------------------------
+    # Function: discard
+    #
+    # Drop a Han (e.g., after its definition is rebuilt) so the next request
+    # loads it again
+    #--------------------------------------------------------------------------
+    def discard(self, strUnicode):
+        self.__lock.acquire()
+        try:
+            entry = self.__dictHan.pop(strUnicode.upper(), None)
+            if entry:
+                self.cbUsed -= entry[1]
+        finally:
+            self.__lock.release()
+        return
+
+    def clear(self):
+        self.__lock.acquire()
+        try:
+            self.__dictHan.clear()
+            self.cbUsed = 0
+        finally:
+            self.__lock.release()
+        return
+
+#------------------------------------------------------------------------------
+# Function: estimateSize
+#
+# Return the approximate bytes of memory held by a Han
+#------------------------------------------------------------------------------
+def estimateSize(han):
+    cPoints = sum([ len(hanStroke.aryPointsForward) + len(hanStroke.aryPointsReverse) for hanStroke in han.aryStrokes ])
+    return (Constants.cbHan +
+            (len(han.aryGroups) * Constants.cbGroup) +
+            (len(han.aryStrokes) * Constants.cbStroke) +
+            (len(han.aryOverlaps) * Constants.cbOverlap) +
+            (cPoints * Constants.cbPoint))
+
+if __name__ == '__main__':
+    # Ensure the least recently used Han are evicted once the budget is passed
+    def makeHan(strUnicode):
+        han = Genome.Han()
+        han.unicode = strUnicode
+        return han
+
+    hanStore = HanStore(makeHan, Constants.cbHan * 3)
+    for strUnicode in [ '4E00', '4E01', '4E02', '4e00', '4E03' ]:
+        assert(hanStore[strUnicode].unicode == strUnicode.upper())
+    assert(hanStore.hits == 1 and hanStore.misses == 4 and hanStore.evictions == 1)
+    assert('4E00' in hanStore and not '4E01' in hanStore and len(hanStore) == 3)
+
+    hanStore.discard('4E02')
+    assert(not '4E02' in hanStore and hanStore.cbUsed == Constants.cbHan * 2)
@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# Stylus, Copyright 2006-2008 Biologic Institute
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+'''
+intersect.py
+
+Find where the strokes of a Han (or HCF) cross one another.
+
+Strokes are treated as polylines (the flattened points of each stroke) and
+their segments swept left to right (Bentley-Ottmann). The sweep keeps the
+segments crossing the sweep line ordered by height; only neighbours within
+that order are tested, and each crossing found becomes a later event at
+which the segments change places. Finding k crossings among n segments
+takes O((n + k) log n) comparisons rather than testing every pair.
+
+Stylus, Copyright 2006-2008 Biologic Institute.
+'''
+
+import fpconst
+import heapq
+import random
+
+import genome as Genome
+
+#==============================================================================
+# Global Constants
+#==============================================================================
+class Constants:
+    # Tolerance within which coordinates are considered equal
+    epsilon = 1e-7
+
+    # Decimal places retained when collecting the crossing points of a pair of strokes
+    nDigits = 6
+
+#==============================================================================
+# Classes
+#==============================================================================
+#------------------------------------------------------------------------------
+# Class: _Sweep
+#
+# Notes:
+# - Segments are stored as (x1, y1, x2, y2, polyline) with (x1, y1) the left
+#   (or, for vertical segments, the lower) end
+# - At each event the segments touching the event point form one run within
+#   the status; the run is removed and those continuing past the point are
+#   re-inserted ordered by slope, which is their order just past the point
+# - Vertical segments take the height of the event point while the sweep
+#   line lies upon them, and sort above all others passing through a point
+#------------------------------------------------------------------------------
+class _Sweep(object):
+    def __init__(self, arySegments):
+        self.arySegments = arySegments
+        self.dictPairs = {}
+
+        self.__x = None
+        self.__y = None
+        self.__aryStatus = []
+        self.__aryEvents = []
+        self.__dictStarts = {}
+
+        for iSegment, (x1, y1, x2, y2, iPolyline) in enumerate(arySegments):
+            ptStart = (x1, y1)
+            if not ptStart in self.__dictStarts:
+                self.__dictStarts[ptStart] = []
+                self.__aryEvents.append(ptStart)
+            self.__dictStarts[ptStart].append(iSegment)
+            self.__aryEvents.append((x2, y2))
+        heapq.heapify(self.__aryEvents)
+        return
+
+    def __yAt(self, iSegment):
+        x1, y1, x2, y2, iPolyline = self.arySegments[iSegment]
+        if x1 == x2:
+            return min(max(self.__y, y1), y2)
+        if self.__x == x1:
+            return y1
+        if self.__x == x2:
+            return y2
+        return y1 + ((self.__x - x1) * (y2 - y1) / (x2 - x1))
+
+    def __slope(self, iSegment):
+        x1, y1, x2, y2, iPolyline = self.arySegments[iSegment]
+        if x1 == x2:
+            return fpconst.PosInf
+        return (y2 - y1) / (x2 - x1)
+
+    def __isAfter(self, x, y):
+        return (x, y) > (self.__x, self.__y)
+
+    def __testPair(self, iSegment1, iSegment2):
+        x1, y1, x2, y2, iPolyline1 = self.arySegments[iSegment1]
+        x3, y3, x4, y4, iPolyline2 = self.arySegments[iSegment2]
+        dx1 = x2 - x1
+        dy1 = y2 - y1
+        dx2 = x4 - x3
+        dy2 = y4 - y3
+        denominator = (dx1 * dy2) - (dy1 * dx2)
+        if denominator == 0:
+            return
+
+        t = (((x3 - x1) * dy2) - ((y3 - y1) * dx2)) / denominator
+        u = (((x3 - x1) * dy1) - ((y3 - y1) * dx1)) / denominator
+        tolerance = Constants.epsilon / max(abs(dx1) + abs(dy1), abs(dx2) + abs(dy2))
+        if t < -tolerance or t > 1 + tolerance or u < -tolerance or u > 1 + tolerance:
+            return
+
+        x = x1 + (t * dx1)
+        y = y1 + (t * dy1)
+        if self.__isAfter(x, y):
+            heapq.heappush(self.__aryEvents, (x, y))
+        return
+
+    def __report(self, arySegments):
+        setPolylines = set([ self.arySegments[iSegment][4] for iSegment in arySegments ])
+        if len(setPolylines) < 2:
+            return
+        pt = (round(self.__x, Constants.nDigits), round(self.__y, Constants.nDigits))
+        aryPolylines = sorted(setPolylines)
+        for i in xrange(len(aryPolylines)):
+            for j in xrange(i+1, len(aryPolylines)):
+                self.dictPairs.setdefault((aryPolylines[i], aryPolylines[j]), set()).add(pt)
+        return
+
+    def __findRun(self):
+        aryStatus = self.__aryStatus
+        iLow = 0
+        iHigh = len(aryStatus)
+        while iLow < iHigh:
+            iMiddle = (iLow + iHigh) // 2
+            if self.__yAt(aryStatus[iMiddle]) < self.__y - Constants.epsilon:
+                iLow = iMiddle + 1
+            else:
+                iHigh = iMiddle
+        iEnd = iLow
+        while iEnd < len(aryStatus) and self.__yAt(aryStatus[iEnd]) <= self.__y + Constants.epsilon:
+            iEnd += 1
+        return iLow, iEnd
+
+    def run(self):
+        ptLast = None
+        while self.__aryEvents:
+            pt = heapq.heappop(self.__aryEvents)
+            if pt == ptLast:
+                continue
+            ptLast = pt
+            self.__x, self.__y = pt
+
+            aryStarting = self.__dictStarts.pop(pt, [])
+            iFirst, iEnd = self.__findRun()
+            aryTouching = self.__aryStatus[iFirst:iEnd]
+            self.__report(aryStarting + aryTouching)
+
+            aryContinuing = [ iSegment for iSegment in aryTouching + aryStarting if self.__isAfter(self.arySegments[iSegment][2], self.arySegments[iSegment][3]) ]
+            aryContinuing.sort(key=self.__slope)
+            self.__aryStatus[iFirst:iEnd] = aryContinuing
+
+            iEnd = iFirst + len(aryContinuing)
+            if not aryContinuing:
+                if iFirst > 0 and iFirst < len(self.__aryStatus):
+                    self.__testPair(self.__aryStatus[iFirst-1], self.__aryStatus[iFirst])
+            else:
+                if iFirst > 0:
+                    self.__testPair(self.__aryStatus[iFirst-1], self.__aryStatus[iFirst])
+                if iEnd < len(self.__aryStatus):
+                    self.__testPair(self.__aryStatus[iEnd-1], self.__aryStatus[iEnd])
+        return self.dictPairs
+
+#------------------------------------------------------------------------------
+# Function: findIntersections
+#
+# Return a dictionary mapping each pair of intersecting polylines (as a
+# tuple of their indexes, lowest first) to the sorted list of (x, y) points
+# at which they meet. Polylines are sequences of points (objects with x and
+# y); where a polyline crosses itself is not reported.
+#------------------------------------------------------------------------------
+def findIntersections(aryPolylines):
+    arySegments = []
+    for iPolyline, aryPoints in enumerate(aryPolylines):
+        cSegments = len(arySegments)
+        for i in xrange(1, len(aryPoints)):
+            pt1 = (float(aryPoints[i-1].x), float(aryPoints[i-1].y))
+            pt2 = (float(aryPoints[i].x), float(aryPoints[i].y))
+            if pt1 == pt2:
+                continue
+            if pt2 < pt1:
+                pt1, pt2 = pt2, pt1
+            arySegments.append((pt1[0], pt1[1], pt2[0], pt2[1], iPolyline))
+        if aryPoints and cSegments == len(arySegments):
+            pt = (float(aryPoints[0].x), float(aryPoints[0].y))
+            arySegments.append((pt[0], pt[1], pt[0], pt[1], iPolyline))
+
+    dictPairs = _Sweep(arySegments).run()
+    return dict([ (key, sorted(setPoints)) for key, setPoints in dictPairs.iteritems() ])
+
+#------------------------------------------------------------------------------
+# Function: findStrokeIntersections
+#
+# Return the intersections (see findIntersections) among the strokes of a Han
+# or HCF, with strokes identified by index into aryStrokes
+#------------------------------------------------------------------------------
+def findStrokeIntersections(han):
+    return findIntersections([ stroke.aryPointsForward for stroke in han.aryStrokes ])
+
+#------------------------------------------------------------------------------
+# Function: checkOverlaps
+#
+# Compare the overlaps declared by a Han or HCF with the strokes that cross,
+# returning a list of intersecting stroke pairs lacking a declared overlap
+# (as (first, second, points) using 1-based stroke numbers) and a list of
+# the declared overlaps marked required whose strokes do not cross
+#------------------------------------------------------------------------------
+def checkOverlaps(han):
+    dictPairs = findStrokeIntersections(han)
+
+    setDeclared = set()
+    aryMissing = []
+    for overlap in han.aryOverlaps:
+        iFirst, iSecond = int(overlap.firstStroke)-1, int(overlap.secondStroke)-1
+        key = (min(iFirst, iSecond), max(iFirst, iSecond))
+        setDeclared.add(key)
+        if overlap.required and not key in dictPairs:
+            aryMissing.append(overlap)
+
+    aryUndeclared = [ (iFirst+1, iSecond+1, aryPoints) for (iFirst, iSecond), aryPoints in sorted(dictPairs.iteritems()) if not (iFirst, iSecond) in setDeclared ]
+    return aryUndeclared, aryMissing
+
+if __name__ == '__main__':
+    # Ensure the sweep finds the same intersecting pairs as testing every pair of segments
+    def crosses(pt1, pt2, pt3, pt4):
+        def orient(a, b, c):
+            v = ((b[0] - a[0]) * (c[1] - a[1])) - ((b[1] - a[1]) * (c[0] - a[0]))
+            return (v > 0) - (v < 0)
+        def within(a, b, c):
+            return min(a[0], b[0]) <= c[0] <= max(a[0], b[0]) and min(a[1], b[1]) <= c[1] <= max(a[1], b[1])
+        o1, o2, o3, o4 = orient(pt1, pt2, pt3), orient(pt1, pt2, pt4), orient(pt3, pt4, pt1), orient(pt3, pt4, pt2)
+        if o1 != o2 and o3 != o4:
+            return True
+        return ((o1 == 0 and within(pt1, pt2, pt3)) or (o2 == 0 and within(pt1, pt2, pt4)) or
+                (o3 == 0 and within(pt3, pt4, pt1)) or (o4 == 0 and within(pt3, pt4, pt2)))
+
+    random.seed(1)
+    for i in xrange(300):
+        nRange = random.choice([ 5, 20, 500 ])
+        aryPolylines = [ [ Genome.Point(x=random.randint(0, nRange), y=random.randint(0, nRange)) for k in xrange(random.randint(2, 5)) ] for j in xrange(random.randint(1, 12)) ]
+        setExpected = set()
+        for j1 in xrange(len(aryPolylines)):
+            for j2 in xrange(j1+1, len(aryPolylines)):
+                for k1 in xrange(1, len(aryPolylines[j1])):
+                    for k2 in xrange(1, len(aryPolylines[j2])):
+                        a = aryPolylines[j1]
+                        b = aryPolylines[j2]
+                        if crosses((a[k1-1].x, a[k1-1].y), (a[k1].x, a[k1].y), (b[k2-1].x, b[k2-1].y), (b[k2].x, b[k2].y)):
+                            setExpected.add((j1, j2))
+        assert(set(findIntersections(aryPolylines).keys()) == setExpected)
@@ -0,0 +1,353 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# Stylus, Copyright 2006-2008 Biologic Institute
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+'''
+replay.py
+
+Apply and invert recorded mutations to reconstruct related genomes.
+
+Bases are held in a rope: a treap (ordered by position, balanced by random
+priority) of short pieces, each node recording the number of bases beneath
+it. Inserting, deleting, or extracting bases splits and rejoins the treap
+in O(log n) time, independent of genome length. Undoing the accepted
+mutations of a genome, newest first, yields its ancestors.
+
+Stylus, Copyright 2006-2008 Biologic Institute.
+'''
+
+import random
+
+import genome as Genome
+
+#==============================================================================
+# Global Constants
+#==============================================================================
+class Constants:
+    # Longest piece stored within a single node (bounding the cost of splitting one)
+    cbPiece = 1024
+
+#==============================================================================
+# Classes
+#==============================================================================
+#------------------------------------------------------------------------------
+# Class: ReplayError
+#
+#------------------------------------------------------------------------------
+class ReplayError(Exception):
+    def __init__(self, msg):
+        self.msg = ''
+        if msg and len(msg) > 0:
+            self.msg = 'Error: ' + msg
+
+    def __str__(self):
+        return self.msg
+
+#------------------------------------------------------------------------------
+# Class: _Node
+#
+#------------------------------------------------------------------------------
+class _Node(object):
+    __slots__ = [ 'piece', 'priority', 'left', 'right', 'size' ]
+
+    def __init__(self, piece, priority=None, left=None, right=None):
+        self.piece = piece
+        if priority is None:
+            priority = random.random()
+        self.priority = priority
+        self.left = left
+        self.right = right
+        _update(self)
+        return
+
+def _size(node):
+    return node and node.size or 0
+
+def _update(node):
+    node.size = len(node.piece) + _size(node.left) + _size(node.right)
+    return
+
+def _merge(nodeLeft, nodeRight):
+    if not nodeLeft: return nodeRight
+    if not nodeRight: return nodeLeft
+    if nodeLeft.priority >= nodeRight.priority:
+        nodeLeft.right = _merge(nodeLeft.right, nodeRight)
+        _update(nodeLeft)
+        return nodeLeft
+    else:
+        nodeRight.left = _merge(nodeLeft, nodeRight.left)
+        _update(nodeRight)
+        return nodeRight
+
+#------------------------------------------------------------------------------
+# Function: _split
+#
+# Split a treap into one holding the first cBases bases and one holding the
+# rest. A piece straddling the split becomes two nodes sharing its priority,
+# which keeps both halves valid treaps.
+#------------------------------------------------------------------------------
+def _split(node, cBases):
+    if not node:
+        return None, None
+
+    cLeft = _size(node.left)
+    if cBases <= cLeft:
+        nodeLeft, nodeRight = _split(node.left, cBases)
+        node.left = nodeRight
+        _update(node)
+        return nodeLeft, node
+
+    cBases -= cLeft
+    if cBases >= len(node.piece):
+        nodeLeft, nodeRight = _split(node.right, cBases - len(node.piece))
+        node.right = nodeLeft
+        _update(node)
+        return node, nodeRight
+
+    nodeRight = _Node(node.piece[cBases:], node.priority, None, node.right)
+    node.piece = node.piece[:cBases]
+    node.right = None
+    _update(node)
+    return node, nodeRight
+
+def _build(strBases):
+    node = None
+    for i in xrange(0, len(strBases), Constants.cbPiece):
+        node = _merge(node, _Node(strBases[i:i+Constants.cbPiece]))
+    return node
+
+#------------------------------------------------------------------------------
+# Class: Rope
+#
+# Notes:
+# - Like mutations, all indexes are 1-based; inserting at an index places the
+#   new bases before the base currently at that index (inserting at one past
+#   the last base appends)
+#------------------------------------------------------------------------------
+class Rope(object):
+    def __init__(self, strBases=''):
+        self.__root = _build(strBases)
+        return
+
+    def __len__(self):
+        return _size(self.__root)
+
+    def __str__(self):
+        aryPieces = []
+        aryStack = []
+        node = self.__root
+        while aryStack or node:
+            if node:
+                aryStack.append(node)
+                node = node.left
+            else:
+                node = aryStack.pop()
+                aryPieces.append(node.piece)
+                node = node.right
+        return ''.join(aryPieces)
+
+    def __validate(self, baseIndex, cBases, fInsert=False):
+        cMax = len(self) + (fInsert and 1 or 0)
+        if baseIndex < 1 or cBases < 0 or (baseIndex + (not fInsert and cBases or 0) - 1) > cMax or baseIndex > cMax:
+            raise ReplayError('Index %d (%d bases) lies outside the %d bases held' % (baseIndex, cBases, len(self)))
+        return
+
+    def get(self, baseIndex, cBases):
+        self.__validate(baseIndex, cBases)
+        nodeLeft, nodeRight = _split(self.__root, baseIndex-1)
+        nodeMiddle, nodeRight = _split(nodeRight, cBases)
+        strBases = str(Rope.__wrap(nodeMiddle))
+        self.__root = _merge(_merge(nodeLeft, nodeMiddle), nodeRight)
+        return strBases
+
+    def insert(self, baseIndex, strBases):
+        self.__validate(baseIndex, len(strBases), True)
+        nodeLeft, nodeRight = _split(self.__root, baseIndex-1)
+        self.__root = _merge(_merge(nodeLeft, _build(strBases)), nodeRight)
+        return
+
+    def delete(self, baseIndex, cBases):
+        self.__validate(baseIndex, cBases)
+        nodeLeft, nodeRight = _split(self.__root, baseIndex-1)
+        nodeMiddle, nodeRight = _split(nodeRight, cBases)
+        self.__root = _merge(nodeLeft, nodeRight)
+        return str(Rope.__wrap(nodeMiddle))
+
+    def replace(self, baseIndex, strBases):
+        strReplaced = self.delete(baseIndex, len(strBases))
+        self.insert(baseIndex, strBases)
+        return strReplaced
+
+    def __wrap(node):
+        rope = Rope()
+        rope.__root = node
+        return rope
+    __wrap = staticmethod(__wrap)
+
+#------------------------------------------------------------------------------
+# Class: Replay
+#
+# Apply mutations to (or remove them from) a sequence of bases.
+#
+# Notes:
+# - Changed replaces the bases at the target with basesAfter; copied inserts
+#   the bases at the source before the target; deleted removes bases at the
+#   target; inserted places bases before the target; transposed removes the
+#   bases at the source and inserts them before the base that occupied the
+#   target (that is, at target - countBases when the target follows the
+#   source)
+# - When validating (the default), the bases a mutation records must match
+#   those found, catching logs applied to the wrong genome or out of order
+#------------------------------------------------------------------------------
+class Replay(object):
+    def __init__(self, strBases, fValidate=True):
+        self.rope = Rope(strBases)
+        self.fValidate = fValidate
+        return
+
+    def __getBases(self):
+        return str(self.rope)
+    bases = property(__getBases)
+
+    def __check(self, mutation, strExpected, strFound):
+        if self.fValidate and strExpected is not None and strExpected != strFound:
+            raise ReplayError('%s does not match the bases found (%s)' % (str(mutation), strFound))
+        return
+
+    def __require(self, mutation, strBases):
+        if strBases is None:
+            raise ReplayError('%s does not record the bases it requires' % str(mutation))
+        return strBases
+
+    def __transposedTarget(self, mutation):
+        if mutation.targetIndex > mutation.sourceIndex:
+            return mutation.targetIndex - mutation.countBases
+        return mutation.targetIndex
+
+    def apply(self, mutation):
+        if mutation.tag == 'changed':
+            strBases = self.__require(mutation, mutation.basesAfter)
+            self.__check(mutation, mutation.bases, self.rope.replace(mutation.targetIndex, strBases))
+        elif mutation.tag == 'copied':
+            strBases = self.rope.get(mutation.sourceIndex, mutation.countBases)
+            self.__check(mutation, mutation.bases, strBases)
+            self.rope.insert(mutation.targetIndex, strBases)
+        elif mutation.tag == 'deleted':
+            self.__check(mutation, mutation.bases, self.rope.delete(mutation.targetIndex, mutation.countBases))
+        elif mutation.tag == 'inserted':
+            self.rope.insert(mutation.targetIndex, self.__require(mutation, mutation.bases))
+        elif mutation.tag == 'transposed':
+            strBases = self.rope.delete(mutation.sourceIndex, mutation.countBases)
+            self.__check(mutation, mutation.bases, strBases)
+            self.rope.insert(self.__transposedTarget(mutation), strBases)
+        else:
+            raise ReplayError('Unknown mutation %s' % mutation.tag)
+        return
+
+    def invert(self, mutation):
+        if mutation.tag == 'changed':
+            strBases = self.__require(mutation, mutation.bases)
+            self.__check(mutation, mutation.basesAfter, self.rope.replace(mutation.targetIndex, strBases))
+        elif mutation.tag == 'copied' or mutation.tag == 'inserted':
+            self.__check(mutation, mutation.bases, self.rope.delete(mutation.targetIndex, mutation.countBases))
+        elif mutation.tag == 'deleted':
+            self.rope.insert(mutation.targetIndex, self.__require(mutation, mutation.bases))
+        elif mutation.tag == 'transposed':
+            strBases = self.rope.delete(self.__transposedTarget(mutation), mutation.countBases)
+            self.__check(mutation, mutation.bases, strBases)
+            self.rope.insert(mutation.sourceIndex, strBases)
+        else:
+            raise ReplayError('Unknown mutation %s' % mutation.tag)
+        return
+
+    def applyAll(self, aryMutations):
+        for mutation in aryMutations:
+            self.apply(mutation)
+        return
+
+    #--------------------------------------------------------------------------
+    # Function: invertAll
+    #
+    # Remove a sequence of mutations (given in the order applied), newest first
+    #--------------------------------------------------------------------------
+    def invertAll(self, aryMutations):
+        for mutation in reversed(list(aryMutations)):
+            self.invert(mutation)
+        return
+
+#------------------------------------------------------------------------------
+# Function: reconstructAncestor
+#
+# Return the bases of a genome before its last cUndo accepted mutations (or
+# before all of them, if cUndo is None). Mutations are streamed from the
+# lineage; the rest of the genome is not parsed.
+#------------------------------------------------------------------------------
+def reconstructAncestor(genome, cUndo=None, fValidate=True):
+    if not isinstance(genome, Genome.Genome):
+        genome = Genome.Genome(genome)
+    aryMutations = list(genome.iterAcceptedMutations())
+    if cUndo is not None:
+        aryMutations = cUndo > 0 and aryMutations[-cUndo:] or []
+    replay = Replay(genome.bases, fValidate)
+    replay.invertAll(aryMutations)
+    return replay.bases
+
+if __name__ == '__main__':
+    # Ensure random mutations, applied and then inverted, restore the original bases
+    random.seed(1)
+    Constants.cbPiece = 7
+    strBases = ''.join([ random.choice('TCAG') for i in xrange(500) ])
+    replay = Replay(strBases)
+    aryBases = list(strBases)
+    aryMutations = []
+    for i in xrange(400):
+        tag = random.choice(Genome.Mutation.tags)
+        cBases = random.randint(1, 9)
+        if len(aryBases) < cBases + 1:
+            tag = 'inserted'
+        dictMutation = { 'countBases' : cBases }
+        if tag in ('changed', 'deleted', 'copied', 'transposed'):
+            iTarget = random.randint(1, len(aryBases) - cBases + 1)
+            dictMutation['bases'] = ''.join(aryBases[iTarget-1:iTarget-1+cBases])
+        if tag == 'changed':
+            dictMutation['targetIndex'] = iTarget
+            dictMutation['basesAfter'] = ''.join([ random.choice('TCAG') for j in xrange(cBases) ])
+            aryBases[iTarget-1:iTarget-1+cBases] = list(dictMutation['basesAfter'])
+        elif tag == 'deleted':
+            dictMutation['targetIndex'] = iTarget
+            del aryBases[iTarget-1:iTarget-1+cBases]
+        elif tag == 'copied':
+            dictMutation['sourceIndex'] = iTarget
+            dictMutation['targetIndex'] = random.randint(1, len(aryBases) + 1)
+            aryBases[dictMutation['targetIndex']-1:dictMutation['targetIndex']-1] = list(dictMutation['bases'])
+        elif tag == 'inserted':
+            dictMutation['targetIndex'] = random.randint(1, len(aryBases) + 1)
+            dictMutation['bases'] = ''.join([ random.choice('TCAG') for j in xrange(cBases) ])
+            aryBases[dictMutation['targetIndex']-1:dictMutation['targetIndex']-1] = list(dictMutation['bases'])
+        elif tag == 'transposed':
+            iSource = iTarget
+            iTarget = random.choice([ j for j in xrange(1, len(aryBases) + 2) if j <= iSource or j >= iSource + cBases ])
+            dictMutation['sourceIndex'] = iSource
+            dictMutation['targetIndex'] = iTarget
+            aryMoved = aryBases[iSource-1:iSource-1+cBases]
+            del aryBases[iSource-1:iSource-1+cBases]
+            iInsert = iTarget > iSource and iTarget - cBases or iTarget
+            aryBases[iInsert-1:iInsert-1] = aryMoved
+        mutation = Genome.Mutation(tag, dictMutation)
+        replay.apply(mutation)
+        aryMutations.append(mutation)
+        assert(replay.bases == ''.join(aryBases))
+    replay.invertAll(aryMutations)
+    assert(replay.bases == strBases)
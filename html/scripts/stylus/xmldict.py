@@ -20,7 +20,10 @@ xmldict.py
 Stylus, Copyright 2006-2008 Biologic Institute.
 '''
 
+import fetch as Fetch
+import multiprocessing
 import os
+import pyexpat
 import shutil
 import sys
 import time
@@ -33,6 +36,26 @@ class XMLDictError(Exception):
     def __init__(self, msg='Internal Error'):
         self.msg = 'Error: ' + msg + '\n'
 
+#------------------------------------------------------------------------------
+# Class: _StopParsing
+# 
+# Raised from within the parser handlers to end parsing once the stopAfter
+# option is satisfied
+#------------------------------------------------------------------------------
+class _StopParsing(Exception):
+    pass
+
+def _toBool(str):
+    return str == 'true'
+
+def _toIntList(str):
+    return [ int(s) for s in str.split() ]
+
+def _convert(fnType, tag, name, value):
+    try: return fnType(value)
+    except (TypeError, ValueError):
+        raise XMLDictError('%s within %s holds an invalid value (%s)' % (name == XMLDict.value and 'The text' or ('The %s attribute' % name), tag, value))
+
 class XMLDict(object):
     '''
     This class loads XML data (from strings or files) converting the XML into a hierarchy of ordered
@@ -47,16 +70,47 @@ class XMLDict(object):
         XMLDict.toList - Store child elements as an ordered list of tuples with the form (tag, dict) accessible
                         under the key of XMLDict.children (required for elements that may have repeating content)
         XMLDict.ignore - Do not include listed elements or their descendents
+        XMLDict.backend - The parser to use: XMLDict.backendExpat (the default), which drives pyexpat
+                        directly, or XMLDict.backendSAX, which uses the generic xml.sax handler
+        XMLDict.types - A dictionary mapping element names to dictionaries that map attribute names (or
+                        XMLDict.value, for textual content) to the type into which to convert the value as
+                        it is parsed (e.g., XMLDict.typeFloat); values of other attributes remain strings
+        XMLDict.factories - A dictionary mapping element names to functions that, given the completed
+                        dictionary of an element, return an object to store in its place
+        XMLDict.stopAfter - Either a list of element names or a function; parsing stops, and no more of
+                        the document is read, once an element with a listed name ends or the function,
+                        called with the path of each element (e.g., /genome/bases) and True as it ends
+                        (False as it starts), returns True; the document parsed so far is returned
+
+    Both backends produce the same dictionaries, save that the expat backend interns element and
+    attribute names (as byte strings) and discards text within ignored elements.
 
     '''
-    __scheme_FILE = 'file://'
-    
     toList = 'toList'
     ignore = 'ignore'
+    backend = 'backend'
+
+    types = 'types'
+    factories = 'factories'
+    stopAfter = 'stopAfter'
+
+    backendExpat = 'expat'
+    backendSAX = 'sax'
+
+    typeFloat = float
+    typeInt = int
+    typeBool = staticmethod(_toBool)
+    typeIntList = staticmethod(_toIntList)
 
     value = ':value'
     children = ':children'
 
+    # Bytes read at once when streaming files (see iterload)
+    cbChunk = 65536
+
+    # Batches of documents given each worker when loading in parallel (see loadMany)
+    batchesPerWorker = 4
+
     class __SAXHandler(xml.sax.handler.ContentHandler):
         def __init__(self, dictDocument, dictOptions = {}):
             self.__dictDocument = dictDocument
@@ -65,6 +119,7 @@ class XMLDict(object):
             self.__stack = []
             self.__text = ''
             self.__cPruning = 0
+            self.__fnStop = _toStopFunction(dictOptions[XMLDict.stopAfter])
             return
 
         def startDocument(self):
@@ -82,6 +137,12 @@ class XMLDict(object):
             if not self.__cPruning:
                 dictParent = self.__stack[-1]
                 dictElement = dict(attrs.items())
+
+                dictTypes = self.__dictOptions[XMLDict.types].get(tag)
+                if dictTypes:
+                    for name in dictElement:
+                        if name in dictTypes:
+                            dictElement[name] = _convert(dictTypes[name], tag, name, dictElement[name])
                 
                 if tag in self.__dictOptions[XMLDict.toList]:
                     dictElement[XMLDict.children] = []
@@ -93,18 +154,32 @@ class XMLDict(object):
 
                 self.__stack.append(dictElement)
                 self.__path += '/' + tag
+
+                if self.__fnStop and self.__fnStop(self.__path, False):
+                    raise _StopParsing()
             return
 
         def endElement(self, tag):
             if not self.__cPruning:
                 self.__text = self.__text.strip()
                 if self.__text:
-                    self.__stack[-1][XMLDict.value] = self.__text
+                    dictTypes = self.__dictOptions[XMLDict.types].get(tag)
+                    if dictTypes and XMLDict.value in dictTypes:
+                        self.__stack[-1][XMLDict.value] = _convert(dictTypes[XMLDict.value], tag, XMLDict.value, self.__text)
+                    else:
+                        self.__stack[-1][XMLDict.value] = self.__text
                     self.__text = ''
+                fStop = self.__fnStop and self.__fnStop(self.__path, True)
                 i = self.__path.rfind('/')
                 if i >= 0:
                     self.__path = self.__path[:i]
-                self.__stack.pop()
+                dictElement = self.__stack.pop()
+
+                if tag in self.__dictOptions[XMLDict.factories]:
+                    _replaceElement(self.__stack[-1], tag, self.__dictOptions[XMLDict.factories][tag](dictElement))
+
+                if fStop:
+                    raise _StopParsing()
                 
             elif tag in self.__dictOptions[XMLDict.ignore]:
                 self.__cPruning -= 1
@@ -113,6 +188,122 @@ class XMLDict(object):
         def characters(self, str):
             self.__text += str.encode('utf-8')
             return
+
+    #--------------------------------------------------------------------------
+    # Function: __createExpatParser
+    # 
+    # Return a pyexpat parser that fills dictDocument
+    #
+    # Notes:
+    # - The path of the current element is tracked only when needed (to yield
+    #   elements or to call a stopAfter function)
+    # - When given setYield, each element with a listed tag is, once it ends,
+    #   detached from its parent and appended (with its path) to aryYielded
+    #   (see iterload)
+    # - Text is collected as a list of pieces and joined once, when its
+    #   element ends, rather than concatenated piece by piece
+    # - Names arrive as unicode; each is converted to an interned byte string
+    #   once and remembered, so repeated names share one key object
+    # - The handlers are closures over local state, avoiding attribute lookups
+    #   on every call
+    #--------------------------------------------------------------------------
+    def __createExpatParser(dictDocument, dictOptions, setYield=None, aryYielded=None):
+        aryStack = [ dictDocument ]
+        aryPath = []
+        aryText = []
+        aryPruning = [ 0 ]
+        dictNames = {}
+        setToList = set(dictOptions[XMLDict.toList])
+        setIgnore = set(dictOptions[XMLDict.ignore])
+        dictAllTypes = dictOptions[XMLDict.types]
+        dictFactories = dictOptions[XMLDict.factories]
+        fnStop = _toStopFunction(dictOptions[XMLDict.stopAfter])
+        fPath = setYield or fnStop
+        children = XMLDict.children
+        value = XMLDict.value
+
+        def toName(name):
+            try: return dictNames[name]
+            except KeyError:
+                strName = intern(name.encode('utf-8'))
+                dictNames[name] = strName
+                return strName
+
+        def startElement(tag, attrs):
+            if aryPruning[0] or tag in setIgnore:
+                aryPruning[0] += 1
+                return
+
+            tag = toName(tag)
+            dictElement = {}
+            dictTypes = dictAllTypes.get(tag)
+            if dictTypes:
+                for i in xrange(0, len(attrs), 2):
+                    name = toName(attrs[i])
+                    if name in dictTypes:
+                        dictElement[name] = _convert(dictTypes[name], tag, name, attrs[i+1])
+                    else:
+                        dictElement[name] = attrs[i+1]
+            else:
+                for i in xrange(0, len(attrs), 2):
+                    dictElement[toName(attrs[i])] = attrs[i+1]
+
+            if tag in setToList:
+                dictElement[children] = []
+
+            dictParent = aryStack[-1]
+            if children in dictParent:
+                dictParent[children].append((tag, dictElement))
+            else:
+                dictParent[tag] = dictElement
+            aryStack.append(dictElement)
+            if fPath:
+                aryPath.append(tag)
+                if fnStop and fnStop('/' + '/'.join(aryPath), False):
+                    raise _StopParsing()
+
+        def endElement(tag):
+            if aryPruning[0]:
+                aryPruning[0] -= 1
+                return
+
+            tag = toName(tag)
+            if aryText:
+                strText = u''.join(aryText).strip()
+                del aryText[:]
+                if strText:
+                    strText = strText.encode('utf-8')
+                    dictTypes = dictAllTypes.get(tag)
+                    if dictTypes and value in dictTypes:
+                        strText = _convert(dictTypes[value], tag, value, strText)
+                    aryStack[-1][value] = strText
+            dictElement = aryStack.pop()
+
+            if tag in dictFactories:
+                dictElement = dictFactories[tag](dictElement)
+                _replaceElement(aryStack[-1], tag, dictElement)
+
+            if fPath:
+                strPath = '/' + '/'.join(aryPath)
+                if setYield and tag in setYield:
+                    aryYielded.append((strPath, dictElement))
+                    _removeElement(aryStack[-1], tag)
+                aryPath.pop()
+                if fnStop and fnStop(strPath, True):
+                    raise _StopParsing()
+
+        def characters(str):
+            if not aryPruning[0]:
+                aryText.append(str)
+
+        parser = pyexpat.ParserCreate()
+        parser.ordered_attributes = True
+        parser.buffer_text = True
+        parser.StartElementHandler = startElement
+        parser.EndElementHandler = endElement
+        parser.CharacterDataHandler = characters
+        return parser
+    __createExpatParser = staticmethod(__createExpatParser)
     
     def __init__(self, dictOptions={}):
         self.__dictOptions = dict(dictOptions)
@@ -120,19 +311,24 @@ class XMLDict(object):
             self.__dictOptions[XMLDict.toList] = []
         if not XMLDict.ignore in self.__dictOptions:
             self.__dictOptions[XMLDict.ignore] = []
+        if not XMLDict.types in self.__dictOptions:
+            self.__dictOptions[XMLDict.types] = {}
+        if not XMLDict.factories in self.__dictOptions:
+            self.__dictOptions[XMLDict.factories] = {}
+        if not XMLDict.stopAfter in self.__dictOptions:
+            self.__dictOptions[XMLDict.stopAfter] = None
+        if not XMLDict.backend in self.__dictOptions:
+            self.__dictOptions[XMLDict.backend] = XMLDict.backendExpat
+        if not self.__dictOptions[XMLDict.backend] in (XMLDict.backendExpat, XMLDict.backendSAX):
+            raise XMLDictError('%s is not a known XMLDict backend' % self.__dictOptions[XMLDict.backend])
         return
 
     def __openFile(strPath):
-        if strPath[0] == '.':
-            strPath = os.getcwd() + strPath[1:]
-        else:
-            strPath = os.path.expanduser(strPath)
-        if os.path.isabs(strPath):
-            strPath = urlparse.urljoin(XMLDict.__scheme_FILE, strPath)
+        strPath = Fetch.pathToURL(strPath)
         aryURL = urlparse.urlsplit(strPath)
         if not aryURL[0].lower() in ('http', 'https', 'file', 'ftp', 'gopher'):
             raise XMLDictError(strPath + ' contains an unknown URL scheme')
-        return urllib2.urlopen(strPath)
+        return Fetch.openURL(strPath)
     __openFile = staticmethod(__openFile)
         
     def load(self, strPath):
@@ -140,17 +336,254 @@ class XMLDict(object):
             raise XMLDictError('load was not supplied with a path or URL for the file')
         fileXML = XMLDict.__openFile(strPath)
         dictDocument = {}
-        saxHandler = XMLDict.__SAXHandler(dictDocument, self.__dictOptions)
-        xml.sax.parse(fileXML, saxHandler)
+        if self.__dictOptions[XMLDict.backend] == XMLDict.backendSAX:
+            saxHandler = XMLDict.__SAXHandler(dictDocument, self.__dictOptions)
+            try: xml.sax.parse(fileXML, saxHandler)
+            except _StopParsing: fileXML.close()
+        else:
+            try:
+                try: XMLDict.__createExpatParser(dictDocument, self.__dictOptions).ParseFile(fileXML)
+                except pyexpat.ExpatError, err: raise XMLDictError('Unable to parse %s - %s' % (strPath, str(err)))
+                except _StopParsing: pass
+            finally:
+                fileXML.close()
         return dictDocument
         
     def loads(self, strXML):
         if not strXML:
             raise XMLDictError('loads was not supplied with an XML string')
         dictDocument = {}
-        saxHandler = XMLDict.__SAXHandler(dictDocument, self.__dictOptions)
-        xml.sax.parseString(strXML, saxHandler)
+        if self.__dictOptions[XMLDict.backend] == XMLDict.backendSAX:
+            saxHandler = XMLDict.__SAXHandler(dictDocument, self.__dictOptions)
+            try: xml.sax.parseString(strXML, saxHandler)
+            except _StopParsing: pass
+        else:
+            try: XMLDict.__createExpatParser(dictDocument, self.__dictOptions).Parse(strXML, True)
+            except pyexpat.ExpatError, err: raise XMLDictError('Unable to parse XML - %s' % str(err))
+            except _StopParsing: pass
         return dictDocument
 
+    #--------------------------------------------------------------------------
+    # Function: iterload
+    # 
+    # Yield (path, dictionary) pairs for each element whose tag is listed in
+    # aryTags, as the element ends, from the file at strPath (see iterloads)
+    #--------------------------------------------------------------------------
+    def iterload(self, strPath, aryTags):
+        if not strPath:
+            raise XMLDictError('iterload was not supplied with a path or URL for the file')
+        fileXML = XMLDict.__openFile(strPath)
+        try:
+            for item in self.__iterParse(iter(lambda: fileXML.read(XMLDict.cbChunk), ''), aryTags, strPath):
+                yield item
+        finally:
+            fileXML.close()
+
+    #--------------------------------------------------------------------------
+    # Function: iterloads
+    # 
+    # Yield (path, dictionary) pairs for each element whose tag is listed in
+    # aryTags, as the element ends, from an XML string or an iterable of
+    # strings holding successive pieces of the document
+    #
+    # Notes:
+    # - Paths list the tags from the root to the element (e.g., /genome/bases)
+    # - Yielded elements are detached from the document, so memory does not
+    #   grow with their number; the elements enclosing them, and any others
+    #   not ignored, are still retained until the document ends
+    # - An element listed within another yields first and is absent from the
+    #   enclosing element
+    # - Parsing always uses pyexpat, whichever backend the options select
+    #--------------------------------------------------------------------------
+    def iterloads(self, strXML, aryTags):
+        if not strXML:
+            raise XMLDictError('iterloads was not supplied with an XML string')
+        if isinstance(strXML, basestring):
+            strXML = [ strXML ]
+        return self.__iterParse(strXML, aryTags, None)
+
+    def __iterParse(self, iterChunks, aryTags, strPath):
+        aryYielded = []
+        parser = XMLDict.__createExpatParser({}, self.__dictOptions, set(aryTags), aryYielded)
+        try:
+            for strChunk in iterChunks:
+                parser.Parse(strChunk, False)
+                for item in aryYielded:
+                    yield item
+                del aryYielded[:]
+            parser.Parse('', True)
+        except pyexpat.ExpatError, err:
+            raise XMLDictError('Unable to parse %s - %s' % (strPath or 'XML', str(err)))
+        except _StopParsing:
+            pass
+        for item in aryYielded:
+            yield item
+
+#------------------------------------------------------------------------------
+# Function: _toStopFunction
+# 
+# Return the stopAfter option as a function of an element path and whether
+# the element is ending (or None if parsing should not stop early)
+#------------------------------------------------------------------------------
+def _toStopFunction(stopAfter):
+    if not stopAfter or callable(stopAfter):
+        return stopAfter
+    setNames = set(stopAfter)
+    return lambda strPath, fEnd: fEnd and strPath[strPath.rfind('/')+1:] in setNames
+
+#------------------------------------------------------------------------------
+# Function: _removeElement
+# 
+# Remove the most recently completed child element of a parent
+#------------------------------------------------------------------------------
+def _removeElement(dictParent, tag):
+    if XMLDict.children in dictParent:
+        dictParent[XMLDict.children].pop()
+    else:
+        del dictParent[tag]
+    return
+
+#------------------------------------------------------------------------------
+# Function: _replaceElement
+# 
+# Replace the most recently completed child element of a parent with an
+# object (the element, having just ended, is the last child of its parent)
+#------------------------------------------------------------------------------
+def _replaceElement(dictParent, tag, obj):
+    if XMLDict.children in dictParent:
+        dictParent[XMLDict.children][-1] = (tag, obj)
+    else:
+        dictParent[tag] = obj
+    return
+
+#------------------------------------------------------------------------------
+# Function: loadMany
+# 
+# Load many XML documents (paths or URLs) using a pool of worker processes,
+# yielding (url, dictDocument, err) for each; documents that fail to load
+# yield None and the XMLDictError describing the failure rather than ending
+# the batch. Results are yielded in the order of urls or, if fOrdered is
+# False, as each completes.
+#
+# Notes:
+# - Documents are handed to workers in batches of roughly equal total size
+#   (see _makeBatches), largest first, so a few large files do not leave
+#   the other workers idle at the end
+# - Workers are forked and receive the options when they start, so options
+#   holding functions (e.g., factories) need not be picklable; the objects
+#   factories return must be
+# - With workers of 1 (or a single document), documents load in this process
+#------------------------------------------------------------------------------
+def loadMany(urls, dictOptions={}, workers=None, fOrdered=True):
+    urls = list(urls)
+    workers = workers or multiprocessing.cpu_count()
+    if workers <= 1 or len(urls) <= 1:
+        _initWorker(dictOptions)
+        for i, url in enumerate(urls):
+            yield _toResult(_loadWorker(i, url))
+        return
+
+    aryBatches = _makeBatches(urls, workers * XMLDict.batchesPerWorker)
+    pool = multiprocessing.Pool(min(workers, len(aryBatches)), _initWorker, (dictOptions,))
+    fComplete = False
+    try:
+        dictPending = {}
+        iNext = 0
+        for aryResults in pool.imap_unordered(_loadBatch, aryBatches):
+            if not fOrdered:
+                for result in aryResults:
+                    yield _toResult(result)
+                continue
+            for result in aryResults:
+                dictPending[result[0]] = result
+            while iNext in dictPending:
+                yield _toResult(dictPending.pop(iNext))
+                iNext += 1
+        fComplete = True
+    finally:
+        if fComplete:
+            pool.close()
+        else:
+            pool.terminate()
+        pool.join()
+
+#------------------------------------------------------------------------------
+# Function: _makeBatches
+# 
+# Divide the urls into roughly cBatches lists of (index, url), each holding
+# about the same number of bytes (and no more than its share of the urls, so
+# one very large file does not sweep the rest into a single batch), ordered
+# largest first. Files whose size cannot be learned (e.g., http URLs) count
+# as the average size.
+#------------------------------------------------------------------------------
+def _makeBatches(urls, cBatches):
+    arySizes = []
+    for url in urls:
+        aryURL = urlparse.urlsplit(url)
+        try:
+            if aryURL[0].lower() == 'file':
+                arySizes.append(os.path.getsize(urllib2.url2pathname(aryURL[2])))
+            elif not aryURL[0]:
+                arySizes.append(os.path.getsize(os.path.expanduser(url)))
+            else:
+                arySizes.append(None)
+        except OSError:
+            arySizes.append(None)
+
+    aryKnown = [ cb for cb in arySizes if cb is not None ]
+    cbAverage = aryKnown and (sum(aryKnown) / len(aryKnown)) or 1
+    arySizes = [ max(cb is None and cbAverage or cb, 1) for cb in arySizes ]
+    cbBatch = max(sum(arySizes) / cBatches, 1)
+    cMaxBatch = max((len(urls) + cBatches - 1) / cBatches, 1)
+
+    aryBatches = []
+    aryBatch = []
+    cbCurrent = 0
+    for cb, i in sorted([ (cb, i) for i, cb in enumerate(arySizes) ], reverse=True):
+        aryBatch.append((i, urls[i]))
+        cbCurrent += cb
+        if cbCurrent >= cbBatch or len(aryBatch) >= cMaxBatch:
+            aryBatches.append(aryBatch)
+            aryBatch = []
+            cbCurrent = 0
+    if aryBatch:
+        aryBatches.append(aryBatch)
+    return aryBatches
+
+_xmlDictWorker = None
+
+def _initWorker(dictOptions):
+    global _xmlDictWorker
+    _xmlDictWorker = XMLDict(dictOptions)
+    return
+
+def _loadWorker(i, url):
+    try: return (i, url, _xmlDictWorker.load(url), None)
+    except XMLDictError, err: return (i, url, None, err.msg[len('Error: '):])
+    except Exception, err: return (i, url, None, str(err))
+
+def _loadBatch(aryBatch):
+    return [ _loadWorker(i, url) for i, url in aryBatch ]
+
+def _toResult(result):
+    i, url, dictDocument, strError = result
+    return (url, dictDocument, strError and XMLDictError('Unable to load %s - %s' % (url, strError.strip())) or None)
+
 if __name__ == '__main__':
-    pass
+    # Compare the backends on the files given (timing each and ensuring they agree)
+    # e.g., python xmldict.py ~/Archetypes/4000/4E00.han genome.xml
+    dictOptions = { XMLDict.toList : [ 'acceptedMutations', 'rejectedMutations', 'attempt', 'genes', 'hanReferences',
+                                        'groups', 'strokes', 'forward', 'reverse', 'overlaps', 'segments', 'segment' ] }
+    for strPath in sys.argv[1:]:
+        aryResults = []
+        for strBackend in (XMLDict.backendSAX, XMLDict.backendExpat):
+            dictOptions[XMLDict.backend] = strBackend
+            xmlDict = XMLDict(dictOptions)
+            cLoads = 0
+            tmStart = time.time()
+            while cLoads < 3 or (time.time() - tmStart) < 1:
+                dictDocument = xmlDict.load(os.path.abspath(strPath))
+                cLoads += 1
+            aryResults.append(((time.time() - tmStart) / cLoads, dictDocument))
+        assert(aryResults[0][1] == aryResults[1][1])
+        print '%s: sax %.4fs, expat %.4fs (%.1fx)' % (strPath, aryResults[0][0], aryResults[1][0], aryResults[0][0] / aryResults[1][0])